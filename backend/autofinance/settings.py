@@ -35,6 +35,129 @@ ALLOWED_HOSTS = env('ALLOWED_HOSTS').split(',')
 
 GEMINI_API_KEY = env('GEMINI_API_KEY')
 
+# Seconds the async views wait for a Gemini response before giving up, also
+# the read timeout of each HTTP request to Gemini
+GEMINI_TIMEOUT = env.float('GEMINI_TIMEOUT', default=60)
+GEMINI_CONNECT_TIMEOUT = env.float('GEMINI_CONNECT_TIMEOUT', default=5)
+
+# Shared Gemini client (core.llm_client): pooled connections per process,
+# retries with jittered exponential backoff on 429/5xx, and a circuit breaker
+# that fails fast for GEMINI_CIRCUIT_RESET seconds after
+# GEMINI_CIRCUIT_THRESHOLD consecutive upstream failures.
+# GEMINI_BASE_URL overrides the API endpoint, e.g. for a local fake server.
+GEMINI_BASE_URL = env('GEMINI_BASE_URL', default='')
+GEMINI_MAX_CONNECTIONS = env.int('GEMINI_MAX_CONNECTIONS', default=20)
+GEMINI_MAX_RETRIES = env.int('GEMINI_MAX_RETRIES', default=3)
+GEMINI_BACKOFF_BASE = env.float('GEMINI_BACKOFF_BASE', default=0.5)
+GEMINI_BACKOFF_MAX = env.float('GEMINI_BACKOFF_MAX', default=8)
+GEMINI_CIRCUIT_THRESHOLD = env.int('GEMINI_CIRCUIT_THRESHOLD', default=5)
+GEMINI_CIRCUIT_RESET = env.float('GEMINI_CIRCUIT_RESET', default=30)
+
+# LLM backend behind core.llm_client: Gemini, or the deterministic offline fake
+# (core.llm_backends.FakeBackend) for tests and load benchmarks, with its
+# latency distribution (fixed, uniform, normal or lognormal around
+# LLM_FAKE_LATENCY_MS), the share of calls failing with a 429/503 and the share
+# of answers cut off halfway (unparseable)
+LLM_BACKEND = env('LLM_BACKEND', default='core.llm_backends.GeminiBackend')
+LLM_FAKE_LATENCY = env('LLM_FAKE_LATENCY', default='lognormal')
+LLM_FAKE_LATENCY_MS = env.float('LLM_FAKE_LATENCY_MS', default=800)
+LLM_FAKE_LATENCY_SPREAD = env.float('LLM_FAKE_LATENCY_SPREAD', default=0.5)
+LLM_FAKE_ERROR_RATE = env.float('LLM_FAKE_ERROR_RATE', default=0.0)
+LLM_FAKE_MALFORMED_RATE = env.float('LLM_FAKE_MALFORMED_RATE', default=0.0)
+LLM_FAKE_SEED = env.int('LLM_FAKE_SEED', default=0)
+
+# Receipt images sent to Gemini (core.receipt_images): auto-oriented, grayscale,
+# downsampled to RECEIPT_IMAGE_MAX_PIXELS pixels and re-encoded as JPEG of
+# RECEIPT_IMAGE_QUALITY, on a pool of RECEIPT_IMAGE_WORKERS threads (0 = up to 4
+# by CPU count); RECEIPT_IMAGE_PREPROCESS=False sends the uploads unchanged
+RECEIPT_IMAGE_PREPROCESS = env.bool('RECEIPT_IMAGE_PREPROCESS', default=True)
+RECEIPT_IMAGE_MAX_PIXELS = env.int('RECEIPT_IMAGE_MAX_PIXELS', default=2_000_000)
+RECEIPT_IMAGE_QUALITY = env.int('RECEIPT_IMAGE_QUALITY', default=80)
+RECEIPT_IMAGE_WORKERS = env.int('RECEIPT_IMAGE_WORKERS', default=0)
+
+# Receipt cache (core.receipt_cache): a re-uploaded receipt reuses the stored
+# transactions. Each user keeps RECEIPT_CACHE_MAX_ENTRIES receipts (0 disables
+# the cache) and all stored images together stay under RECEIPT_CACHE_MAX_BYTES,
+# least recently used evicted. RECEIPT_CACHE_PHASH_THRESHOLD >= 0 also serves
+# stored receipts whose perceptual hash is within that many bits once their
+# pixels are confirmed to match, flagged as `near_match`; receipts of the same
+# shop are often 0-4 bits apart, so by default (-1) only exact copies are served
+RECEIPT_CACHE_MAX_ENTRIES = env.int('RECEIPT_CACHE_MAX_ENTRIES', default=100)
+RECEIPT_CACHE_MAX_BYTES = env.int('RECEIPT_CACHE_MAX_BYTES', default=500 * 1024 * 1024)
+RECEIPT_CACHE_PHASH_THRESHOLD = env.int('RECEIPT_CACHE_PHASH_THRESHOLD', default=-1)
+
+# Batch receipt upload (core.receipt_batch): at most RECEIPT_BATCH_MAX_IMAGES
+# receipts per request (zips expanded), read RECEIPT_BATCH_CONCURRENCY at a time;
+# a user may spend RECEIPT_BATCH_RATE_LIMIT Gemini calls (cache misses) per
+# RECEIPT_BATCH_RATE_PERIOD seconds on batches (0 = unlimited)
+RECEIPT_BATCH_MAX_IMAGES = env.int('RECEIPT_BATCH_MAX_IMAGES', default=50)
+RECEIPT_BATCH_CONCURRENCY = env.int('RECEIPT_BATCH_CONCURRENCY', default=4)
+RECEIPT_BATCH_RATE_LIMIT = env.int('RECEIPT_BATCH_RATE_LIMIT', default=100)
+RECEIPT_BATCH_RATE_PERIOD = env.int('RECEIPT_BATCH_RATE_PERIOD', default=3600)
+
+# Local category classifier (core.categorizer): stored models are reloaded
+# every CATEGORIZER_REFRESH_SECONDS, writes queue a training job (run by
+# run_jobworker) when CATEGORIZER_TRAIN_ON_WRITE, CATEGORIZER_CACHE_SIZE
+# models stay in memory per process, a guess below CATEGORIZER_MIN_SCORE (cosine)
+# is not used, and a user's own model outweighs the global one past
+# CATEGORIZER_PERSONAL_PRIOR transactions
+CATEGORIZER_REFRESH_SECONDS = env.int('CATEGORIZER_REFRESH_SECONDS', default=300)
+CATEGORIZER_TRAIN_ON_WRITE = env.bool('CATEGORIZER_TRAIN_ON_WRITE', default=True)
+CATEGORIZER_CACHE_SIZE = env.int('CATEGORIZER_CACHE_SIZE', default=256)
+CATEGORIZER_MIN_SCORE = env.float('CATEGORIZER_MIN_SCORE', default=0.1)
+CATEGORIZER_PERSONAL_PRIOR = env.int('CATEGORIZER_PERSONAL_PRIOR', default=20)
+
+# Recurring transaction detection (core.recurring): amounts of one series may
+# step by RECURRING_AMOUNT_TOLERANCE (relative) between sorted values, at least
+# RECURRING_MIN_REGULARITY of the intervals must fit the period, and writes
+# queue a detection job for the months they changed when RECURRING_DETECT_ON_WRITE
+# (run `manage.py detect_recurring` daily to re-detect every series)
+RECURRING_AMOUNT_TOLERANCE = env.float('RECURRING_AMOUNT_TOLERANCE', default=0.2)
+RECURRING_MIN_REGULARITY = env.float('RECURRING_MIN_REGULARITY', default=0.75)
+RECURRING_DETECT_ON_WRITE = env.bool('RECURRING_DETECT_ON_WRITE', default=True)
+
+# Spending anomalies (core.anomalies): flagged at ANOMALY_THRESHOLD robust
+# z-scores (scaled MADs) above the category's usual amount, once a category has
+# ANOMALY_MIN_HISTORY transactions (ANOMALY_MIN_MONTHS months for monthly
+# totals). Saved transactions are scored right away when ANOMALY_SCORE_ON_WRITE,
+# the score_anomalies command recomputes everything (run it nightly)
+ANOMALY_THRESHOLD = env.float('ANOMALY_THRESHOLD', default=3.5)
+ANOMALY_MIN_HISTORY = env.int('ANOMALY_MIN_HISTORY', default=8)
+ANOMALY_MIN_MONTHS = env.int('ANOMALY_MIN_MONTHS', default=4)
+ANOMALY_SCORE_ON_WRITE = env.bool('ANOMALY_SCORE_ON_WRITE', default=True)
+ANOMALY_ANALYSIS_LIMIT = env.int('ANOMALY_ANALYSIS_LIMIT', default=10)
+
+# Month-end forecast (core.forecast): how many past months the daily spending
+# curves are averaged over
+FORECAST_HISTORY_MONTHS = env.int('FORECAST_HISTORY_MONTHS', default=12)
+
+# Trends endpoint (core.trends): months shown when no start is given, and the
+# longest range one request may ask for
+TRENDS_DEFAULT_MONTHS = env.int('TRENDS_DEFAULT_MONTHS', default=12)
+TRENDS_MAX_MONTHS = env.int('TRENDS_MAX_MONTHS', default=120)
+
+# Single-flight coalescing of identical concurrent Gemini calls (core.singleflight):
+# lock files and shared results live in SINGLEFLIGHT_DIR (defaults to a folder
+# in the system temp dir, must be shared by all worker processes), and a caller
+# waits at most SINGLEFLIGHT_LEASE_TIMEOUT seconds for another process's call
+SINGLEFLIGHT_DIR = env('SINGLEFLIGHT_DIR', default='')
+SINGLEFLIGHT_LEASE_TIMEOUT = env.float('SINGLEFLIGHT_LEASE_TIMEOUT', default=120)
+
+# Background jobs (core.jobs, run by `manage.py run_jobworker`): a claimed job
+# is leased for JOB_LEASE_SECONDS, renewed every third of that while it runs (a
+# dead worker's job is claimable again once its lease runs out), failures are
+# retried after JOB_RETRY_BACKOFF * 2**(attempt - 1) seconds (jittered) and a
+# job that failed JOB_MAX_ATTEMPTS times is kept as dead
+JOB_LEASE_SECONDS = env.int('JOB_LEASE_SECONDS', default=600)
+JOB_MAX_ATTEMPTS = env.int('JOB_MAX_ATTEMPTS', default=3)
+JOB_RETRY_BACKOFF = env.float('JOB_RETRY_BACKOFF', default=30)
+JOB_POLL_INTERVAL = env.float('JOB_POLL_INTERVAL', default=1)
+
+# Gemini analysis cache: entries expire after ANALYSIS_CACHE_TTL seconds and each
+# user keeps at most ANALYSIS_CACHE_MAX_ENTRIES (least recently used are evicted)
+ANALYSIS_CACHE_TTL = env.int('ANALYSIS_CACHE_TTL', default=7 * 24 * 3600)
+ANALYSIS_CACHE_MAX_ENTRIES = env.int('ANALYSIS_CACHE_MAX_ENTRIES', default=24)
+
 
 # Application definition
 
@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Transaction, TransactionImage
+from .models import Transaction, TransactionImage, MonthlyCategoryRollup, Job, CategoryModel, RecurringSeries, Anomaly, ForecastCurve, MonthlyStatement
+from . import jobs
 
 # Register your models here.
 
@@ -14,9 +15,66 @@ class TransactionAdmin(admin.ModelAdmin):
 
 @admin.register(TransactionImage)
 class TransactionImageAdmin(admin.ModelAdmin):
-    list_display = ('id', 'image')
-    search_fields = ('image',)
+    list_display = ('id', 'user', 'image', 'size', 'hits', 'last_used_at')
+    search_fields = ('image', 'sha256', 'user__username')
     ordering = ('-id',)
 
+@admin.register(MonthlyCategoryRollup)
+class MonthlyCategoryRollupAdmin(admin.ModelAdmin):
+    list_display = ('user', 'year', 'month', 'category', 'total_amount', 'transaction_count', 'recurring_count')
+    list_filter = ('year', 'category')
+    ordering = ('-year', '-month', 'category')
 
 
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'kind', 'status', 'priority', 'attempts', 'max_attempts', 'created_at', 'finished_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('user__username', 'error')
+    ordering = ('-created_at',)
+    actions = ['retry_dead_jobs']
+
+    @admin.action(description='Retry selected dead jobs')
+    def retry_dead_jobs(self, request, queryset):
+        retried = sum(jobs.retry(job) for job in queryset.filter(status=Job.STATUS_DEAD))
+        self.message_user(request, f'{retried} job(s) queued again.')
+
+
+@admin.register(CategoryModel)
+class CategoryModelAdmin(admin.ModelAdmin):
+    list_display = ('key', 'user', 'examples', 'last_transaction_id', 'feature_version', 'updated_at')
+    search_fields = ('key', 'user__username')
+    exclude = ('weights',)
+    ordering = ('-updated_at',)
+
+
+@admin.register(RecurringSeries)
+class RecurringSeriesAdmin(admin.ModelAdmin):
+    list_display = ('user', 'description', 'period', 'amount', 'occurrences', 'last_date', 'next_date', 'active')
+    list_filter = ('period', 'active')
+    search_fields = ('description', 'user__username')
+    ordering = ('next_date',)
+
+
+@admin.register(Anomaly)
+class AnomalyAdmin(admin.ModelAdmin):
+    list_display = ('user', 'kind', 'category', 'year', 'month', 'amount', 'expected', 'score', 'detected_at')
+    list_filter = ('kind', 'category')
+    search_fields = ('user__username', 'transaction__description')
+    raw_id_fields = ('transaction',)
+    ordering = ('-detected_at',)
+
+
+@admin.register(ForecastCurve)
+class ForecastCurveAdmin(admin.ModelAdmin):
+    list_display = ('user', 'year', 'month', 'created_at')
+    search_fields = ('user__username',)
+    exclude = ('cumulative',)
+    ordering = ('-year', '-month')
+
+
+@admin.register(MonthlyStatement)
+class MonthlyStatementAdmin(admin.ModelAdmin):
+    list_display = ('user', 'year', 'month', 'size', 'data_version', 'renderer_version', 'created_at')
+    search_fields = ('user__username',)
+    ordering = ('-year', '-month')
@@ -1,53 +1,39 @@
-from google import genai
+import asyncio
+import json
+from datetime import date
 
+from . import analytics, llm_client, structured_output
 
-def transaction_analysis(api_key, current_transactions, previous_transactions=None):
-    """
-    Analyzes transactions and provides realistic financial insights with month-over-month comparisons.
-    
-    Args:
-        current_transactions (list): Current month's transaction dictionaries
-        previous_transactions (list, optional): Previous month's transactions for comparison
-        user_income (float, optional): User's monthly income for percentage calculations
-        api_key (str): API key for Gemini AI
-        
-    Returns:
-        dict: Comprehensive financial analysis with actionable insights
-    """
-    
-    # Prepare comparison context
-    comparison_context = ""
-    if previous_transactions:
-        comparison_context = f"PREVIOUS MONTH TRANSACTIONS FOR COMPARISON: {previous_transactions}"
-    
-    
-    try:
-        client = genai.Client(api_key=api_key)
-        response = client.models.generate_content(
-            model="gemini-2.5-flash", 
-            contents=f'''
-            You are a simple financial advisor. Analyze these transactions and give easy-to-understand advice.
+
+ANALYSIS_MODEL = "gemini-2.5-flash"
+# Bump whenever the prompt or the expected response shape changes, cached
+# analyses from an older prompt are then ignored
+ANALYSIS_PROMPT_VERSION = "2"
+
+
+def build_analysis_prompt(summary, period=None):
+    """Builds the Gemini prompt from the local summary (without the financial score)"""
+    prompt_summary = {key: value for key, value in summary.items() if key != 'financial_score'}
+    return f'''
+            You are a simple financial advisor. Analyze this monthly summary and give easy-to-understand advice.
             
             Rules:
             - Keep all text short and simple
-            - Use bullet points with specific dollar amounts
-            - Give actionable tips like "Save $200 this month"
+            - Use bullet points with specific amounts taken from the summary
+            - Give actionable tips like "Save BDT200 this month"
             - Avoid long explanations
             - Use everyday language
             - Currency is Bangladeshi Taka (BDT)
+            - Do not recompute totals, the numbers in the summary are exact
 
-            CURRENT MONTH TRANSACTIONS: {current_transactions}
-            {comparison_context}
+            ANALYSED MONTH: {period or 'not specified'}
+            TODAY: {date.today().isoformat()}
+            MONTH SUMMARY: {json.dumps(prompt_summary, separators=(',', ':'))}
 
             Provide a simple, user-friendly analysis in this exact JSON format. Keep all text short and easy to understand:
             {{
                 "overview": "Brief 1-2 sentence summary of spending period and key insight",
                 
-                "financial_score": {{
-                    "score": 75,
-                    "status": "Good/Fair/Poor"
-                }},
-                
                 "quick_tips": [
                     "Save BDT500 this month",
                     "Reduce food spending by BDT200",
@@ -64,39 +50,80 @@ def transaction_analysis(api_key, current_transactions, previous_transactions=No
                     "Consistent saving pattern"
                 ]
             }}
-            now if the current transactions analysis is not for the actual current month, make sure to give the analysis in past tense.
+            now if the analysed month is not the current month, make sure to give the analysis in past tense.
 
             '''
-        )
+
+
+def parse_analysis_response(response, summary):
+    """Turns the Gemini response into the analysis dict and merges the local metrics"""
+    try:
+        analysis = structured_output.parse(llm_client.TASK_ANALYSIS, response.text)
+    except structured_output.ParseError as e:
+        # Return the raw text along with the reason
+        return {"analysis": response.text, "error": f"Could not parse the analysis: {e}"}
+    analysis['financial_score'] = summary['financial_score']
+    analysis['metrics'] = summary
+    return analysis
+
+
+def transaction_analysis(api_key, current_transactions, previous_transactions=None, period=None):
+    """
+    Analyzes transactions and provides realistic financial insights with month-over-month comparisons.
+
+    Totals, ratios, the month-over-month comparison and the financial score are
+    computed locally by core.analytics; Gemini only receives that compact summary
+    and writes the prose fields.
+    
+    Args:
+        current_transactions (list): Current month's transaction dictionaries
+        previous_transactions (list, optional): Previous month's transactions for comparison
+        api_key (str): API key for Gemini AI
+        period (str, optional): Analysed month as YYYY-MM
         
-        # Parse the response and return as JSON
-        import json
-        try:
-            # Handle different response formats from Gemini API
-            if hasattr(response, 'text'):
-                if isinstance(response.text, list):
-                    # If response.text is a list, join it or take the first element
-                    response_text = ' '.join(response.text) if response.text else ""
-                else:
-                    response_text = str(response.text)
-            else:
-                response_text = str(response)
-            
-            response_text = response_text.strip()
-            
-            # Try to extract JSON from the response
-            if response_text.startswith('```json'):
-                response_text = response_text[7:-3]  # Remove ```json and ```
-            elif response_text.startswith('```'):
-                response_text = response_text[3:-3]  # Remove ``` and ```
-            
-            return json.loads(response_text)
-        except json.JSONDecodeError:
-            # If parsing fails, return the raw text
-            return {"analysis": response_text, "error": "Could not parse as JSON"}
-            
+    Returns:
+        dict: Comprehensive financial analysis with actionable insights
+    """
+    
+    summary = analytics.summarize(current_transactions, previous_transactions)
+    
+    try:
+        response = llm_client.generate_content(
+            api_key, ANALYSIS_MODEL, build_analysis_prompt(summary, period), task=llm_client.TASK_ANALYSIS,
+            config=structured_output.response_config(llm_client.TASK_ANALYSIS),
+        )
+        return parse_analysis_response(response, summary)
+    except Exception as e:
+        return {"error": f"Analysis failed: {str(e)}"}
+
+
+async def transaction_analysis_async(api_key, current_transactions, previous_transactions=None,
+                                     period=None, timeout=None):
+    """
+    Async variant of transaction_analysis using the async Gemini client.
+
+    Args:
+        timeout (float, optional): Seconds to wait for Gemini before giving up
+
+    Raises:
+        asyncio.TimeoutError: Gemini did not answer within `timeout`
+        asyncio.CancelledError: The request was cancelled, e.g. the client disconnected
+    """
+    summary = analytics.summarize(current_transactions, previous_transactions)
+    
+    try:
+        response = await asyncio.wait_for(
+            llm_client.agenerate_content(
+                api_key, ANALYSIS_MODEL, build_analysis_prompt(summary, period), task=llm_client.TASK_ANALYSIS,
+                config=structured_output.response_config(llm_client.TASK_ANALYSIS),
+            ),
+            timeout=timeout,
+        )
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        raise
     except Exception as e:
         return {"error": f"Analysis failed: {str(e)}"}
+    return parse_analysis_response(response, summary)
 
 
 def test():
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import AnalysisCache
+from .periods import month_range
+
+
+logger = logging.getLogger(__name__)
+
+
+# Analysis results are cached per user and month, keyed by a hash of the exact
+# transactions that went into the prompt plus the model and prompt version.
+# Any change to either month's transactions changes the fingerprint, and writes
+# also drop the affected entries eagerly through invalidate().
+
+def _ttl():
+    return timedelta(seconds=getattr(settings, 'ANALYSIS_CACHE_TTL', 7 * 24 * 3600))
+
+
+def _max_entries():
+    return getattr(settings, 'ANALYSIS_CACHE_MAX_ENTRIES', 24)
+
+
+def transactions_fingerprint(current_transactions, previous_transactions=None):
+    """
+    Stable SHA-256 over the transactions fed to the analysis, independent of row order.
+
+    Args:
+        current_transactions (list): Transaction dicts for the analysed month
+        previous_transactions (list, optional): Transaction dicts for the month before
+
+    Returns:
+        str: Hex digest
+    """
+    def canonical(transactions):
+        return sorted(
+            (str(t['date']), t['description'], str(t['amount']), t['category'], bool(t.get('is_recurring')))
+            for t in transactions or []
+        )
+
+    payload = json.dumps([canonical(current_transactions), canonical(previous_transactions)], separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def cache_key(user_id, year, month, fingerprint, model_name, prompt_version):
+    raw = f'{user_id}:{year}:{month}:{fingerprint}:{model_name}:{prompt_version}'
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def get(user, year, month, fingerprint, model_name, prompt_version):
+    """
+    Looks up a cached analysis.
+
+    Returns:
+        tuple or None: (result dict, age in seconds) on a fresh hit
+    """
+    key = cache_key(user.pk, year, month, fingerprint, model_name, prompt_version)
+    entry = AnalysisCache.objects.filter(key=key).only('result', 'created_at').first()
+    if entry is None:
+        return None
+
+    now = timezone.now()
+    if now - entry.created_at > _ttl():
+        entry.delete()
+        return None
+    try:
+        AnalysisCache.objects.filter(pk=entry.pk).update(last_used_at=now)
+    except DatabaseError as e:
+        # Only the LRU order suffers
+        logger.warning('Could not touch cached analysis %s: %s', entry.pk, e)
+    return entry.result, int((now - entry.created_at).total_seconds())
+
+
+def put(user, year, month, fingerprint, model_name, prompt_version, result):
+    """Stores an analysis and evicts the user's least recently used entries past the limit."""
+    key = cache_key(user.pk, year, month, fingerprint, model_name, prompt_version)
+    try:
+        AnalysisCache.objects.update_or_create(
+            key=key,
+            defaults=dict(
+                user=user, year=year, month=month, fingerprint=fingerprint,
+                model_name=model_name, prompt_version=prompt_version, result=result,
+            ),
+        )
+    except IntegrityError:
+        # A concurrent request stored the same analysis
+        pass
+    except DatabaseError as e:
+        # Caching is best effort, e.g. SQLite answers "database is locked" under
+        # concurrent writes; the analysis itself is still returned
+        logger.warning('Could not cache analysis for user %s: %s', user.pk, e)
+        return
+    try:
+        evict(user)
+    except DatabaseError as e:
+        logger.warning('Could not evict cached analyses for user %s: %s', user.pk, e)
+
+
+def evict(user):
+    entries = AnalysisCache.objects.filter(user=user)
+    entries.filter(created_at__lt=timezone.now() - _ttl()).delete()
+    stale = entries.order_by('-last_used_at').values_list('pk', flat=True)[_max_entries():]
+    stale = list(stale)
+    if stale:
+        AnalysisCache.objects.filter(pk__in=stale).delete()
+
+
+def invalidate(months):
+    """
+    Drops cached analyses that read any of the given months. An analysis of month M
+    also reads month M-1, so a change in M invalidates M and M+1.
+
+    Args:
+        months (iterable): (user_id, year, month) tuples
+    """
+    condition = Q()
+    for user_id, year, month in months:
+        _, next_start = month_range(year, month)
+        condition |= Q(user_id=user_id, year=year, month=month)
+        condition |= Q(user_id=user_id, year=next_start.year, month=next_start.month)
+    if condition:
+        AnalysisCache.objects.filter(condition).delete()
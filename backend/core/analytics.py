@@ -0,0 +1,188 @@
+import re
+
+import numpy as np
+
+from .constants import catagory_choices
+
+
+# Deterministic, vectorized month summary. transaction_analysis sends this
+# summary to Gemini instead of the raw transactions, so the prompt has the same
+# size for 50 or 5,000 transactions and the model never has to do arithmetic.
+
+CATEGORY_KEYS = [key for key, _ in catagory_choices]
+CATEGORY_INDEX = {key: i for i, key in enumerate(CATEGORY_KEYS)}
+INCOME = CATEGORY_INDEX['income']
+SAVING_CATEGORIES = [CATEGORY_INDEX['savings'], CATEGORY_INDEX['investment']]
+DISCRETIONARY_CATEGORIES = [
+    CATEGORY_INDEX['entertainment'],
+    CATEGORY_INDEX['clothing'],
+    CATEGORY_INDEX['miscellaneous'],
+]
+
+TOP_MERCHANTS = 5
+LARGEST_EXPENSES = 3
+
+_MERCHANT_NOISE = re.compile(r'[\d#*]+|\s+-\s+.*$')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_merchant(description):
+    """'Uber ride #4411' and 'UBER RIDE 12' both become 'uber ride'"""
+    name = _MERCHANT_NOISE.sub(' ', description.lower())
+    return _SPACES.sub(' ', name).strip() or description.lower().strip()
+
+
+def to_arrays(transactions):
+    """
+    Converts transaction dicts into column arrays.
+
+    Returns:
+        tuple: (amounts float64, category indexes int, recurring bool, descriptions list)
+    """
+    count = len(transactions)
+    amounts = np.fromiter((float(t['amount']) for t in transactions), dtype=np.float64, count=count)
+    categories = np.fromiter(
+        (CATEGORY_INDEX.get(str(t['category']).lower(), CATEGORY_INDEX['miscellaneous']) for t in transactions),
+        dtype=np.int64, count=count,
+    )
+    recurring = np.fromiter((bool(t.get('is_recurring')) for t in transactions), dtype=bool, count=count)
+    descriptions = [t['description'] for t in transactions]
+    return amounts, categories, recurring, descriptions
+
+
+def category_totals(amounts, categories):
+    return np.bincount(categories, weights=amounts, minlength=len(CATEGORY_KEYS))
+
+
+def _ratio(numerator, denominator):
+    return float(numerator / denominator) if denominator else None
+
+
+def _round(value):
+    return None if value is None else round(float(value), 2)
+
+
+def top_merchants(amounts, categories, descriptions, limit=TOP_MERCHANTS):
+    expense = categories != INCOME
+    if not expense.any():
+        return []
+    names = np.array([normalize_merchant(d) for d, is_expense in zip(descriptions, expense) if is_expense])
+    unique, inverse = np.unique(names, return_inverse=True)
+    totals = np.bincount(inverse, weights=amounts[expense])
+    counts = np.bincount(inverse)
+    order = np.argsort(-totals)[:limit]
+    return [
+        {'merchant': str(unique[i]), 'total': _round(totals[i]), 'count': int(counts[i])}
+        for i in order
+    ]
+
+
+def financial_score(summary):
+    """
+    Rule-based 0-100 score from the summary.
+
+    Starts at 50 and moves with the savings rate, recurring load, month-over-month
+    expense growth, the share of discretionary spending and money put into savings.
+    """
+    score = 50.0
+    savings_rate = summary['savings_rate']
+    if savings_rate is None:
+        score -= 10 if summary['total_expenses'] > 0 else 0
+    else:
+        # +/-30 points between a -50% and a +50% savings rate
+        score += 60 * max(-0.5, min(0.5, savings_rate))
+
+    recurring_load = summary['recurring_load']
+    if recurring_load is not None and recurring_load > 0.5:
+        score -= min(15, (recurring_load - 0.5) * 50)
+
+    expense_change = summary['expense_change_pct']
+    if expense_change is not None and expense_change > 10:
+        score -= min(10, (expense_change - 10) / 5)
+    elif expense_change is not None and expense_change < 0:
+        score += min(5, -expense_change / 5)
+
+    discretionary_share = summary['discretionary_share']
+    if discretionary_share is not None and discretionary_share > 0.3:
+        score -= min(10, (discretionary_share - 0.3) * 40)
+
+    if summary['saved_or_invested'] > 0:
+        score += 5
+
+    score = int(round(max(0, min(100, score))))
+    if score >= 70:
+        status = 'Good'
+    elif score >= 45:
+        status = 'Fair'
+    else:
+        status = 'Poor'
+    return {'score': score, 'status': status}
+
+
+def summarize(current_transactions, previous_transactions=None):
+    """
+    Computes the month summary locally.
+
+    Args:
+        current_transactions (list): Transaction dicts with amount, category, description, is_recurring
+        previous_transactions (list, optional): The previous month's transaction dicts
+
+    Returns:
+        dict: Totals, ratios, category and month-over-month breakdowns, top merchants,
+        recurring load and the rule-based financial_score
+    """
+    amounts, categories, recurring, descriptions = to_arrays(current_transactions)
+    totals = category_totals(amounts, categories)
+    income = totals[INCOME]
+    expenses = totals.sum() - income
+
+    previous_totals = None
+    if previous_transactions:
+        previous_amounts, previous_categories, _, _ = to_arrays(previous_transactions)
+        previous_totals = category_totals(previous_amounts, previous_categories)
+    previous_expenses = previous_totals.sum() - previous_totals[INCOME] if previous_totals is not None else None
+
+    active = totals != 0
+    if previous_totals is not None:
+        active |= previous_totals != 0
+    by_category = []
+    for i in np.flatnonzero(active):
+        entry = {'category': CATEGORY_KEYS[i], 'total': _round(totals[i])}
+        if previous_totals is not None:
+            entry['previous'] = _round(previous_totals[i])
+            entry['change'] = _round(totals[i] - previous_totals[i])
+            entry['change_pct'] = _round(
+                _ratio((totals[i] - previous_totals[i]) * 100, previous_totals[i])
+            )
+        by_category.append(entry)
+    by_category.sort(key=lambda entry: -abs(entry['total']))
+
+    expense_mask = categories != INCOME
+    recurring_expenses = amounts[recurring & expense_mask].sum()
+    largest = np.flatnonzero(expense_mask)
+    largest = largest[np.argsort(-amounts[largest])][:LARGEST_EXPENSES]
+
+    summary = {
+        'transaction_count': int(len(amounts)),
+        'previous_transaction_count': len(previous_transactions or []),
+        'total_income': _round(income),
+        'total_expenses': _round(expenses),
+        'net_amount': _round(income - expenses),
+        'income_expense_ratio': _round(_ratio(income, expenses)),
+        'savings_rate': _round(_ratio(income - expenses, income)),
+        'previous_total_expenses': _round(previous_expenses),
+        'expense_change_pct': _round(_ratio((expenses - previous_expenses) * 100, previous_expenses))
+        if previous_expenses is not None else None,
+        'by_category': by_category,
+        'top_merchants': top_merchants(amounts, categories, descriptions),
+        'largest_expenses': [
+            {'description': descriptions[i], 'amount': _round(amounts[i]), 'category': CATEGORY_KEYS[categories[i]]}
+            for i in largest
+        ],
+        'recurring_expenses': _round(recurring_expenses),
+        'recurring_load': _round(_ratio(recurring_expenses, income)),
+        'discretionary_share': _round(_ratio(totals[DISCRETIONARY_CATEGORIES].sum(), expenses)),
+        'saved_or_invested': _round(totals[SAVING_CATEGORIES].sum()),
+    }
+    summary['financial_score'] = financial_score(summary)
+    return summary
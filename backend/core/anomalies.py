@@ -0,0 +1,358 @@
+import io
+import logging
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.utils import timezone
+
+from .constants import catagory_choices
+from .models import Anomaly, AnomalyStats, MonthlyCategoryRollup, Transaction
+
+
+logger = logging.getLogger(__name__)
+
+
+# Spending anomaly engine. For every user and category it keeps robust
+# statistics: the median and MAD (median absolute deviation) of transaction
+# amounts, the same for monthly totals, and a seasonal baseline (the average
+# total of each calendar month, so December is compared with past Decembers).
+# A transaction or month is unusual when it lies ANOMALY_THRESHOLD or more
+# scaled MADs above what is expected (a robust z-score; only overspending is
+# flagged).
+#
+# The statistics are recomputed by the score_anomalies command, typically
+# nightly, for the whole user base at once with numpy (group medians from one
+# sort over (user, category, amount)); that pass also rescores every stored
+# transaction and month. In between, each saved transaction is scored in O(1)
+# against its user's stored statistics (one (categories x columns) array per
+# user) and the rolling count and mean are updated; transactions created in bulk
+# through the API are scored the same way, a user at a time. Statement imports
+# skip the model signals and are scored by the next batch run.
+
+# Income is not spending, an unusually large salary is not flagged
+CATEGORIES = [key for key, _label in catagory_choices if key != 'income']
+_CATEGORY_INDEX = {category: i for i, category in enumerate(CATEGORIES)}
+
+# Columns of a user's statistics array, one row per category
+COUNT, MEAN, MEDIAN, SCALE, MONTHS, MONTH_MEDIAN, MONTH_SCALE = range(7)
+# Average total per calendar month, NaN where there is no past data
+SEASONAL = 7
+COLUMNS = SEASONAL + 12
+# MAD to standard deviation for normally distributed data
+MAD_TO_SIGMA = 1.4826
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def dumps(stats):
+    output = io.BytesIO()
+    np.save(output, stats.astype(np.float32), allow_pickle=False)
+    return output.getvalue()
+
+
+def loads(data):
+    return np.load(io.BytesIO(bytes(data)), allow_pickle=False).astype(np.float64)
+
+
+def _scale(medians, mads):
+    # A floor, so a category with identical amounts (MAD 0) does not flag every small change
+    return np.maximum(np.maximum(MAD_TO_SIGMA * mads, 0.1 * np.abs(medians)), 1.0)
+
+
+def group_medians(values, groups, group_count):
+    """
+    Median of `values` per group id, NaN for empty groups, with a single sort.
+
+    Returns:
+        ndarray: group_count medians
+    """
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    counts = np.bincount(groups, minlength=group_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    medians = np.full(group_count, np.nan)
+    present = counts > 0
+    low = starts[present] + (counts[present] - 1) // 2
+    high = starts[present] + counts[present] // 2
+    medians[present] = (sorted_values[low] + sorted_values[high]) / 2
+    return medians
+
+
+def compute(user_ids, categories, amounts, month_numbers, current_month):
+    """
+    Statistics and scores for many users at once.
+
+    Args:
+        user_ids, categories, amounts, month_numbers (ndarray): One entry per
+            transaction; categories are CATEGORIES indices, month numbers count
+            months since 1970-01
+        current_month (int): Month number of the month in progress, left out of
+            the monthly baselines
+
+    Returns:
+        dict: 'users' (the distinct user ids), 'stats' (users x categories x
+              COLUMNS), 'scores' per transaction, 'months' (user index,
+              category, month number, total, expected, score) arrays per
+              user/category/month
+    """
+    users, user_index = np.unique(user_ids, return_inverse=True)
+    group_count = len(users) * len(CATEGORIES)
+    groups = user_index * len(CATEGORIES) + categories
+    stats = np.full((group_count, COLUMNS), np.nan)
+
+    # Transactions
+    counts = np.bincount(groups, minlength=group_count)
+    stats[:, COUNT] = counts
+    stats[:, MEAN] = np.bincount(groups, weights=amounts, minlength=group_count) / np.maximum(counts, 1)
+    medians = group_medians(amounts, groups, group_count)
+    mads = group_medians(np.abs(amounts - medians[groups]), groups, group_count)
+    stats[:, MEDIAN] = medians
+    stats[:, SCALE] = _scale(medians, mads)
+    scores = (amounts - medians[groups]) / stats[groups, SCALE]
+
+    # Monthly totals per user and category
+    first_month = int(month_numbers.min()) if len(month_numbers) else 0
+    span = int(month_numbers.max()) - first_month + 1 if len(month_numbers) else 1
+    keys, key_index = np.unique(groups * span + (month_numbers - first_month), return_inverse=True)
+    totals = np.bincount(key_index, weights=amounts)
+    month_groups = keys // span
+    months = keys % span + first_month
+    past = months < current_month
+
+    month_counts = np.bincount(month_groups[past], minlength=group_count)
+    stats[:, MONTHS] = month_counts
+    month_medians = group_medians(totals[past], month_groups[past], group_count)
+    month_mads = group_medians(
+        np.abs(totals[past] - month_medians[month_groups[past]]), month_groups[past], group_count
+    )
+    stats[:, MONTH_MEDIAN] = month_medians
+    stats[:, MONTH_SCALE] = _scale(month_medians, month_mads)
+
+    seasons = month_groups * 12 + months % 12
+    season_sums = np.bincount(seasons[past], weights=totals[past], minlength=group_count * 12)
+    season_counts = np.bincount(seasons[past], minlength=group_count * 12)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats[:, SEASONAL:] = (season_sums / season_counts).reshape(group_count, 12)
+        # Each month is compared with the same calendar month of the other years
+        other_counts = season_counts[seasons] - past
+        other_sums = season_sums[seasons] - totals * past
+        expected = np.where(other_counts > 0, other_sums / np.maximum(other_counts, 1), month_medians[month_groups])
+    month_scores = (totals - expected) / stats[month_groups, MONTH_SCALE]
+
+    return {
+        'users': users,
+        'stats': stats.reshape(len(users), len(CATEGORIES), COLUMNS),
+        'scores': scores,
+        'months': (month_groups // len(CATEGORIES), month_groups % len(CATEGORIES), months, totals, expected, month_scores),
+    }
+
+
+def _month_number(day):
+    return (day.year - 1970) * 12 + day.month - 1
+
+
+def _money(value):
+    return Decimal(str(round(float(value), 2)))
+
+
+def rescore(user_ids=None, today=None):
+    """
+    Recomputes the statistics and all anomalies, for everyone or some users.
+
+    Returns:
+        tuple: (users, transactions scored, anomalies found)
+    """
+    today = today or date.today()
+    rows = Transaction.objects.all()
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+    ids, users, categories, amounts, days = [], [], [], [], []
+    for transaction_id, user_id, category, amount, day in rows.values_list(
+        'id', 'user_id', 'category', 'amount', 'date'
+    ).iterator(chunk_size=5000):
+        index = _CATEGORY_INDEX.get(category)
+        if index is None:
+            continue
+        ids.append(transaction_id)
+        users.append(user_id)
+        categories.append(index)
+        amounts.append(float(amount))
+        days.append(day)
+    if not ids:
+        return 0, 0, 0
+
+    user_ids_array = np.array(users, dtype=np.int64)
+    categories_array = np.array(categories, dtype=np.int64)
+    amounts_array = np.array(amounts)
+    month_numbers = np.array(days, dtype='datetime64[M]').astype(np.int64)
+    result = compute(user_ids_array, categories_array, amounts_array, month_numbers, _month_number(today))
+
+    threshold = _setting('ANOMALY_THRESHOLD', 3.5)
+    user_position = {int(user_id): i for i, user_id in enumerate(result['users'])}
+    stats = result['stats']
+    anomalies = []
+
+    user_positions = np.searchsorted(result['users'], user_ids_array)
+    history = stats[user_positions, categories_array, COUNT]
+    for i in np.flatnonzero((result['scores'] >= threshold) & (history >= _setting('ANOMALY_MIN_HISTORY', 8))):
+        anomalies.append(Anomaly(
+            user_id=users[i], kind=Anomaly.KIND_TRANSACTION, transaction_id=ids[i],
+            category=CATEGORIES[categories[i]], year=days[i].year, month=days[i].month,
+            amount=_money(amounts[i]),
+            expected=_money(stats[user_positions[i], categories[i], MEDIAN]),
+            score=round(float(result['scores'][i]), 2),
+        ))
+
+    month_users, month_categories, months, totals, expected, month_scores = result['months']
+    month_history = stats[month_users, month_categories, MONTHS]
+    for i in np.flatnonzero((month_scores >= threshold) & (month_history >= _setting('ANOMALY_MIN_MONTHS', 4))):
+        year, month = divmod(int(months[i]), 12)
+        anomalies.append(Anomaly(
+            user_id=int(result['users'][month_users[i]]), kind=Anomaly.KIND_MONTH,
+            category=CATEGORIES[month_categories[i]], year=1970 + year, month=month + 1,
+            amount=_money(totals[i]), expected=_money(expected[i]), score=round(float(month_scores[i]), 2),
+        ))
+
+    now = timezone.now()
+    with db_transaction.atomic():
+        AnomalyStats.objects.bulk_create(
+            [
+                AnomalyStats(user_id=user_id, arrays=dumps(stats[position]), computed_at=now)
+                for user_id, position in user_position.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['arrays', 'computed_at', 'updated_at'],
+            batch_size=500,
+        )
+        scored = Anomaly.objects.all()
+        if user_ids is not None:
+            scored = scored.filter(user_id__in=user_ids)
+        scored.delete()
+        Anomaly.objects.bulk_create(anomalies, batch_size=1000)
+    return len(user_position), len(ids), len(anomalies)
+
+
+def _add_to_mean(values, amount):
+    # Welford's running mean
+    values[COUNT] += 1
+    values[MEAN] = np.nan_to_num(values[MEAN]) + (amount - np.nan_to_num(values[MEAN])) / values[COUNT]
+
+
+def _transaction_date(transaction):
+    return transaction.date if isinstance(transaction.date, date) else date.fromisoformat(str(transaction.date))
+
+
+def _transaction_anomaly(transaction, values, threshold):
+    """The unsaved Anomaly of a transaction scored against its category's statistics, None if usual"""
+    if values[COUNT] < _setting('ANOMALY_MIN_HISTORY', 8) or np.isnan(values[MEDIAN]):
+        return None
+    amount = float(transaction.amount)
+    score = (amount - values[MEDIAN]) / values[SCALE]
+    if score < threshold:
+        return None
+    day = _transaction_date(transaction)
+    return Anomaly(
+        user_id=transaction.user_id, kind=Anomaly.KIND_TRANSACTION, transaction=transaction,
+        category=transaction.category, year=day.year, month=day.month,
+        amount=_money(amount), expected=_money(values[MEDIAN]), score=round(float(score), 2),
+    )
+
+
+def _score_month(user_id, category, day, values, computed_at, threshold):
+    """Rescores the category's month of `day` from its rollup total, if it is the month in progress"""
+    # The month in progress, whose baseline is the stored one
+    if _month_number(day) < _month_number(timezone.localdate(computed_at)):
+        return
+    month = Anomaly.objects.filter(
+        user_id=user_id, kind=Anomaly.KIND_MONTH, category=category, year=day.year, month=day.month,
+    )
+    total = MonthlyCategoryRollup.objects.filter(
+        user_id=user_id, year=day.year, month=day.month, category=category,
+    ).values_list('total_amount', flat=True).first()
+    expected = values[SEASONAL + day.month - 1]
+    if np.isnan(expected):
+        expected = values[MONTH_MEDIAN]
+    if total is None or np.isnan(expected) or values[MONTHS] < _setting('ANOMALY_MIN_MONTHS', 4):
+        month.delete()
+        return
+    score = (float(total) - expected) / values[MONTH_SCALE]
+    if score < threshold:
+        month.delete()
+    elif not month.update(amount=total, expected=_money(expected), score=round(float(score), 2)):
+        Anomaly.objects.create(
+            user_id=user_id, kind=Anomaly.KIND_MONTH, category=category,
+            year=day.year, month=day.month, amount=total, expected=_money(expected), score=round(float(score), 2),
+        )
+
+
+def score_transaction(transaction, created):
+    """
+    Scores a saved transaction against its user's stored statistics, O(1).
+    New transactions also update the rolling count and mean of their category.
+    Users without statistics yet are left to the next rescore().
+    """
+    row = AnomalyStats.objects.filter(user_id=transaction.user_id).first()
+    category = _CATEGORY_INDEX.get(transaction.category)
+    if row is None or category is None:
+        return
+    stats = loads(row.arrays)
+    threshold = _setting('ANOMALY_THRESHOLD', 3.5)
+
+    values = stats[category]
+    if created:
+        _add_to_mean(values, float(transaction.amount))
+        AnomalyStats.objects.filter(pk=row.pk).update(arrays=dumps(stats), updated_at=timezone.now())
+    else:
+        Anomaly.objects.filter(transaction=transaction).delete()
+
+    anomaly = _transaction_anomaly(transaction, values, threshold)
+    if anomaly is not None:
+        anomaly.save()
+    _score_month(transaction.user_id, transaction.category, _transaction_date(transaction), values, row.computed_at,
+                 threshold)
+
+
+def score_transactions(transactions):
+    """
+    Scores newly inserted transactions like score_transaction(), for bulk
+    inserts that skip the model signals: each user's statistics are read and
+    written once, each touched category month is rescored once.
+    """
+    by_user = {}
+    for transaction in transactions:
+        if transaction.category in _CATEGORY_INDEX:
+            by_user.setdefault(transaction.user_id, []).append(transaction)
+    if not by_user:
+        return
+    threshold = _setting('ANOMALY_THRESHOLD', 3.5)
+    found = []
+    for row in AnomalyStats.objects.filter(user_id__in=by_user):
+        stats = loads(row.arrays)
+        months = set()
+        for transaction in by_user[row.user_id]:
+            values = stats[_CATEGORY_INDEX[transaction.category]]
+            _add_to_mean(values, float(transaction.amount))
+            anomaly = _transaction_anomaly(transaction, values, threshold)
+            if anomaly is not None:
+                found.append(anomaly)
+            day = _transaction_date(transaction)
+            months.add((transaction.category, day.year, day.month))
+        AnomalyStats.objects.filter(pk=row.pk).update(arrays=dumps(stats), updated_at=timezone.now())
+        for category, year, month in months:
+            _score_month(row.user_id, category, date(year, month, 1), stats[_CATEGORY_INDEX[category]],
+                         row.computed_at, threshold)
+    Anomaly.objects.bulk_create(found)
+
+
+def month_anomalies(user, year, month):
+    """The anomalies of a user's month, most unusual first, as dicts for the analysis response"""
+    from .serializers import AnomalySerializer
+
+    queryset = Anomaly.objects.filter(user=user, year=year, month=month).select_related('transaction')
+    return AnomalySerializer(queryset[:_setting('ANOMALY_ANALYSIS_LIMIT', 10)], many=True).data
@@ -0,0 +1,331 @@
+import asyncio
+import logging
+from datetime import date as dt
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views import View
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from .analysis import transaction_analysis_async, ANALYSIS_MODEL, ANALYSIS_PROMPT_VERSION
+from .exporters import STREAM_FORMATS, stream_event
+from .image_to_transaction import image_to_transaction_async, stream_image_to_transaction_async
+from .llm_client import LLMUnavailable
+from .periods import month_range, previous_month, period_filter
+from .serializers import TransactionViewSerializer
+from .views import (
+    analysis_flight_key,
+    receipt_batch_done,
+    receipt_batch_event,
+    receipt_cache_near,
+    receipt_flight_key,
+    receipt_response_data,
+    receipt_stream_format,
+    receipt_stream_response,
+    receipt_transaction,
+)
+from . import analysis_cache, anomalies, receipt_batch, receipt_cache, receipt_images, singleflight
+
+
+logger = logging.getLogger(__name__)
+
+
+# Async versions of the Gemini-backed endpoints. Served under ASGI
+# (autofinance.asgi) an outstanding LLM call only holds a coroutine, not a
+# worker, so the CRUD endpoints keep their latency while analyses are running.
+# Django cancels the view task when the client disconnects; the CancelledError
+# propagates into the pending Gemini call and aborts it.
+
+
+def _json(data, status=status.HTTP_200_OK):
+    # DRF's encoder, so decimals render as numbers like in the sync views
+    return JsonResponse(data, status=status, encoder=JSONEncoder)
+
+
+def _gemini_timeout():
+    return getattr(settings, 'GEMINI_TIMEOUT', 60)
+
+
+class AsyncAPIView(View):
+    """Minimal async view that authenticates with the project's DRF authentication classes"""
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # Token authenticated like the DRF views, so no CSRF cookie is involved
+        view.csrf_exempt = True
+        return view
+
+    def authenticate(self, request):
+        authenticators = [auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+        return Request(request, authenticators=authenticators).user
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            user = await sync_to_async(self.authenticate)(request)
+        except exceptions.APIException as e:
+            return _json({"error": str(e.detail)}, status=e.status_code)
+        if not user or not user.is_authenticated:
+            return _json(
+                {"error": "Authentication credentials were not provided."},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        request.user = user
+        return await super().dispatch(request, *args, **kwargs)
+
+
+async def _month_transactions(user, start, end):
+    queryset = user.transactions.filter(**period_filter(start, end)).values(
+        'date', 'description', 'amount', 'category', 'is_recurring'
+    )
+    transactions = [transaction async for transaction in queryset]
+    # Parse Date into string format
+    for transaction in transactions:
+        transaction['date'] = transaction['date'].strftime('%Y-%m-%d')
+    return transactions
+
+
+class AsyncAnalysisView(AsyncAPIView):
+
+    async def get(self, request, *args, **kwargs):
+        # Get month and year from query parameters, default to current month/year if not provided
+        try:
+            month = int(request.GET.get('month', dt.today().month))
+            year = int(request.GET.get('year', dt.today().year))
+            current_period = month_range(year, month)
+        except ValueError:
+            return _json({"error": "Invalid month or year parameter"}, status=status.HTTP_400_BAD_REQUEST)
+
+        current_transactions, previous_transactions = await asyncio.gather(
+            _month_transactions(request.user, *current_period),
+            _month_transactions(request.user, *month_range(*previous_month(year, month))),
+        )
+
+        # Serve a stored analysis while neither month's transactions have changed
+        fingerprint = analysis_cache.transactions_fingerprint(current_transactions, previous_transactions)
+        cache_args = (request.user, year, month, fingerprint, ANALYSIS_MODEL, ANALYSIS_PROMPT_VERSION)
+        cached = await sync_to_async(analysis_cache.get)(*cache_args)
+        if cached is not None:
+            analysis_result, age = cached
+            month_anomalies = await sync_to_async(anomalies.month_anomalies)(request.user, year, month)
+            return _json({
+                **analysis_result, 'anomalies': month_anomalies, 'cached': True, 'cache_age_seconds': age
+            })
+
+        async def analyse():
+            analysis_result = await transaction_analysis_async(
+                settings.GEMINI_API_KEY, current_transactions, previous_transactions,
+                period=f"{year}-{month:02d}", timeout=_gemini_timeout()
+            )
+            if 'error' not in analysis_result:
+                await sync_to_async(analysis_cache.put)(*cache_args, analysis_result)
+            return analysis_result
+
+        try:
+            analysis_result = await singleflight.ado(
+                analysis_flight_key(*cache_args), analyse, shareable=lambda result: 'error' not in result
+            )
+        except asyncio.TimeoutError:
+            return _json({"error": "Analysis timed out"}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        except asyncio.CancelledError:
+            logger.info("Analysis for user %s cancelled, client disconnected", request.user.pk)
+            raise
+
+        month_anomalies = await sync_to_async(anomalies.month_anomalies)(request.user, year, month)
+        return _json({**analysis_result, 'anomalies': month_anomalies, 'cached': False, 'cache_age_seconds': 0})
+
+
+async def _receipt_transactions(user, image_bytes, budget=None, near=True):
+    # Async counterpart of views.receipt_transactions
+    image = await receipt_images.aprepare(image_bytes)
+    cached = await sync_to_async(receipt_cache.get)(user, image, near=near)
+    if cached is not None:
+        return cached
+    if budget is not None:
+        await sync_to_async(budget)()
+
+    async def extract():
+        extracted = await image_to_transaction_async(
+            image_bytes, settings.GEMINI_API_KEY, timeout=_gemini_timeout(), prepared=image
+        )
+        await sync_to_async(receipt_cache.put)(user, image, extracted)
+        return extracted
+
+    return await singleflight.ado(receipt_flight_key(user, image_bytes), extract, shareable=bool)
+
+
+class AsyncImageToTransactionView(AsyncAPIView):
+
+    async def post(self, request, *args, **kwargs):
+        image_file = await sync_to_async(request.FILES.get)('image')
+        if not image_file:
+            return _json({"error": "No image file provided."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Check file size limit (5MB)
+        if image_file.size > 5 * 1024 * 1024:
+            return _json({"error": "Image file size exceeds 5MB limit."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            image_bytes = await sync_to_async(image_file.read)()
+            transactions_data = await _receipt_transactions(
+                request.user, image_bytes, near=receipt_cache_near(request)
+            )
+        except asyncio.TimeoutError:
+            return _json({"error": "Receipt extraction timed out"}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        except asyncio.CancelledError:
+            logger.info("Receipt extraction for user %s cancelled, client disconnected", request.user.pk)
+            raise
+        except LLMUnavailable as e:
+            return _json({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except Exception as e:
+            return _json({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not transactions_data:
+            return _json({"error": "Failed to extract transactions from image."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return _json(receipt_response_data(request.user, transactions_data))
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+async def _receipt_event_stream(user, first, transactions_data, stream_format, near_match=False):
+    # Async counterpart of views.receipt_event_stream
+    count = 0
+    try:
+        transaction_data = first
+        while transaction_data is not None:
+            transaction = receipt_transaction(user, transaction_data)
+            if transaction is not None:
+                count += 1
+                yield stream_event('transaction', TransactionViewSerializer(transaction).data, stream_format)
+            transaction_data = await anext(transactions_data, None)
+    except asyncio.CancelledError:
+        logger.info("Receipt stream for user %s cancelled, client disconnected", user.pk)
+        raise
+    except Exception as e:
+        yield stream_event('error', {"error": str(e)}, stream_format)
+        return
+    yield stream_event('done', {
+        "success": True,
+        "message": f"Extracted {count} transactions from image",
+        "near_match": near_match,
+    }, stream_format)
+
+
+class AsyncImageToTransactionStreamView(AsyncAPIView):
+    """Streams the transactions as NDJSON or server-sent events while Gemini writes them"""
+
+    async def post(self, request, *args, **kwargs):
+        stream_format = receipt_stream_format(request)
+        if stream_format not in STREAM_FORMATS:
+            return _json(
+                {"error": f"Unsupported stream format. Choose one of: {', '.join(STREAM_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        image_file = await sync_to_async(request.FILES.get)('image')
+        if not image_file:
+            return _json({"error": "No image file provided."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Check file size limit (5MB)
+        if image_file.size > 5 * 1024 * 1024:
+            return _json({"error": "Image file size exceeds 5MB limit."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            image_bytes = await sync_to_async(image_file.read)()
+            image = await receipt_images.aprepare(image_bytes)
+            cached = await sync_to_async(receipt_cache.get)(request.user, image, near=receipt_cache_near(request))
+            if cached is not None:
+                transactions_data = _aiter(cached)
+            else:
+                transactions_data = receipt_cache.astoring(
+                    request.user, image,
+                    stream_image_to_transaction_async(image_bytes, settings.GEMINI_API_KEY, prepared=image),
+                )
+            # Wait for the first transaction, so a failing call still gets a proper status code
+            first = await asyncio.wait_for(anext(transactions_data, None), timeout=_gemini_timeout())
+        except asyncio.TimeoutError:
+            return _json({"error": "Receipt extraction timed out"}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        except asyncio.CancelledError:
+            logger.info("Receipt extraction for user %s cancelled, client disconnected", request.user.pk)
+            raise
+        except LLMUnavailable as e:
+            return _json({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except Exception as e:
+            return _json({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if first is None:
+            return _json({"error": "Failed to extract transactions from image."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return receipt_stream_response(
+            _receipt_event_stream(
+                request.user, first, transactions_data, stream_format,
+                near_match=isinstance(cached, receipt_cache.NearMatch),
+            ),
+            stream_format,
+        )
+
+
+async def _receipt_batch_event_stream(user, images, stream_format, near=True):
+    # Async counterpart of views.receipt_batch_event_stream, the receipts are
+    # read as tasks, at most receipt_batch.concurrency() at a time
+    semaphore = asyncio.Semaphore(receipt_batch.concurrency())
+
+    async def read(index, image):
+        async with semaphore:
+            try:
+                image_bytes = await sync_to_async(image.read)()
+                transactions_data = await _receipt_transactions(
+                    user, image_bytes, budget=lambda: receipt_batch.take_budget(user), near=near
+                )
+            except asyncio.TimeoutError:
+                return index, None, "Receipt extraction timed out"
+            except Exception as e:
+                logger.info("Batch receipt %s of user %s failed: %s", image.name, user.pk, e)
+                return index, None, e
+            return index, transactions_data, None
+
+    tasks = [asyncio.ensure_future(read(index, image)) for index, image in enumerate(images)]
+    failed = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, transactions_data, error = await next_done
+            failed += error is not None or not transactions_data
+            yield receipt_batch_event(user, index, images[index], transactions_data, error, stream_format)
+    except asyncio.CancelledError:
+        logger.info("Receipt batch for user %s cancelled, client disconnected", user.pk)
+        raise
+    finally:
+        for task in tasks:
+            task.cancel()
+    yield receipt_batch_done(len(images), failed, stream_format)
+
+
+class AsyncImageToTransactionBatchView(AsyncAPIView):
+    """Reads many receipts (images or zips of images in `images`) and streams an event per receipt"""
+
+    async def post(self, request, *args, **kwargs):
+        stream_format = receipt_stream_format(request)
+        if stream_format not in STREAM_FORMATS:
+            return _json(
+                {"error": f"Unsupported stream format. Choose one of: {', '.join(STREAM_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        uploads = await sync_to_async(request.FILES.getlist)('images')
+        if not uploads:
+            return _json({"error": "No image files provided."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            images = await sync_to_async(receipt_batch.collect_images)(uploads)
+        except ValueError as e:
+            return _json({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not images:
+            return _json({"error": "No images found in the upload."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return receipt_stream_response(
+            _receipt_batch_event_stream(request.user, images, stream_format, near=receipt_cache_near(request)),
+            stream_format
+        )
@@ -0,0 +1,284 @@
+import io
+import logging
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DatabaseError
+
+from .constants import catagory_choices
+from .models import CategoryModel, Job, Transaction
+from . import jobs
+
+
+logger = logging.getLogger(__name__)
+
+
+# Local category classifier, so picking a category for a description needs no
+# LLM call. A description becomes a bag of character 3-5-grams of its words,
+# hashed into DIMENSIONS buckets, log-scaled and L2 normalized. Each category's
+# model is the sum of its examples' vectors (nearest centroid, by cosine), so a
+# new transaction is learned by adding its vector, and a prediction is a
+# (categories x a few hundred buckets) product: a few microseconds.
+#
+# There is one model per user and a global one over all users' transactions;
+# suggestions blend them, leaning on the user's own model as it grows. Models
+# are stored as compressed numpy arrays in CategoryModel. Requests only load
+# them, on first use and again every CATEGORIZER_REFRESH_SECONDS; learning
+# happens off the request path, in a "categorizer" background job queued after
+# writes (run by run_jobworker, which learns the transactions added since the
+# last run, by id) or with the train_categorizer command. Imported rows whose
+# category was guessed or defaulted (Transaction.category_guessed) are not
+# learned. Edits of already learned rows, and categories later set on guessed
+# rows, are only picked up by `train_categorizer --rebuild`.
+
+# Bumped when features() changes, stored models of another version are rebuilt
+FEATURE_VERSION = 1
+DIMENSIONS = 1 << 12
+NGRAM_SIZES = (3, 4, 5)
+CATEGORIES = [key for key, _label in catagory_choices]
+_CATEGORY_INDEX = {category: i for i, category in enumerate(CATEGORIES)}
+# Digits (dates, amounts, references) and punctuation separate words
+_SEPARATORS = re.compile(r'[\W\d_]+')
+GLOBAL_KEY = 'global'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def features(description):
+    """
+    Hashed character n-gram vector of a description.
+
+    Returns:
+        tuple: (bucket indices, L2 normalized float32 weights), empty arrays
+               when the description has no letters
+    """
+    buckets = []
+    for word in _SEPARATORS.sub(' ', description.casefold()).split():
+        padded = f' {word} '
+        for size in NGRAM_SIZES:
+            for start in range(len(padded) - size + 1):
+                buckets.append(zlib.crc32(padded[start:start + size].encode('utf-8')) & (DIMENSIONS - 1))
+    if not buckets:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+    indices, counts = np.unique(np.array(buckets, dtype=np.intp), return_counts=True)
+    weights = 1 + np.log(counts, dtype=np.float32)
+    return indices, weights / np.linalg.norm(weights)
+
+
+class CentroidModel:
+    """Per-category sums of example vectors, scored by cosine similarity"""
+
+    def __init__(self, sums=None, counts=None, last_transaction_id=0):
+        self.sums = np.zeros((len(CATEGORIES), DIMENSIONS), dtype=np.float32) if sums is None else sums
+        self.counts = np.zeros(len(CATEGORIES), dtype=np.int64) if counts is None else counts
+        self.last_transaction_id = last_transaction_id
+        self._norms = None
+
+    @property
+    def examples(self):
+        return int(self.counts.sum())
+
+    def learn(self, rows):
+        """
+        Args:
+            rows: (transaction id, description, category) tuples in id order
+
+        Returns:
+            int: Rows learned
+        """
+        learned = 0
+        for transaction_id, description, category in rows:
+            self.last_transaction_id = max(self.last_transaction_id, transaction_id)
+            index = _CATEGORY_INDEX.get(category)
+            indices, weights = features(description)
+            if index is None or not len(indices):
+                continue
+            self.sums[index, indices] += weights
+            self.counts[index] += 1
+            learned += 1
+        if learned:
+            self._norms = None
+        return learned
+
+    def scores(self, indices, weights):
+        """Cosine similarity of a features() vector with every category's centroid"""
+        if self._norms is None:
+            self._norms = np.linalg.norm(self.sums, axis=1)
+        dots = self.sums[:, indices] @ weights
+        return np.divide(dots, self._norms, out=np.zeros(len(CATEGORIES), dtype=np.float32), where=self._norms > 0)
+
+    def dumps(self):
+        output = io.BytesIO()
+        np.savez_compressed(output, sums=self.sums, counts=self.counts)
+        return output.getvalue()
+
+    @classmethod
+    def loads(cls, data, last_transaction_id=0):
+        with np.load(io.BytesIO(data)) as arrays:
+            return cls(arrays['sums'], arrays['counts'], last_transaction_id)
+
+
+def _key(user_id):
+    return GLOBAL_KEY if user_id is None else f'user-{user_id}'
+
+
+def load(user_id):
+    """The stored model of a user (None: the global one), an empty one if there is none yet"""
+    row = CategoryModel.objects.filter(key=_key(user_id)).first()
+    if row is None or row.feature_version != FEATURE_VERSION:
+        return CentroidModel()
+    return CentroidModel.loads(bytes(row.weights), row.last_transaction_id)
+
+
+def save(user_id, model):
+    CategoryModel.objects.update_or_create(
+        key=_key(user_id),
+        defaults={
+            'user_id': user_id,
+            'feature_version': FEATURE_VERSION,
+            'weights': model.dumps(),
+            'examples': model.examples,
+            'last_transaction_id': model.last_transaction_id,
+        },
+    )
+
+
+def update(user_id, model):
+    """Learns the transactions added since the model was last updated"""
+    # Guessed categories are the classifier's own output, learning them would reinforce its mistakes
+    rows = Transaction.objects.filter(id__gt=model.last_transaction_id, category_guessed=False)
+    if user_id is not None:
+        rows = rows.filter(user_id=user_id)
+    rows = rows.order_by('id').values_list('id', 'description', 'category')
+    previous = model.last_transaction_id
+    model.learn(rows.iterator(chunk_size=2000))
+    return model.last_transaction_id != previous
+
+
+def train(user_id=None, rebuild=False):
+    """
+    Brings a stored model up to date with every transaction, from scratch with
+    `rebuild`. Used by the categorizer job and the train_categorizer command.
+
+    Returns:
+        CentroidModel: The saved model
+    """
+    model = CentroidModel() if rebuild else load(user_id)
+    update(user_id, model)
+    save(user_id, model)
+    with _lock:
+        _models.pop(_key(user_id), None)
+    return model
+
+
+def schedule(user_ids):
+    """Queues a training job for each user that has none waiting yet"""
+    if not user_ids:
+        return
+    existing = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+    waiting = set(
+        Job.objects.filter(
+            kind=Job.KIND_CATEGORIZER, status=Job.STATUS_QUEUED, user_id__in=existing
+        ).values_list('user_id', flat=True)
+    )
+    for user_id in existing - waiting:
+        jobs.submit(User(pk=user_id), Job.KIND_CATEGORIZER, priority=-5)
+
+
+_lock = threading.Lock()
+# key -> (loaded at, CentroidModel), least recently used first
+_models = OrderedDict()
+
+
+def get_model(user_id):
+    """
+    The in-memory model of a user (None: the global one), loaded lazily and
+    reloaded from the database every CATEGORIZER_REFRESH_SECONDS. Never learns.
+    """
+    key = _key(user_id)
+    now = time.monotonic()
+    with _lock:
+        entry = _models.get(key)
+        if entry is not None and now - entry[0] < _setting('CATEGORIZER_REFRESH_SECONDS', 300):
+            _models.move_to_end(key)
+            return entry[1]
+    try:
+        model = load(user_id)
+    except DatabaseError as e:
+        # Suggestions are best effort, keep serving the model in memory if there is one
+        logger.warning('Could not refresh the category model %s: %s', key, e)
+        model = entry[1] if entry is not None else CentroidModel()
+    with _lock:
+        _models[key] = (now, model)
+        _models.move_to_end(key)
+        while len(_models) > _setting('CATEGORIZER_CACHE_SIZE', 256):
+            _models.popitem(last=False)
+    return model
+
+
+def scorer(personal, shared):
+    """
+    Blends a user's model with the global one; the user's own model takes over
+    as it learns more of their transactions.
+
+    Returns:
+        callable: description -> per-category scores, None without features
+    """
+    prior = _setting('CATEGORIZER_PERSONAL_PRIOR', 20)
+    weight = personal.examples / (personal.examples + prior) if personal.examples else 0.0
+
+    def score(description):
+        indices, weights = features(description)
+        if not len(indices):
+            return None
+        if weight == 1.0:
+            return personal.scores(indices, weights)
+        return weight * personal.scores(indices, weights) + (1 - weight) * shared.scores(indices, weights)
+    return score
+
+
+def suggest(user, description, limit=3):
+    """
+    Most likely categories of a description for a user.
+
+    Args:
+        user (User): Whose model to use, blended with the global one
+        description (str): Transaction description
+        limit (int): Number of suggestions
+
+    Returns:
+        list: (category, score) tuples, best first; empty when nothing was learned
+              yet or the description has no letters
+    """
+    scores = scorer(get_model(user.pk), get_model(None))(description)
+    if scores is None:
+        return []
+    best = np.argsort(scores)[::-1][:limit]
+    return [(CATEGORIES[i], float(scores[i])) for i in best if scores[i] > 0]
+
+
+def categorize(user, descriptions):
+    """
+    Batch categorizer for statement imports (the `categorize` hook of
+    importers.import_transactions).
+
+    Returns:
+        list: Best category per description, None where no score reaches
+              CATEGORIZER_MIN_SCORE
+    """
+    score = scorer(get_model(user.pk), get_model(None))
+    min_score = _setting('CATEGORIZER_MIN_SCORE', 0.1)
+    categories = []
+    for description in descriptions:
+        scores = score(description)
+        best = None if scores is None else int(np.argmax(scores))
+        categories.append(CATEGORIES[best] if best is not None and scores[best] >= min_score else None)
+    return categories
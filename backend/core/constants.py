@@ -12,4 +12,49 @@ catagory_choices = [
         ('investment', 'Investment'),
         ('miscellaneous', 'Miscellaneous'),
         ('tax','Tax'),
-    ]
\ No newline at end of file
+    ]
+
+# Common bank/statement category names mapped onto catagory_choices keys
+category_aliases = {
+    'salary': 'income',
+    'wages': 'income',
+    'payroll': 'income',
+    'deposit': 'income',
+    'interest': 'income',
+    'refund': 'income',
+    'groceries': 'food',
+    'grocery': 'food',
+    'dining': 'food',
+    'restaurants': 'food',
+    'restaurant': 'food',
+    'food & dining': 'food',
+    'transportation': 'transport',
+    'travel': 'transport',
+    'fuel': 'transport',
+    'gas': 'transport',
+    'auto & transport': 'transport',
+    'bills': 'utilities',
+    'bills & utilities': 'utilities',
+    'internet': 'utilities',
+    'phone': 'utilities',
+    'electricity': 'utilities',
+    'subscriptions': 'entertainment',
+    'streaming': 'entertainment',
+    'healthcare': 'health',
+    'medical': 'health',
+    'pharmacy': 'health',
+    'fitness': 'health',
+    'tuition': 'education',
+    'books': 'education',
+    'shopping': 'clothing',
+    'apparel': 'clothing',
+    'rent': 'housing',
+    'mortgage': 'housing',
+    'home': 'housing',
+    'transfer to savings': 'savings',
+    'investments': 'investment',
+    'stocks': 'investment',
+    'taxes': 'tax',
+    'other': 'miscellaneous',
+    'uncategorized': 'miscellaneous',
+}
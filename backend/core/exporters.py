@@ -0,0 +1,110 @@
+import csv
+import json
+import zlib
+
+from rest_framework.utils.encoders import JSONEncoder
+
+
+EXPORT_FIELDS = ('id', 'date', 'description', 'amount', 'category', 'is_recurring')
+DESCRIPTION = EXPORT_FIELDS.index('description')
+
+# Spreadsheets run CSV cells starting with these as formulas (CSV injection), so
+# such descriptions are written with a leading apostrophe, which shows as text
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+# Event streams, e.g. receipt transactions sent while they are being extracted
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream',
+}
+
+# Rows are joined into chunks of roughly this size before being yielded, so the
+# WSGI server does not pay a write per row
+CHUNK_BYTES = 64 * 1024
+
+
+class _Echo:
+    """File-like object for csv.writer that hands back the line instead of storing it"""
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        if row[DESCRIPTION].startswith(FORMULA_PREFIXES):
+            row = (*row[:DESCRIPTION], "'" + row[DESCRIPTION], *row[DESCRIPTION + 1:])
+        yield writer.writerow(row)
+
+
+def ndjson_lines(rows):
+    for transaction_id, date, description, amount, category, is_recurring in rows:
+        yield json.dumps({
+            'id': transaction_id,
+            'date': date.isoformat(),
+            'description': description,
+            'amount': float(amount),
+            'category': category,
+            'is_recurring': is_recurring,
+        }, ensure_ascii=False) + '\n'
+
+
+def chunked(lines, size=CHUNK_BYTES):
+    """Encodes text lines to UTF-8 and groups them into chunks of about `size` bytes"""
+    buffer = []
+    buffered = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        buffer.append(data)
+        buffered += len(data)
+        if buffered >= size:
+            yield b''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzipped(chunks, level=6):
+    # wbits=31 writes a gzip header/trailer around the deflate stream
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(rows, export_format='csv', gzip=False):
+    """
+    Streams transactions as CSV or NDJSON.
+
+    Args:
+        rows (iterable): Tuples in EXPORT_FIELDS order, typically values_list().iterator()
+        export_format (str): 'csv' or 'ndjson'
+        gzip (bool): Compress the stream with gzip
+
+    Returns:
+        iterator: Byte chunks for a StreamingHttpResponse
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+    lines = csv_lines(rows) if export_format == 'csv' else ndjson_lines(rows)
+    chunks = chunked(lines)
+    if gzip:
+        chunks = gzipped(chunks)
+    return chunks
+
+
+def stream_event(event, data, stream_format):
+    """One event as an NDJSON line ({"event": ..., "data": ...}) or a server-sent event"""
+    payload = json.dumps(data, cls=JSONEncoder, ensure_ascii=False)
+    if stream_format == 'sse':
+        return f'event: {event}\ndata: {payload}\n\n'
+    return f'{{"event": "{event}", "data": {payload}}}\n'
@@ -1,6 +1,6 @@
 from django_filters.rest_framework import FilterSet
 from django_filters import DateFromToRangeFilter
-from .models import Transaction
+from .models import Anomaly, Transaction
 
 
 class TransactionFilters(FilterSet):
@@ -12,3 +12,9 @@ class TransactionFilters(FilterSet):
             'amount': ['gte', 'lte'],
         }
 
+
+
+class AnomalyFilters(FilterSet):
+    class Meta:
+        model = Anomaly
+        fields = ['year', 'month', 'kind', 'category']
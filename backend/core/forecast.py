@@ -0,0 +1,262 @@
+import calendar
+import hashlib
+import io
+import logging
+from datetime import date
+
+import numpy as np
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Q
+
+from .constants import catagory_choices
+from .models import ForecastCurve, RecurringSeries, Transaction
+from .periods import month_range, previous_month
+from . import recurring
+
+
+logger = logging.getLogger(__name__)
+
+
+# Local month-end forecast, no LLM involved. For every past month the user's
+# spending per category is accumulated over the month into BUCKETS points (each
+# a 1/31 of the month, so February and March line up), leaving out the
+# transactions of recurring series. Averaged over the last FORECAST_HISTORY_MONTHS months, these curves say
+# how much of a category's month is usually spent by a given day and how much
+# usually follows.
+#
+# The rest of the current month is projected per category by blending the
+# current pace (spent so far / usual share spent by now) with the usual
+# remaining spend, trusting the pace more the further the month is. Recurring
+# series (core.recurring) still due before the month ends are added as known
+# amounts.
+#
+# Each past month's curve is stored in ForecastCurve and only built when
+# missing: writes to a month drop its curve (see core.signals), and curves built
+# against another set of recurring series are rebuilt. A forecast therefore
+# reads a dozen small rows and the current month's transactions.
+
+# Income is not spending
+CATEGORIES = [key for key, _label in catagory_choices if key != 'income']
+_CATEGORY_INDEX = {category: i for i, category in enumerate(CATEGORIES)}
+BUCKETS = 31
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def bucket(day, days_in_month):
+    """Curve point a day of the month falls in, by its position in the month"""
+    return np.minimum(BUCKETS - 1, -(-np.asarray(day) * BUCKETS // days_in_month) - 1)
+
+
+def dumps(curve):
+    output = io.BytesIO()
+    np.save(output, curve.astype(np.float32), allow_pickle=False)
+    return output.getvalue()
+
+
+def loads(data):
+    return np.load(io.BytesIO(bytes(data)), allow_pickle=False).astype(np.float64)
+
+
+def series_signature(keys):
+    return hashlib.sha256('\n'.join(sorted(keys)).encode('utf-8')).hexdigest()
+
+
+def build_curves(rows, months, recurring_keys):
+    """
+    Cumulative non-recurring spending curves of several months at once.
+
+    Args:
+        rows (iterable): (date, description, amount, category) tuples
+        months (list): (year, month) tuples to build
+        recurring_keys (set): Normalized descriptions of recurring series, left out
+
+    Returns:
+        ndarray: (months x categories x BUCKETS) cumulative amounts
+    """
+    month_index = {month: i for i, month in enumerate(months)}
+    indices, amounts = [], []
+    for day, description, amount, category in rows:
+        position = month_index.get((day.year, day.month))
+        category_index = _CATEGORY_INDEX.get(category)
+        if position is None or category_index is None:
+            continue
+        if recurring_keys and recurring.normalize(description) in recurring_keys:
+            continue
+        days_in_month = calendar.monthrange(day.year, day.month)[1]
+        indices.append((position * len(CATEGORIES) + category_index) * BUCKETS + bucket(day.day, days_in_month))
+        amounts.append(float(amount))
+    size = len(months) * len(CATEGORIES) * BUCKETS
+    daily = np.bincount(np.array(indices, dtype=np.int64), weights=amounts, minlength=size)
+    return np.cumsum(daily.reshape(len(months), len(CATEGORIES), BUCKETS), axis=2)
+
+
+def history_months(user, today):
+    """The past months the forecast learns from, oldest first, none before the user's first transaction"""
+    first = Transaction.objects.filter(user=user).order_by('date').values_list('date', flat=True).first()
+    months = []
+    year, month = today.year, today.month
+    for _ in range(_setting('FORECAST_HISTORY_MONTHS', 12)):
+        year, month = previous_month(year, month)
+        if first is None or (year, month) < (first.year, first.month):
+            break
+        months.append((year, month))
+    return months[::-1]
+
+
+def curves(user, months, recurring_keys):
+    """
+    The stored curves of `months`, building and storing the missing or outdated ones.
+
+    Returns:
+        ndarray: (months x categories x BUCKETS) cumulative amounts
+    """
+    if not months:
+        return np.zeros((0, len(CATEGORIES), BUCKETS))
+    signature = series_signature(recurring_keys)
+    wanted = set(months)
+    stored = {
+        (row.year, row.month): loads(row.cumulative)
+        for row in ForecastCurve.objects.filter(
+            user=user, signature=signature, year__gte=months[0][0]
+        ).only('year', 'month', 'cumulative')
+        if (row.year, row.month) in wanted
+    }
+    missing = [month for month in months if month not in stored]
+    if missing:
+        periods, outdated = Q(), Q()
+        for year, month in missing:
+            start, end = month_range(year, month)
+            periods |= Q(date__gte=start, date__lt=end)
+            outdated |= Q(year=year, month=month)
+        rows = Transaction.objects.filter(periods, user=user).values_list(
+            'date', 'description', 'amount', 'category'
+        )
+        built = build_curves(rows.iterator(chunk_size=2000), missing, recurring_keys)
+        ForecastCurve.objects.filter(outdated, user=user).delete()
+        try:
+            ForecastCurve.objects.bulk_create([
+                ForecastCurve(user=user, year=year, month=month, signature=signature, cumulative=dumps(curve))
+                for (year, month), curve in zip(missing, built)
+            ])
+        except IntegrityError:
+            # Stored by a concurrent forecast meanwhile, the built curves are still used
+            logger.info('Forecast curves of user %s stored concurrently', user.pk)
+        stored.update(zip(missing, built))
+    return np.stack([stored[month] for month in months])
+
+
+def recurring_due(series, today, month_end):
+    """
+    Occurrences of active recurring series expected after `today` and before
+    `month_end`, and overdue ones expected earlier in the month.
+
+    Returns:
+        list: (series, date) tuples
+    """
+    month_start = today.replace(day=1)
+    due = []
+    for item in series:
+        period = next(period for period in recurring.PERIODS if period.name == item.period)
+        expected = item.next_date
+        while expected < month_end:
+            if expected >= month_start and (expected > today or expected > item.last_date):
+                due.append((item, expected))
+            expected = recurring.next_occurrence(expected, period)
+    return due
+
+
+def forecast(user, today=None):
+    """
+    Projects the user's spending per category at the end of the month of `today`.
+
+    Returns:
+        dict: Spent so far, projected further spending, recurring items still due
+              and the month-end forecast per category, with totals
+    """
+    today = today or date.today()
+    month_start, month_end = month_range(today.year, today.month)
+    days_in_month = (month_end - month_start).days
+
+    series = list(RecurringSeries.objects.filter(user=user, active=True))
+    recurring_keys = {item.key for item in series}
+    months = history_months(user, today)
+    history = curves(user, months, recurring_keys)
+
+    spent = np.zeros(len(CATEGORIES))
+    spent_other = np.zeros(len(CATEGORIES))
+    for description, amount, category in user.transactions.filter(
+        date__gte=month_start, date__lte=today
+    ).values_list('description', 'amount', 'category'):
+        index = _CATEGORY_INDEX.get(category)
+        if index is None:
+            continue
+        spent[index] += float(amount)
+        if recurring.normalize(description) not in recurring_keys:
+            spent_other[index] += float(amount)
+
+    projected = np.zeros(len(CATEGORIES))
+    if len(months):
+        usual_total = history[:, :, -1].mean(axis=0)
+        usual_by_now = history[:, :, bucket(today.day, days_in_month)].mean(axis=0)
+        usual_remaining = usual_total - usual_by_now
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share = np.where(usual_total > 0, usual_by_now / usual_total, 0.0)
+            pace_remaining = np.where(share > 0, spent_other / share - spent_other, usual_remaining)
+        projected = np.maximum(share * pace_remaining + (1 - share) * usual_remaining, 0.0)
+
+    due_amounts = np.zeros(len(CATEGORIES))
+    due_items = []
+    for item, expected in recurring_due(series, today, month_end):
+        index = _CATEGORY_INDEX.get(item.category)
+        if index is None:
+            continue
+        due_amounts[index] += float(item.amount)
+        due_items.append({
+            'description': item.description,
+            'category': item.category,
+            'date': expected.isoformat(),
+            'amount': round(float(item.amount), 2),
+        })
+
+    total = spent + projected + due_amounts
+    categories = [
+        {
+            'category': category,
+            'spent': round(float(spent[i]), 2),
+            'projected': round(float(projected[i]), 2),
+            'recurring_due': round(float(due_amounts[i]), 2),
+            'forecast': round(float(total[i]), 2),
+        }
+        for i, category in enumerate(CATEGORIES)
+        if total[i] > 0
+    ]
+    categories.sort(key=lambda item: item['forecast'], reverse=True)
+    return {
+        'year': today.year,
+        'month': today.month,
+        'as_of': today.isoformat(),
+        'days_left': (month_end - today).days - 1,
+        'history_months': len(months),
+        'spent': round(float(spent.sum()), 2),
+        'forecast': round(float(total.sum()), 2),
+        'categories': categories,
+        'recurring_due': due_items,
+    }
+
+
+def invalidate(months):
+    """
+    Drops the stored curves of changed months.
+
+    Args:
+        months (iterable): (user_id, year, month) tuples
+    """
+    condition = Q()
+    for user_id, year, month in months:
+        condition |= Q(user_id=user_id, year=year, month=month)
+    if condition:
+        ForecastCurve.objects.filter(condition).delete()
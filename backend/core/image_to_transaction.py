@@ -1,41 +1,101 @@
 from google import genai
-import json
+import asyncio
 
-from .constants import catagory_choices
+from . import llm_client, receipt_images, structured_output
+from .json_stream import JSONArrayStream
 
-def image_to_transaction(image_bytes, api_key):
-    client = genai.Client(api_key=api_key)
 
-    response = client.models.generate_content(
-        model='gemini-2.5-flash',
-        contents=[
+RECEIPT_MODEL = 'gemini-2.5-flash'
+
+
+def build_receipt_contents(image):
+    # `image` is a receipt_images.PreparedImage. The output format (fields, ISO
+    # dates, category keys) is set by the response schema, see core.structured_output
+    return [
         genai.types.Part.from_bytes(
-            data=image_bytes,
-            mime_type='image/jpeg',
+            data=image.data,
+            mime_type=image.mime_type,
         ),
         'Make a transaction list from this receipt.',
-        '''Output Format:[
-            {"date": "YYYY-MM-DD", "description": "Burger King - Burger", "amount": 32, "category": "Food"},
-            {"date": "YYYY-MM-DD", "description": "Burger King - Frenchfries", "amount": 13, "category": "Food"},
-            ...]
-        ''',
-        'Categories: ['
-        + ', '.join([f'"{category}"' for category in catagory_choices])
-        + ']'
-        ]
+        'One transaction per line item, described as "Store - Item", e.g. "Burger King - Burger".',
+    ]
+
+
+def image_to_transaction(image_bytes, api_key, prepared=None):
+    """
+    Extracts the transactions from a receipt image with Gemini.
+
+    Args:
+        image_bytes (bytes): The uploaded image
+        api_key (str): API key for Gemini AI
+        prepared (PreparedImage, optional): receipt_images.prepare(image_bytes),
+            when the caller already has it
+
+    Returns:
+        list: Transaction dicts (date, description, amount, category)
+    """
+    contents = build_receipt_contents(prepared or receipt_images.prepare(image_bytes))
+    response = llm_client.generate_content(
+        api_key, RECEIPT_MODEL, contents, task=llm_client.TASK_RECEIPT,
+        config=structured_output.response_config(llm_client.TASK_RECEIPT),
     )
+    return structured_output.parse(llm_client.TASK_RECEIPT, response.text)
+
+
+async def image_to_transaction_async(image_bytes, api_key, timeout=None, prepared=None):
+    """
+    Async variant of image_to_transaction using the async Gemini client.
+
+    Raises:
+        asyncio.TimeoutError: Gemini did not answer within `timeout` seconds
+    """
+    contents = build_receipt_contents(prepared or await receipt_images.aprepare(image_bytes))
+    response = await asyncio.wait_for(
+        llm_client.agenerate_content(
+            api_key, RECEIPT_MODEL, contents, task=llm_client.TASK_RECEIPT,
+            config=structured_output.response_config(llm_client.TASK_RECEIPT),
+        ),
+        timeout=timeout,
+    )
+    return structured_output.parse(llm_client.TASK_RECEIPT, response.text)
+
+
+def stream_image_to_transaction(image_bytes, api_key, prepared=None):
+    """
+    Streaming variant of image_to_transaction: yields each transaction as soon
+    as its object closes in the model output, before the rest is generated.
+
+    Raises:
+        ValueError: The answer is not a JSON array of transactions
+    """
+    contents = build_receipt_contents(prepared or receipt_images.prepare(image_bytes))
+    array = JSONArrayStream(decode=structured_output.parse_receipt_line)
+    try:
+        for text in llm_client.generate_content_stream(
+            api_key, RECEIPT_MODEL, contents, task=llm_client.TASK_RECEIPT,
+            config=structured_output.response_config(llm_client.TASK_RECEIPT),
+        ):
+            yield from array.feed(text)
+        array.close()
+    except ValueError as e:
+        structured_output.record(llm_client.TASK_RECEIPT, e)
+        raise
+    structured_output.record(llm_client.TASK_RECEIPT)
+
 
-    # Parse the response - remove markdown formatting
-    response_text = response.text.strip()
-    
-    # Remove markdown code block formatting if present
-    if response_text.startswith('```json'):
-        response_text = response_text[7:]  # Remove '```json'
-    if response_text.endswith('```'):
-        response_text = response_text[:-3]  # Remove '```'
-    
-    # Clean any extra whitespace
-    response_text = response_text.strip()
-    
-    transactions = json.loads(response_text)
-    return transactions
+async def stream_image_to_transaction_async(image_bytes, api_key, prepared=None):
+    """Async variant of stream_image_to_transaction"""
+    contents = build_receipt_contents(prepared or await receipt_images.aprepare(image_bytes))
+    array = JSONArrayStream(decode=structured_output.parse_receipt_line)
+    try:
+        async for text in llm_client.agenerate_content_stream(
+            api_key, RECEIPT_MODEL, contents, task=llm_client.TASK_RECEIPT,
+            config=structured_output.response_config(llm_client.TASK_RECEIPT),
+        ):
+            for transaction in array.feed(text):
+                yield transaction
+        array.close()
+    except ValueError as e:
+        structured_output.record(llm_client.TASK_RECEIPT, e)
+        raise
+    structured_output.record(llm_client.TASK_RECEIPT)
@@ -0,0 +1,376 @@
+import csv
+import io
+import re
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import connections, router, transaction
+
+from .constants import catagory_choices, category_aliases
+from .models import Transaction
+from . import rollups
+from .signals import transactions_changed
+
+try:
+    from psycopg2.extras import execute_values
+except ImportError:
+    execute_values = None
+
+
+IMPORT_FORMATS = ('csv', 'ofx')
+DEFAULT_BATCH_SIZE = 5000
+MAX_AMOUNT = Decimal('99999999.99')  # max_digits=10, decimal_places=2
+MAX_ERRORS_REPORTED = 100
+INSERT_COLUMNS = ('user_id', 'category', 'date', 'description', 'amount', 'is_recurring', 'category_guessed')
+
+CSV_COLUMNS = {
+    'date': ('date', 'transaction date', 'posted date', 'posting date', 'value date', 'dtposted'),
+    'description': ('description', 'memo', 'payee', 'name', 'narration', 'details', 'merchant'),
+    'amount': ('amount', 'value', 'trnamt'),
+    'debit': ('debit', 'withdrawal', 'money out'),
+    'credit': ('credit', 'deposit', 'money in'),
+    'category': ('category',),
+    # Direction of the amount, never a category (DEBIT/CREDIT, DR/CR)
+    'type': ('type', 'transaction type', 'trntype', 'dr/cr'),
+    'is_recurring': ('is_recurring', 'recurring'),
+}
+
+DEBIT_TYPES = frozenset(('debit', 'dr', 'd', 'withdrawal', 'payment', 'pos', 'atm', 'fee', 'check', 'cheque'))
+CREDIT_TYPES = frozenset(('credit', 'cr', 'c', 'deposit', 'dep', 'interest'))
+
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%d-%m-%Y', '%Y/%m/%d', '%Y%m%d')
+
+_CATEGORY_LOOKUP = {}
+for _key, _label in catagory_choices:
+    _CATEGORY_LOOKUP[_key] = _key
+    _CATEGORY_LOOKUP[_label.lower()] = _key
+_CATEGORY_LOOKUP.update(category_aliases)
+
+_TRUE_VALUES = frozenset(('1', 'true', 'yes', 'y', 't'))
+
+
+class StatementImportError(Exception):
+    pass
+
+
+def detect_format(filename, default='csv'):
+    name = (filename or '').lower()
+    if name.endswith(('.ofx', '.qfx')):
+        return 'ofx'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def map_category(raw):
+    """Maps a free-text category onto a catagory_choices key, or None if unknown"""
+    if not raw:
+        return None
+    return _CATEGORY_LOOKUP.get(raw.strip().lower())
+
+
+# ---------------------------------------------------------------------------
+# Streaming parsers. Both yield (line, date, description, amount, category, recurring)
+# tuples of raw strings; validation happens later, a chunk at a time.
+# ---------------------------------------------------------------------------
+
+def _text_stream(fileobj):
+    if isinstance(fileobj, io.TextIOBase):
+        return fileobj
+    return io.TextIOWrapper(fileobj, encoding='utf-8-sig', errors='replace', newline='')
+
+
+def parse_csv(fileobj):
+    reader = csv.reader(_text_stream(fileobj))
+    header = next(reader, None)
+    if not header:
+        return
+    header = [column.strip().lower() for column in header]
+
+    def find(name):
+        for alias in CSV_COLUMNS[name]:
+            if alias in header:
+                return header.index(alias)
+        return None
+
+    columns = {name: find(name) for name in CSV_COLUMNS}
+    if columns['date'] is None or columns['description'] is None:
+        raise StatementImportError("CSV needs a date and a description column")
+    if columns['amount'] is None and columns['debit'] is None and columns['credit'] is None:
+        raise StatementImportError("CSV needs an amount column or debit/credit columns")
+
+    def cell(row, name):
+        index = columns[name]
+        if index is None or index >= len(row):
+            return ''
+        return row[index]
+
+    for line, row in enumerate(reader, start=2):
+        if not row:
+            continue
+        amount = cell(row, 'amount')
+        if not amount:
+            # Separate debit/credit columns: debits become negative amounts
+            debit, credit = cell(row, 'debit').strip(), cell(row, 'credit').strip()
+            amount = f'-{debit}' if debit else credit
+        else:
+            # Unsigned amounts with a type column: debits become negative amounts
+            kind = cell(row, 'type').strip().lower()
+            if kind in DEBIT_TYPES and not amount.strip().startswith(('-', '(')):
+                amount = f'-{amount.strip()}'
+            elif kind in CREDIT_TYPES:
+                amount = amount.strip().lstrip('-').strip('()')
+        yield (
+            line,
+            cell(row, 'date'),
+            cell(row, 'description'),
+            amount,
+            cell(row, 'category'),
+            cell(row, 'is_recurring'),
+        )
+
+
+_OFX_TOKEN = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+
+def parse_ofx(fileobj, read_size=64 * 1024):
+    """
+    Incremental OFX parser for both the SGML (1.x, unclosed tags) and XML (2.x) dialects.
+    Only STMTTRN blocks are interpreted.
+    """
+    stream = _text_stream(fileobj)
+    buffer = ''
+    current = None
+    index = 0
+
+    def finish(record):
+        description = record.get('NAME') or record.get('MEMO') or record.get('PAYEE') or ''
+        if record.get('NAME') and record.get('MEMO') and record['MEMO'] != record['NAME']:
+            description = f"{record['NAME']} - {record['MEMO']}"
+        return (index, record.get('DTPOSTED', ''), description, record.get('TRNAMT', ''), '', '')
+
+    while True:
+        data = stream.read(read_size)
+        buffer += data
+        # Keep a possibly incomplete trailing tag for the next read
+        cut = buffer.rfind('<') if data else len(buffer)
+        if cut <= 0 and data:
+            continue
+        complete, buffer = buffer[:cut], buffer[cut:]
+
+        for closing, tag, value in _OFX_TOKEN.findall(complete):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if current is not None:
+                    index += 1
+                    yield finish(current)
+                current = None if closing else {}
+            elif current is not None and not closing:
+                current[tag] = value.strip()
+        if not data:
+            break
+
+    if current is not None:
+        index += 1
+        yield finish(current)
+
+
+PARSERS = {
+    'csv': parse_csv,
+    'ofx': parse_ofx,
+}
+
+
+# ---------------------------------------------------------------------------
+# Columnar validation
+# ---------------------------------------------------------------------------
+
+def _parse_date(raw):
+    raw = raw.strip()
+    if len(raw) >= 8 and raw[:8].isdigit():
+        # OFX dates: YYYYMMDD[HHMMSS[.XXX][TZ]]
+        return date(int(raw[:4]), int(raw[4:6]), int(raw[6:8]))
+    try:
+        return date.fromisoformat(raw[:10])
+    except ValueError:
+        pass
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(raw, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError
+
+
+def _parse_amount(raw):
+    raw = raw.strip().replace(',', '').replace(' ', '')
+    if raw.startswith('(') and raw.endswith(')'):
+        raw = '-' + raw[1:-1]
+    amount = Decimal(raw)
+    if not amount.is_finite():
+        raise ValueError
+    return amount.quantize(Decimal('0.01'))
+
+
+def _column(parse, values, lines, errors, message):
+    """Parses one column; unparseable cells become None and are reported once"""
+    parsed = []
+    append = parsed.append
+    for line, value in zip(lines, values):
+        try:
+            append(parse(value))
+        except (ValueError, InvalidOperation, TypeError):
+            append(None)
+            errors.append({'line': line, 'error': message})
+    return parsed
+
+
+def validate_chunk(rows, categorize=None):
+    """
+    Validates a chunk of parsed rows column by column instead of row by row.
+
+    Args:
+        rows (list): Tuples from one of the parsers
+        categorize (callable, optional): Fallback for rows whose category cannot be
+            mapped, receives a list of descriptions and returns category keys
+
+    Returns:
+        tuple: (valid (date, description, amount, category, is_recurring,
+        category_guessed) tuples, list of {'line', 'error'} dicts)
+    """
+    if not rows:
+        return [], []
+    lines, raw_dates, raw_descriptions, raw_amounts, raw_categories, raw_recurring = zip(*rows)
+    errors = []
+
+    dates = _column(_parse_date, raw_dates, lines, errors, 'Invalid date')
+    amounts = _column(_parse_amount, raw_amounts, lines, errors, 'Invalid amount')
+    descriptions = [value.strip()[:255] for value in raw_descriptions]
+    categories = [map_category(value) for value in raw_categories]
+    # Rows without a usable category of their own get a guessed one below
+    guessed = [category is None for category in categories]
+    recurring = [value.strip().lower() in _TRUE_VALUES for value in raw_recurring]
+
+    # Signed amounts carry the direction when the file has no usable category
+    for i, amount in enumerate(amounts):
+        if amount is not None and categories[i] is None and amount > 0 and not raw_categories[i].strip():
+            categories[i] = 'income'
+
+    unknown = [i for i, category in enumerate(categories) if category is None]
+    if unknown and categorize is not None:
+        guesses = categorize([descriptions[i] for i in unknown])
+        for i, guess in zip(unknown, guesses):
+            categories[i] = guess
+    for i in unknown:
+        if categories[i] is None:
+            categories[i] = 'miscellaneous'
+
+    valid = []
+    for i, line in enumerate(lines):
+        day, amount, description = dates[i], amounts[i], descriptions[i]
+        if day is None or amount is None:
+            continue
+        amount = abs(amount)
+        if not description:
+            errors.append({'line': line, 'error': 'Missing description'})
+        elif amount == 0:
+            errors.append({'line': line, 'error': 'Amount must be greater than zero.'})
+        elif amount > MAX_AMOUNT:
+            errors.append({'line': line, 'error': 'Amount is too large'})
+        else:
+            valid.append((day, description, amount, categories[i], recurring[i], guessed[i]))
+    return valid, errors
+
+
+# ---------------------------------------------------------------------------
+# Pipeline
+# ---------------------------------------------------------------------------
+
+def insert_rows(user_id, rows, using=None):
+    """
+    Inserts validated rows with a single executemany, without instantiating
+    Transaction objects. Model signals are not sent, like bulk_create.
+    """
+    if not rows:
+        return
+    connection = connections[using or router.db_for_write(Transaction)]
+    ops = connection.ops
+    table = ops.quote_name(Transaction._meta.db_table)
+    columns = ', '.join(ops.quote_name(name) for name in INSERT_COLUMNS)
+
+    params = [
+        (user_id, category, ops.adapt_datefield_value(day), description,
+         ops.adapt_decimalfield_value(amount), is_recurring, category_guessed)
+        for day, description, amount, category, is_recurring, category_guessed in rows
+    ]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql' and execute_values is not None:
+            # One multi-row INSERT per page instead of a round trip per row
+            execute_values(cursor.cursor, f'INSERT INTO {table} ({columns}) VALUES %s', params, page_size=1000)
+        else:
+            placeholders = ', '.join(['%s'] * len(INSERT_COLUMNS))
+            cursor.executemany(f'INSERT INTO {table} ({columns}) VALUES ({placeholders})', params)
+
+
+def import_transactions(user, fileobj, file_format='csv', batch_size=DEFAULT_BATCH_SIZE,
+                        progress=None, categorize=None):
+    """
+    Streams a statement file into the Transaction table in batches.
+
+    Each batch is validated column-wise and inserted with one executemany in its
+    own database transaction. Rollup deltas are accumulated across batches and
+    applied once at the end, or for the committed batches if the import fails.
+    The rows are not scored for anomalies on insert, unlike transactions saved
+    or bulk-created through the API: they wait for the next score_anomalies run
+    (core.anomalies), typically nightly.
+
+    Args:
+        user (User): Owner of the imported transactions
+        fileobj (file): Binary or text file object
+        file_format (str): 'csv' or 'ofx'
+        batch_size (int): Rows per validation/insert chunk
+        progress (callable, optional): Called with each chunk's report dict
+        categorize (callable, optional): Passed through to validate_chunk
+
+    Returns:
+        dict: Totals, the first errors and per-chunk reports
+    """
+    if file_format not in PARSERS:
+        raise StatementImportError(f"Unsupported import format: {file_format}")
+    rows = PARSERS[file_format](fileobj)
+
+    result = {'inserted': 0, 'rejected': 0, 'errors': [], 'chunks': []}
+    deltas = None
+    chunk_number = 0
+    try:
+        while True:
+            chunk = list(islice(rows, batch_size))
+            if not chunk:
+                break
+            chunk_number += 1
+            valid, errors = validate_chunk(chunk, categorize=categorize)
+
+            with transaction.atomic():
+                insert_rows(user.pk, valid)
+            deltas = rollups.collect_deltas(
+                ({'user_id': user.pk, 'date': row[0], 'amount': row[2], 'category': row[3], 'is_recurring': row[4]}
+                 for row in valid),
+                deltas=deltas,
+            )
+
+            report = {'chunk': chunk_number, 'rows': len(chunk), 'inserted': len(valid), 'rejected': len(errors)}
+            result['inserted'] += len(valid)
+            result['rejected'] += len(errors)
+            room = MAX_ERRORS_REPORTED - len(result['errors'])
+            if room > 0:
+                result['errors'].extend(errors[:room])
+            result['chunks'].append(report)
+            if progress is not None:
+                progress(report)
+    finally:
+        if deltas:
+            with transaction.atomic():
+                months = rollups.apply_deltas(deltas)
+            transactions_changed.send(sender=Transaction, months=months)
+    return result
@@ -0,0 +1,323 @@
+import json
+import logging
+import random
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+
+# Database-backed job queue, no broker needed. Requests submit() a Job; the
+# run_jobworker command claim()s runnable jobs and execute()s them on a thread
+# or process pool. On PostgreSQL a claim is SELECT ... FOR UPDATE SKIP LOCKED,
+# so workers never wait on each other; elsewhere (SQLite) it is a conditional
+# UPDATE that only one worker can win. A claim is a lease: if the worker dies,
+# the job becomes claimable again once the lease expires. While a handler runs,
+# execute() renews the lease every third of JOB_LEASE_SECONDS, and every claim
+# has its own lease_holder() id, so only the latest claim may finish a job.
+#
+# Failed jobs are retried with exponential backoff up to max_attempts, then
+# kept with status "dead" (the dead letters) until retried by hand.
+
+# Runnable jobs read per claim attempt when SKIP LOCKED is not available
+CLAIM_CANDIDATES = 5
+
+
+class PermanentJobError(Exception):
+    """A failure that retrying cannot fix, the job goes straight to dead"""
+
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Registers the function running jobs of `kind`, it returns the JSON result"""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def _lease_seconds():
+    return getattr(settings, 'JOB_LEASE_SECONDS', 600)
+
+
+def lease_holder(worker):
+    """A unique id for one claim by `worker`, e.g. host:pid:1a2b3c4d"""
+    return f'{worker}:{uuid.uuid4().hex[:8]}'
+
+
+def submit(user, kind, payload=None, input_file=None, priority=0, max_attempts=None):
+    """
+    Queues a job.
+
+    Args:
+        user (User): Owner of the job
+        kind (str): One of Job.KIND_CHOICES
+        payload (dict, optional): Handler arguments
+        input_file (File, optional): Uploaded input, e.g. a receipt image
+        priority (int, optional): Higher runs first
+        max_attempts (int, optional): Defaults to settings.JOB_MAX_ATTEMPTS
+
+    Returns:
+        Job: The queued job
+    """
+    job = Job(
+        user=user,
+        kind=kind,
+        payload=payload or {},
+        priority=priority,
+        max_attempts=max_attempts or getattr(settings, 'JOB_MAX_ATTEMPTS', 3),
+    )
+    if input_file is not None:
+        job.input_file.save(input_file.name, input_file, save=False)
+    job.save()
+    return job
+
+
+def claim(worker, kinds=None, lease_seconds=None):
+    """
+    Leases the next runnable job to `worker`.
+
+    Runnable are queued jobs whose run_after has passed and running jobs whose
+    lease expired. The highest priority wins, then the oldest.
+
+    Returns:
+        Job or None: The claimed job, its attempts already counted
+    """
+    now = timezone.now()
+    lease = now + timedelta(seconds=lease_seconds or _lease_seconds())
+    runnable = Job.objects.filter(
+        Q(status=Job.STATUS_QUEUED, run_after__lte=now)
+        | Q(status=Job.STATUS_RUNNING, lease_expires_at__lt=now)
+    )
+    if kinds:
+        runnable = runnable.filter(kind__in=kinds)
+    runnable = runnable.order_by('-priority', 'run_after', 'id')
+    claimed = dict(
+        status=Job.STATUS_RUNNING, worker=worker, lease_expires_at=lease,
+        attempts=F('attempts') + 1, started_at=now,
+    )
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = runnable.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            Job.objects.filter(pk=job.pk).update(**claimed)
+    else:
+        # Compare-and-swap: the update only matches while nobody else claimed the job
+        for job in runnable[:CLAIM_CANDIDATES]:
+            if Job.objects.filter(
+                pk=job.pk, status=job.status, attempts=job.attempts, worker=job.worker
+            ).update(**claimed):
+                break
+        else:
+            return None
+
+    job.refresh_from_db()
+    return job
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter after the `attempts`-th failed attempt"""
+    base = getattr(settings, 'JOB_RETRY_BACKOFF', 30)
+    delay = base * 2 ** (attempts - 1)
+    return delay * random.uniform(0.5, 1.5)
+
+
+def _owned(job, worker):
+    # Only the current lease holder may finish a job
+    return Job.objects.filter(pk=job.pk, status=Job.STATUS_RUNNING, worker=worker)
+
+
+def renew(job, worker, lease_seconds=None):
+    """
+    Extends the lease of a job `worker` holds.
+
+    Returns:
+        bool: False if the lease was lost to another worker meanwhile
+    """
+    lease = timezone.now() + timedelta(seconds=lease_seconds or _lease_seconds())
+    return bool(_owned(job, worker).update(lease_expires_at=lease))
+
+
+class _Heartbeat(threading.Thread):
+    """Renews a job's lease until stopped, so handlers may run longer than a lease"""
+
+    def __init__(self, job, worker):
+        super().__init__(name=f'job-{job.pk}-lease', daemon=True)
+        self.job = job
+        self.worker = worker
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(_lease_seconds() / 3):
+                if not renew(self.job, self.worker):
+                    logger.warning('Job %s (%s) lost its lease', self.job.pk, self.job.kind)
+                    return
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def _succeed(job, worker, result):
+    updated = _owned(job, worker).update(
+        status=Job.STATUS_SUCCEEDED,
+        result=json.loads(json.dumps(result, cls=JSONEncoder)),
+        result_file=job.result_file.name or '',
+        error='',
+        lease_expires_at=None,
+        finished_at=timezone.now(),
+    )
+    if updated and job.input_file:
+        job.input_file.delete(save=False)
+        Job.objects.filter(pk=job.pk).update(input_file='')
+    return Job.STATUS_SUCCEEDED if updated else None
+
+
+def _fail(job, worker, error):
+    now = timezone.now()
+    permanent = isinstance(error, PermanentJobError)
+    if permanent or job.attempts >= job.max_attempts:
+        logger.warning('Job %s (%s) is dead after %d attempts: %s', job.pk, job.kind, job.attempts, error)
+        updated = _owned(job, worker).update(
+            status=Job.STATUS_DEAD, error=str(error), lease_expires_at=None, finished_at=now,
+        )
+        return Job.STATUS_DEAD if updated else None
+
+    delay = retry_delay(job.attempts)
+    logger.info('Job %s (%s) failed, retrying in %.0fs: %s', job.pk, job.kind, delay, error)
+    updated = _owned(job, worker).update(
+        status=Job.STATUS_QUEUED, error=str(error), worker='', lease_expires_at=None,
+        run_after=now + timedelta(seconds=delay),
+    )
+    return Job.STATUS_QUEUED if updated else None
+
+
+def execute(job_id, worker):
+    """
+    Runs a claimed job and records the outcome. Runs on the worker pools, so it
+    only takes picklable arguments.
+
+    Returns:
+        str or None: The job's new status, None if the lease was lost meanwhile
+    """
+    try:
+        job = Job.objects.select_related('user').get(pk=job_id)
+        if job.attempts > job.max_attempts:
+            # Workers kept dying while holding it
+            return _fail(job, worker, PermanentJobError('Lease expired on every attempt'))
+
+        run = HANDLERS.get(job.kind)
+        heartbeat = _Heartbeat(job, worker)
+        heartbeat.start()
+        try:
+            if run is None:
+                raise PermanentJobError(f'No handler for {job.kind} jobs')
+            result = run(job)
+        except Exception as e:
+            return _fail(job, worker, e)
+        finally:
+            heartbeat.stop()
+        return _succeed(job, worker, result)
+    finally:
+        # Pool threads must not keep connections open between jobs
+        connection.close()
+
+
+def retry(job):
+    """Puts a dead job back in the queue with fresh attempts"""
+    return Job.objects.filter(pk=job.pk, status=Job.STATUS_DEAD).update(
+        status=Job.STATUS_QUEUED, attempts=0, error='', worker='',
+        run_after=timezone.now(), finished_at=None,
+    )
+
+
+def _period(job):
+    try:
+        return int(job.payload['year']), int(job.payload['month'])
+    except (KeyError, TypeError, ValueError):
+        raise PermanentJobError('payload needs a year and a month')
+
+
+@handler(Job.KIND_ANALYSIS)
+def run_analysis(job):
+    from .views import month_analysis
+
+    year, month = _period(job)
+    result = month_analysis(job.user, year, month)
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    return result
+
+
+@handler(Job.KIND_RECEIPT)
+def run_receipt(job):
+    from .views import receipt_transactions, receipt_response_data
+
+    if not job.input_file:
+        raise PermanentJobError('No image file provided.')
+    with job.input_file.open('rb') as image_file:
+        image_bytes = image_file.read()
+    try:
+        transactions_data = receipt_transactions(job.user, image_bytes)
+    except ValueError as e:
+        # The model answered with something that is not a transaction list
+        raise PermanentJobError(f'Failed to extract transactions from image: {e}')
+    if not transactions_data:
+        raise PermanentJobError('Failed to extract transactions from image.')
+    return receipt_response_data(job.user, transactions_data)
+
+
+@handler(Job.KIND_PDF)
+def run_pdf(job):
+    from .views import month_pdf
+
+    year, month = _period(job)
+    pdf_data = month_pdf(job.user, year, month)
+    if pdf_data is None:
+        raise PermanentJobError(f'No transactions found for {year}-{month:02d}')
+    filename = f'transactions_{year}_{month:02d}.pdf'
+    job.result_file.save(filename, ContentFile(pdf_data), save=False)
+    return {'filename': filename, 'size': len(pdf_data)}
+
+
+@handler(Job.KIND_RECURRING)
+def run_recurring(job):
+    from .recurring import detect_user
+
+    # Queued by writes with the months they changed, without them (submitted
+    # through the API) every series is re-detected
+    months = job.payload.get('months')
+    if months is not None:
+        try:
+            months = [(int(value[:4]), int(value[5:7])) for value in months]
+        except (TypeError, ValueError):
+            raise PermanentJobError('payload months must be YYYY-MM strings')
+    return {'series': detect_user(job.user_id, months=months)}
+
+
+@handler(Job.KIND_CATEGORIZER)
+def run_categorizer(job):
+    from .categorizer import train
+
+    # The global model learns every user's new rows, whichever job gets to them first
+    personal = train(job.user_id)
+    shared = train(None)
+    return {'examples': personal.examples, 'global_examples': shared.examples}
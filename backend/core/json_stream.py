@@ -0,0 +1,84 @@
+import json
+
+
+class JSONArrayStream:
+    """
+    Incremental parser for a JSON array arriving in chunks, e.g. a streamed LLM
+    answer. feed() returns the array elements completed by the chunk, so each
+    one can be handed on as soon as it closes instead of after the whole answer.
+
+    Text before the opening bracket (a ```json fence) and after the closing one
+    is ignored, as are scalar elements: only objects and arrays are returned.
+    Only the element currently being read is buffered. `decode` turns each
+    element's text into the returned value, json.loads by default.
+
+        stream = JSONArrayStream()
+        for chunk in chunks:
+            for item in stream.feed(chunk):
+                ...
+        stream.close()
+    """
+
+    def __init__(self, decode=json.loads):
+        self.decode = decode
+        self.started = False
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.buffer = []
+
+    def feed(self, text):
+        """
+        Args:
+            text (str): Next chunk of the answer
+
+        Returns:
+            list: Elements completed in this chunk, decoded
+
+        Raises:
+            ValueError: A completed element could not be decoded
+        """
+        items = []
+        # Start of the current element within `text`
+        mark = 0 if self.depth else None
+        for i, char in enumerate(text):
+            if self.finished:
+                break
+            if not self.started:
+                self.started = char == '['
+                continue
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in '{[':
+                if not self.depth:
+                    mark = i
+                self.depth += 1
+            elif char in '}]':
+                if not self.depth:
+                    # The array's own closing bracket
+                    self.finished = char == ']'
+                    continue
+                self.depth -= 1
+                if not self.depth:
+                    self.buffer.append(text[mark:i + 1])
+                    items.append(self.decode(''.join(self.buffer)))
+                    self.buffer = []
+                    mark = None
+        if self.depth and mark is not None:
+            self.buffer.append(text[mark:])
+        return items
+
+    def close(self):
+        """Raises ValueError unless a complete array was read"""
+        if not self.started:
+            raise ValueError('No JSON array in the response')
+        if not self.finished:
+            raise ValueError('The JSON array in the response is incomplete')
@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from datetime import date
+
+from django.conf import settings
+from google.genai import errors as genai_errors
+
+from . import llm_client
+
+
+# LLM backends behind core.llm_client, selected with settings.LLM_BACKEND.
+# A backend answers generate_content(api_key, model, contents, task) with an
+# object whose `text` is the raw model output, generate_content_stream with an
+# iterator of such objects holding consecutive pieces of it. Retries, the
+# circuit breaker and parsing stay in llm_client and the calling modules, so
+# they run unchanged against every backend.
+
+
+class GeminiBackend:
+    """Google Gemini through the pooled clients of core.llm_client"""
+
+    def generate_content(self, api_key, model, contents, task=None, config=None):
+        client = llm_client.get_client(api_key)
+        return client.models.generate_content(model=model, contents=contents, config=config)
+
+    async def agenerate_content(self, api_key, model, contents, task=None, config=None):
+        client = llm_client.get_async_client(api_key)
+        return await client.aio.models.generate_content(model=model, contents=contents, config=config)
+
+    def generate_content_stream(self, api_key, model, contents, task=None, config=None):
+        client = llm_client.get_client(api_key)
+        return client.models.generate_content_stream(model=model, contents=contents, config=config)
+
+    async def agenerate_content_stream(self, api_key, model, contents, task=None, config=None):
+        client = llm_client.get_async_client(api_key)
+        async for chunk in await client.aio.models.generate_content_stream(model=model, contents=contents, config=config):
+            yield chunk
+
+
+class FakeResponse:
+
+    def __init__(self, text):
+        self.text = text
+
+
+_SUMMARY = re.compile(r'MONTH SUMMARY: (\{.*\})\s*$', re.MULTILINE)
+_PERIOD = re.compile(r'ANALYSED MONTH: (\S+)')
+# Characters per streamed chunk of a fake answer
+STREAM_CHUNK_CHARS = 32
+# (description, catagory_choices key) pairs for fake receipt lines
+_MERCHANTS = [
+    ('Shwapno Supershop', 'food'),
+    ('Pathao Ride', 'transport'),
+    ('Star Kabab', 'food'),
+    ('Desco Electricity', 'utilities'),
+    ('Aarong', 'clothing'),
+    ('Lazz Pharma', 'health'),
+    ('Rokomari Books', 'education'),
+    ('Star Cineplex', 'entertainment'),
+]
+
+
+class FakeBackend:
+    """
+    Deterministic offline stand-in for Gemini, for tests and load benchmarks.
+
+    The answer only depends on the prompt (the analysis summary or the receipt
+    bytes) and has the shape the real prompts ask for. Latency and failures
+    are drawn from a seeded generator; a streamed answer arrives in chunks
+    spread evenly over the drawn latency:
+
+        LLM_FAKE_LATENCY          'fixed', 'uniform', 'normal' or 'lognormal'
+        LLM_FAKE_LATENCY_MS       median latency in milliseconds
+        LLM_FAKE_LATENCY_SPREAD   relative spread (sigma for lognormal)
+        LLM_FAKE_ERROR_RATE       share of calls failing with a 429 or 503
+        LLM_FAKE_MALFORMED_RATE   share of answers cut off halfway, i.e. unparseable
+        LLM_FAKE_SEED             seed of the latency/error sequence
+    """
+
+    def __init__(self):
+        self.distribution = getattr(settings, 'LLM_FAKE_LATENCY', 'lognormal')
+        self.median = getattr(settings, 'LLM_FAKE_LATENCY_MS', 800) / 1000
+        self.spread = getattr(settings, 'LLM_FAKE_LATENCY_SPREAD', 0.5)
+        self.error_rate = getattr(settings, 'LLM_FAKE_ERROR_RATE', 0.0)
+        self.malformed_rate = getattr(settings, 'LLM_FAKE_MALFORMED_RATE', 0.0)
+        self.random = random.Random(getattr(settings, 'LLM_FAKE_SEED', 0))
+        self._lock = threading.Lock()
+
+    def sample(self):
+        """
+        Draws the next call's latency and outcome.
+
+        Returns:
+            tuple: (latency in seconds, HTTP error code or None, whether the answer is malformed)
+        """
+        with self._lock:
+            if self.distribution == 'fixed':
+                latency = self.median
+            elif self.distribution == 'uniform':
+                latency = self.random.uniform(self.median * (1 - self.spread), self.median * (1 + self.spread))
+            elif self.distribution == 'normal':
+                latency = self.random.gauss(self.median, self.median * self.spread)
+            else:
+                latency = self.median * self.random.lognormvariate(0, self.spread)
+            error = None
+            if self.random.random() < self.error_rate:
+                error = self.random.choice((429, 503))
+            malformed = self.random.random() < self.malformed_rate
+        return max(0.0, latency), error, malformed
+
+    def raise_error(self, code):
+        status = 'RESOURCE_EXHAUSTED' if code == 429 else 'UNAVAILABLE'
+        response_json = {'error': {'code': code, 'message': f'Fake {status.lower()}', 'status': status}}
+        error_class = genai_errors.ClientError if code < 500 else genai_errors.ServerError
+        raise error_class(code, response_json)
+
+    def answer(self, contents, task, malformed=False):
+        # Plain JSON, like Gemini answers with a response schema
+        if task == llm_client.TASK_RECEIPT:
+            text = json.dumps(self.receipt(contents))
+        else:
+            text = json.dumps(self.analysis(contents))
+        if malformed:
+            # As if the answer hit the output token limit
+            text = text[:len(text) // 2]
+        return FakeResponse(text)
+
+    def analysis(self, contents):
+        prompt = contents if isinstance(contents, str) else ' '.join(str(part) for part in contents)
+        match = _SUMMARY.search(prompt)
+        summary = json.loads(match.group(1)) if match else {}
+        period = _PERIOD.search(prompt)
+        period = period.group(1) if period else 'this month'
+
+        income = summary.get('total_income') or 0
+        expenses = summary.get('total_expenses') or 0
+        categories = summary.get('by_category') or []
+        top = next((c for c in categories if c['category'] != 'income'), None)
+
+        tips = [f'Save BDT{max(100, round((income - expenses) * 0.2, -2)):.0f} this month']
+        warnings = []
+        if top:
+            tips.append(f'Reduce {top["category"]} spending by BDT{max(100, round(top["total"] * 0.1, -2)):.0f}')
+            warnings.append(f'High spending on {top["category"]}')
+        if expenses > income:
+            warnings.append(f'Spent BDT{expenses - income:.0f} more than earned')
+        good_habits = ['Tracking every transaction']
+        if (summary.get('saved_or_invested') or 0) > 0:
+            good_habits.append(f'Put BDT{summary["saved_or_invested"]:.0f} into savings')
+
+        return {
+            'overview': f'In {period} you earned BDT{income:.0f} and spent BDT{expenses:.0f} '
+                        f'across {summary.get("transaction_count", 0)} transactions.',
+            'quick_tips': tips,
+            'warnings': warnings,
+            'good_habits': good_habits,
+        }
+
+    def receipt(self, contents):
+        image = next((part for part in contents if not isinstance(part, str)), None)
+        data = getattr(getattr(image, 'inline_data', None), 'data', None) or b''
+        digest = hashlib.sha256(data).digest()
+        items = []
+        for i in range(1 + digest[0] % 4):
+            merchant, category = _MERCHANTS[digest[i + 1] % len(_MERCHANTS)]
+            items.append({
+                'date': date.today().isoformat(),
+                'description': f'{merchant} - Item {i + 1}',
+                'amount': 20 + digest[i + 5] * 3,
+                'category': category,
+            })
+        return items
+
+    def generate_content(self, api_key, model, contents, task=None, config=None):
+        latency, error, malformed = self.sample()
+        time.sleep(latency)
+        if error:
+            self.raise_error(error)
+        return self.answer(contents, task, malformed)
+
+    async def agenerate_content(self, api_key, model, contents, task=None, config=None):
+        latency, error, malformed = self.sample()
+        await asyncio.sleep(latency)
+        if error:
+            self.raise_error(error)
+        return self.answer(contents, task, malformed)
+
+    def stream_chunks(self, contents, task, latency, malformed):
+        text = self.answer(contents, task, malformed).text
+        chunks = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)]
+        return chunks, latency / len(chunks)
+
+    def generate_content_stream(self, api_key, model, contents, task=None, config=None):
+        latency, error, malformed = self.sample()
+        chunks, delay = self.stream_chunks(contents, task, latency, malformed)
+        for chunk in chunks:
+            time.sleep(delay)
+            if error:
+                self.raise_error(error)
+            yield FakeResponse(chunk)
+
+    async def agenerate_content_stream(self, api_key, model, contents, task=None, config=None):
+        latency, error, malformed = self.sample()
+        chunks, delay = self.stream_chunks(contents, task, latency, malformed)
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            if error:
+                self.raise_error(error)
+            yield FakeResponse(chunk)
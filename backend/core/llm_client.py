@@ -0,0 +1,368 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+
+import httpx
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from google import genai
+from google.genai import errors as genai_errors
+
+
+logger = logging.getLogger(__name__)
+
+
+# Process-wide Gemini client layer. analysis.py and image_to_transaction.py
+# call generate_content / agenerate_content here instead of building a new
+# genai.Client per request, so the pooled HTTP connections (and their TLS
+# sessions) are reused. Transient upstream failures (429, 5xx, transport
+# errors) are retried with jittered exponential backoff, and a circuit breaker
+# makes calls fail fast while Gemini keeps failing.
+# The *_stream variants yield the answer's text as it is generated.
+#
+# The upstream itself is a backend class selected by the LLM_BACKEND setting
+# (core.llm_backends): Gemini, or a deterministic offline fake for tests and
+# load benchmarks. GEMINI_BASE_URL points the Gemini backend at another server.
+
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# What a call is for, lets a backend (the fake) answer in the expected shape
+TASK_ANALYSIS = 'analysis'
+TASK_RECEIPT = 'receipt'
+
+
+class LLMUnavailable(Exception):
+    """Raised without calling Gemini while the circuit breaker is open"""
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive upstream failures. After `failure_threshold` of them the
+    circuit opens and calls fail fast for `reset_timeout` seconds; then a single
+    trial call is let through (half-open) and its outcome closes or reopens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def before_call(self):
+        """Raises LLMUnavailable unless a call may go out now"""
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return
+            retry_in = max(0.0, self.reset_timeout - (self.clock() - self.opened_at))
+            raise LLMUnavailable(f'Gemini is unavailable, retry in {retry_in:.0f}s')
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_in_flight:
+                    logger.warning('Gemini circuit opened after %d failures', self.failures)
+                self.opened_at = self.clock()
+            self.trial_in_flight = False
+
+    def release(self):
+        """Ends a call that said nothing about upstream health (e.g. a 400)"""
+        with self._lock:
+            self.trial_in_flight = False
+
+
+def is_retryable(exc):
+    if isinstance(exc, genai_errors.APIError):
+        return exc.code in RETRYABLE_STATUS_CODES
+    return isinstance(exc, httpx.TransportError)
+
+
+def backoff_delay(attempt, base=None, maximum=None):
+    """Full-jitter exponential backoff: uniform in [0, min(maximum, base * 2**attempt)]"""
+    base = _setting('GEMINI_BACKOFF_BASE', 0.5) if base is None else base
+    maximum = _setting('GEMINI_BACKOFF_MAX', 8.0) if maximum is None else maximum
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+_lock = threading.Lock()
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+_breaker = None
+_backend = None
+
+
+def get_backend():
+    """The backend instance named by settings.LLM_BACKEND, created on first use"""
+    global _backend
+    with _lock:
+        if _backend is None:
+            backend_class = import_string(_setting('LLM_BACKEND', 'core.llm_backends.GeminiBackend'))
+            _backend = backend_class()
+        return _backend
+
+
+def get_breaker():
+    global _breaker
+    with _lock:
+        if _breaker is None:
+            _breaker = CircuitBreaker(
+                failure_threshold=_setting('GEMINI_CIRCUIT_THRESHOLD', 5),
+                reset_timeout=_setting('GEMINI_CIRCUIT_RESET', 30.0),
+            )
+        return _breaker
+
+
+def _timeout():
+    return httpx.Timeout(
+        _setting('GEMINI_TIMEOUT', 60),
+        connect=_setting('GEMINI_CONNECT_TIMEOUT', 5),
+    )
+
+
+def _limits():
+    max_connections = _setting('GEMINI_MAX_CONNECTIONS', 20)
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=60,
+    )
+
+
+def _http_options(**transport):
+    return genai.types.HttpOptions(
+        base_url=_setting('GEMINI_BASE_URL', None) or None,
+        # Per request timeout in milliseconds, the SDK passes it to every send()
+        timeout=int(_setting('GEMINI_TIMEOUT', 60) * 1000),
+        **transport,
+    )
+
+
+def get_client(api_key):
+    """
+    The process-wide genai.Client for blocking calls, created on first use.
+
+    Args:
+        api_key (str): API key for Gemini AI
+
+    Returns:
+        genai.Client: Client whose httpx pool is shared by all threads
+    """
+    with _lock:
+        client = _clients.get(api_key)
+        if client is None:
+            transport = httpx.Client(timeout=_timeout(), limits=_limits())
+            client = genai.Client(api_key=api_key, http_options=_http_options(httpx_client=transport))
+            _clients[api_key] = client
+        return client
+
+
+def get_async_client(api_key):
+    """
+    The genai.Client for async calls on the running event loop.
+
+    httpx.AsyncClient connections belong to the loop that opened them, so
+    there is one pool per event loop, dropped together with the loop.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(api_key)
+        if client is None:
+            transport = httpx.AsyncClient(timeout=_timeout(), limits=_limits())
+            client = genai.Client(api_key=api_key, http_options=_http_options(httpx_async_client=transport))
+            clients[api_key] = client
+        return client
+
+
+def reset():
+    """Forgets the pooled clients, the backend and the breaker, e.g. after changing settings"""
+    global _breaker, _backend
+    with _lock:
+        _clients.clear()
+        _async_clients.clear()
+        _breaker = None
+        _backend = None
+
+
+def generate_content(api_key, model, contents, task=None, config=None):
+    """
+    Calls the configured backend with retries and the breaker.
+
+    Args:
+        api_key (str): API key for Gemini AI
+        model (str): Model name
+        contents: Prompt text or a list of prompt parts
+        task (str, optional): TASK_ANALYSIS or TASK_RECEIPT
+        config (GenerateContentConfig, optional): E.g. the structured output schema
+
+    Returns:
+        The backend response, its `text` holds the model output
+
+    Raises:
+        LLMUnavailable: The circuit is open
+        google.genai.errors.APIError, httpx.TransportError: The last attempt failed
+    """
+    backend = get_backend()
+    breaker = get_breaker()
+    attempts = _setting('GEMINI_MAX_RETRIES', 3) + 1
+    for attempt in range(attempts):
+        breaker.before_call()
+        try:
+            response = backend.generate_content(api_key, model, contents, task, config)
+        except Exception as e:
+            if not is_retryable(e):
+                breaker.release()
+                raise
+            breaker.record_failure()
+            if attempt == attempts - 1:
+                raise
+            delay = backoff_delay(attempt)
+            logger.info('Gemini call failed (%s), retry %d in %.2fs', e, attempt + 1, delay)
+            time.sleep(delay)
+        else:
+            breaker.record_success()
+            return response
+
+
+async def agenerate_content(api_key, model, contents, task=None, config=None):
+    """Async counterpart of generate_content"""
+    backend = get_backend()
+    breaker = get_breaker()
+    attempts = _setting('GEMINI_MAX_RETRIES', 3) + 1
+    for attempt in range(attempts):
+        breaker.before_call()
+        try:
+            response = await backend.agenerate_content(api_key, model, contents, task, config)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            if not is_retryable(e):
+                breaker.release()
+                raise
+            breaker.record_failure()
+            if attempt == attempts - 1:
+                raise
+            delay = backoff_delay(attempt)
+            logger.info('Gemini call failed (%s), retry %d in %.2fs', e, attempt + 1, delay)
+            await asyncio.sleep(delay)
+        else:
+            breaker.record_success()
+            return response
+
+
+def generate_content_stream(api_key, model, contents, task=None, config=None):
+    """
+    Streaming generate_content: yields the answer's text chunks as they arrive.
+
+    Retries only happen before the first chunk; a failure after that is raised,
+    since the caller has already consumed part of the answer.
+
+    Yields:
+        str: Next piece of the model output
+    """
+    backend = get_backend()
+    breaker = get_breaker()
+    attempts = _setting('GEMINI_MAX_RETRIES', 3) + 1
+    for attempt in range(attempts):
+        breaker.before_call()
+        received = False
+        try:
+            for chunk in backend.generate_content_stream(api_key, model, contents, task, config):
+                if chunk.text:
+                    received = True
+                    yield chunk.text
+        except GeneratorExit:
+            # The consumer stopped reading, e.g. the client disconnected
+            breaker.release()
+            raise
+        except Exception as e:
+            if not is_retryable(e):
+                breaker.release()
+                raise
+            breaker.record_failure()
+            if received or attempt == attempts - 1:
+                raise
+            delay = backoff_delay(attempt)
+            logger.info('Gemini stream failed (%s), retry %d in %.2fs', e, attempt + 1, delay)
+            time.sleep(delay)
+        else:
+            breaker.record_success()
+            return
+
+
+async def agenerate_content_stream(api_key, model, contents, task=None, config=None):
+    """Async counterpart of generate_content_stream"""
+    backend = get_backend()
+    breaker = get_breaker()
+    attempts = _setting('GEMINI_MAX_RETRIES', 3) + 1
+    for attempt in range(attempts):
+        breaker.before_call()
+        received = False
+        try:
+            async for chunk in backend.agenerate_content_stream(api_key, model, contents, task, config):
+                if chunk.text:
+                    received = True
+                    yield chunk.text
+        except (GeneratorExit, asyncio.CancelledError):
+            breaker.release()
+            raise
+        except Exception as e:
+            if not is_retryable(e):
+                breaker.release()
+                raise
+            breaker.record_failure()
+            if received or attempt == attempts - 1:
+                raise
+            delay = backoff_delay(attempt)
+            logger.info('Gemini stream failed (%s), retry %d in %.2fs', e, attempt + 1, delay)
+            await asyncio.sleep(delay)
+        else:
+            breaker.record_success()
+            return
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    # override_settings(LLM_BACKEND=...) in tests and the load generator
+    if setting.startswith(('LLM_', 'GEMINI_')):
+        reset()
@@ -0,0 +1,85 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db.models import Count
+from rest_framework.renderers import JSONRenderer
+
+from core.models import Transaction
+from core.renderers import FastJSONRenderer
+from core.serializers import TransactionViewSerializer, UserViewSerializer, FLAT_LIST_FIELDS
+
+
+class Command(BaseCommand):
+    help = 'Benchmark per-page serialization of the transaction list: nested serializer vs flat mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=str,
+            help='Username whose transactions are listed (defaults to the user with the most transactions)'
+        )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=20,
+            help='Rows per page (default: 20)'
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=500,
+            help='Pages rendered per mode (default: 500)'
+        )
+
+    def handle(self, *args, **options):
+        username = options.get('user')
+        if username:
+            user = User.objects.filter(username=username).first()
+        else:
+            owner = (
+                Transaction.objects.values('user').order_by()
+                .annotate(n=Count('id'))
+                .order_by('-n').first()
+            )
+            user = User.objects.filter(pk=owner['user']).first() if owner else None
+        if user is None:
+            raise CommandError('No user with transactions found. Run generate_fake_transactions first.')
+
+        page_size = options['page_size']
+        iterations = options['iterations']
+        queryset = Transaction.objects.filter(user=user).order_by('-date', '-id')
+
+        def nested_page():
+            # Before: model instances, a nested user dict per row, DRF's JSON encoder
+            page = list(queryset[:page_size])
+            data = TransactionViewSerializer(page, many=True).data
+            return JSONRenderer().render({'results': data})
+
+        def nested_page_select_related():
+            page = list(queryset.select_related('user')[:page_size])
+            data = TransactionViewSerializer(page, many=True).data
+            return JSONRenderer().render({'results': data})
+
+        def flat_page():
+            # After: .values() rows, the user once in the envelope, orjson
+            rows = list(queryset.values(*FLAT_LIST_FIELDS)[:page_size])
+            users = {user.pk: UserViewSerializer(user).data}
+            return FastJSONRenderer().render({'results': rows, 'users': users})
+
+        results = {}
+        for name, render_page in (
+            ('nested', nested_page),
+            ('nested + select_related', nested_page_select_related),
+            ('flat', flat_page),
+        ):
+            render_page()  # warm up
+            started = time.perf_counter()
+            for _ in range(iterations):
+                size = len(render_page())
+            elapsed = time.perf_counter() - started
+            results[name] = elapsed / iterations * 1000
+            self.stdout.write(f'{name:<26} {results[name]:8.3f} ms/page  {size:7d} bytes/page')
+
+        speedup = results['nested'] / results['flat'] if results['flat'] else 0
+        self.stdout.write(self.style.SUCCESS(f'flat mode is {speedup:.1f}x faster per page of {page_size} rows'))
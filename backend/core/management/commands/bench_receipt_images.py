@@ -0,0 +1,182 @@
+import io
+import random
+import statistics
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from PIL import Image, ImageDraw, ImageFont
+
+from core import receipt_images
+from core.image_to_transaction import image_to_transaction
+
+
+def synthetic_receipts(seed=0):
+    """
+    A small sample set standing in for real uploads: phone photos of a printed
+    receipt (JPEG with an EXIF rotation, WebP) and flatbed scans (PNG, small JPEG).
+
+    Returns:
+        list: (name, image bytes) pairs
+    """
+    rng = random.Random(seed)
+
+    def receipt(width, height, background):
+        image = Image.new('L', (width, height), background)
+        draw = ImageDraw.Draw(image)
+        margin = width // 8
+        draw.rectangle((margin, margin // 2, width - margin, height - margin // 2), fill=250)
+        font = ImageFont.load_default(size=max(12, width // 45))
+        line_height = int(font.size * 1.6)
+        y = margin
+        for i in range((height - 2 * margin) // line_height):
+            item = rng.choice(['Rice 5kg', 'Milk 1L', 'Eggs x12', 'Tea 400g', 'Soap', 'Lentils 1kg', 'Oil 2L'])
+            draw.text((margin * 1.3, y), f'{i + 1:02d}  {item}', fill=20, font=font)
+            draw.text((width - margin * 2.2, y), f'{rng.randint(20, 900):>4}.00', fill=20, font=font)
+            y += line_height
+        if background < 255:
+            # Camera sensor noise, what makes photos large
+            image = Image.blend(image, Image.effect_noise((width, height), 60), 0.12)
+        return image
+
+    samples = []
+
+    photo = receipt(3024, 4032, 120).convert('RGB')
+    # Stored sideways with an orientation tag, like most phone cameras do
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    output = io.BytesIO()
+    photo.transpose(Image.Transpose.ROTATE_90).save(output, 'JPEG', quality=92, exif=exif)
+    samples.append(('photo-rotated.jpg', output.getvalue()))
+
+    output = io.BytesIO()
+    receipt(2000, 2667, 140).convert('RGB').save(output, 'WEBP', quality=90)
+    samples.append(('photo.webp', output.getvalue()))
+
+    output = io.BytesIO()
+    receipt(1240, 3508, 255).save(output, 'PNG')
+    samples.append(('scan.png', output.getvalue()))
+
+    output = io.BytesIO()
+    receipt(900, 1400, 255).save(output, 'JPEG', quality=75)
+    samples.append(('small-scan.jpg', output.getvalue()))
+    return samples
+
+
+def upload_ms(size, mbps):
+    # Inline image data is sent base64 encoded
+    return (size + 2) // 3 * 4 * 8 / (mbps * 1000)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark receipt image preprocessing over a sample set: bytes saved, conversion time, '
+        'estimated upload time and optionally the end-to-end extraction latency with and without it'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dir',
+            type=str,
+            help='Folder of receipt images to use (default: a generated sample set)'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Timed runs per image, the median is reported (default: 3)'
+        )
+        parser.add_argument(
+            '--uplink-mbps',
+            type=float,
+            default=10,
+            help='Upload bandwidth for the estimated upload time (default: 10)'
+        )
+        parser.add_argument(
+            '--end-to-end',
+            action='store_true',
+            help='Also time the receipt extraction against LLM_BACKEND with preprocessing off and on'
+        )
+
+    def handle(self, *args, **options):
+        samples = self.load_samples(options.get('dir'))
+        repeat = max(1, options['repeat'])
+        mbps = options['uplink_mbps']
+
+        self.stdout.write(
+            f'At most {settings.RECEIPT_IMAGE_MAX_PIXELS / 1e6:g} MP, JPEG quality {settings.RECEIPT_IMAGE_QUALITY}, '
+            f'upload estimated at {mbps:g} Mbit/s'
+        )
+        header = f'{"image":<22} {"type":<11} {"original":>10} {"sent":>10} {"saved":>7} {"prep ms":>8} {"upload ms":>15}'
+        if options['end_to_end']:
+            header += f' {"end-to-end ms":>17}'
+        self.stdout.write(header)
+
+        totals = {'original': 0, 'sent': 0, 'prep': 0.0, 'e2e_off': 0.0, 'e2e_on': 0.0}
+        for name, data in samples:
+            mime_type = receipt_images.sniff_mime_type(data)
+            if mime_type is None:
+                self.stderr.write(self.style.WARNING(f'Skipping {name}: not a supported image'))
+                continue
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                processed = receipt_images.preprocess(data).data
+                timings.append((time.perf_counter() - started) * 1000)
+            prep = statistics.median(timings)
+            saved = 1 - len(processed) / len(data)
+            row = (
+                f'{name[:22]:<22} {mime_type:<11} {len(data) / 1024:8.0f}KB {len(processed) / 1024:8.0f}KB '
+                f'{saved:7.1%} {prep:8.1f} {upload_ms(len(data), mbps):7.0f}->{upload_ms(len(processed), mbps):<7.0f}'
+            )
+            totals['original'] += len(data)
+            totals['sent'] += len(processed)
+            totals['prep'] += prep
+            if options['end_to_end']:
+                off, on = self.end_to_end(data, repeat)
+                totals['e2e_off'] += off
+                totals['e2e_on'] += on
+                row += f' {off:8.0f}->{on:<8.0f}'
+            self.stdout.write(row)
+
+        if not totals['original']:
+            raise CommandError('No usable images')
+        saved = 1 - totals['sent'] / totals['original']
+        summary = (
+            f'Total {totals["original"] / 1024:.0f}KB -> {totals["sent"] / 1024:.0f}KB ({saved:.1%} saved), '
+            f'{totals["prep"]:.0f} ms converting, estimated upload '
+            f'{upload_ms(totals["original"], mbps):.0f} -> {upload_ms(totals["sent"], mbps):.0f} ms'
+        )
+        if options['end_to_end']:
+            summary += f', end-to-end {totals["e2e_off"]:.0f} -> {totals["e2e_on"]:.0f} ms'
+        self.stdout.write(self.style.SUCCESS(summary))
+        if options['end_to_end'] and settings.LLM_BACKEND.endswith('FakeBackend'):
+            self.stdout.write(
+                'The fake backend uploads nothing, add the estimated upload times to its end-to-end figures'
+            )
+
+    def load_samples(self, folder):
+        if not folder:
+            return synthetic_receipts()
+        path = Path(folder)
+        if not path.is_dir():
+            raise CommandError(f'{folder} is not a folder')
+        return [(file.name, file.read_bytes()) for file in sorted(path.iterdir()) if file.is_file()]
+
+    def end_to_end(self, data, repeat):
+        # Medians of the whole extraction (preprocessing, upload, model, parsing)
+        medians = []
+        for enabled in (False, True):
+            timings = []
+            with override_settings(RECEIPT_IMAGE_PREPROCESS=enabled):
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    try:
+                        image_to_transaction(data, settings.GEMINI_API_KEY)
+                    except Exception as e:
+                        self.stderr.write(self.style.WARNING(f'Extraction failed: {e}'))
+                    timings.append((time.perf_counter() - started) * 1000)
+            medians.append(statistics.median(timings))
+        return medians
@@ -0,0 +1,143 @@
+import multiprocessing
+import random
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+
+
+MERCHANTS = [
+    ('Salary Deposit', 'income'), ('Grocery Store - Weekly Shopping', 'food'), ('Gas Station - Shell', 'transport'),
+    ('Electric Bill Payment', 'utilities'), ('Netflix Subscription', 'entertainment'), ('Pharmacy - CVS', 'health'),
+    ('Restaurant - Pizza Palace with a rather long description that gets cut', 'food'), ('Rent', 'housing'),
+]
+
+
+def synthetic_rows(count, seed=0):
+    """(date, description, amount, category) rows in date order, generated lazily"""
+    rng = random.Random(seed)
+    start = date(2020, 1, 1)
+    for i in range(count):
+        description, category = rng.choice(MERCHANTS)
+        yield (
+            start + timedelta(days=i * 3650 // max(count, 1)),
+            f'{description} #{rng.randint(1000, 9999)}',
+            Decimal(rng.randint(100, 500000)) / 100,
+            category,
+        )
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process, in KB"""
+    try:
+        # Linux keeps ru_maxrss across exec, so a spawned worker would report its parent's peak
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # Kilobytes on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run(renderer, rows, username, compress):
+    """
+    One measurement, in a fresh process so its peak RSS is its own.
+
+    Returns:
+        tuple: (rows, seconds, PDF bytes, peak RSS before, peak RSS after) in KB
+    """
+    from core.pdf_stream import Summary, statement_chunks
+    from core.transaction_to_pdf import create_transaction_pdf
+
+    if username:
+        user = User.objects.get(username=username)
+        source = user.transactions.order_by('date', 'id').values_list(
+            'date', 'description', 'amount', 'category'
+        )[:rows]
+    before = peak_rss_kb()
+    started = time.perf_counter()
+    if renderer == 'streaming':
+        iterator = source.iterator(chunk_size=2000) if username else synthetic_rows(rows)
+        summary = Summary()
+        size = 0
+        for chunk in statement_chunks(iterator, compress=compress, summary=summary):
+            # Sent and dropped, like a streamed response
+            size += len(chunk)
+        count = summary.count
+    else:
+        # transaction_to_pdf takes a list of dicts and keeps the whole document in memory
+        iterator = source.iterator(chunk_size=2000) if username else synthetic_rows(rows)
+        transactions = [
+            {'date': day.strftime('%Y-%m-%d'), 'description': description, 'amount': amount, 'category': category}
+            for day, description, amount, category in iterator
+        ]
+        count = len(transactions)
+        size = len(create_transaction_pdf(transactions))
+    return count, time.perf_counter() - started, size, before, peak_rss_kb()
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the streaming PDF statement renderer (core.pdf_stream): rows per second and peak RSS, '
+        'optionally against the FPDF renderer (core.transaction_to_pdf)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=100000,
+            help='Rows to render (default: 100000)'
+        )
+        parser.add_argument(
+            '--user',
+            type=str,
+            help="Render this user's transactions from the database instead of generated rows"
+        )
+        parser.add_argument(
+            '--compress',
+            type=int,
+            default=6,
+            help='zlib level of the page contents, 0 for none (default: 6)'
+        )
+        parser.add_argument(
+            '--legacy-rows',
+            type=int,
+            default=0,
+            help='Also render this many rows with the FPDF renderer for comparison (default: 0, skipped)'
+        )
+
+    def handle(self, *args, **options):
+        username = options.get('user')
+        if username and not User.objects.filter(username=username).exists():
+            raise CommandError(f'User "{username}" does not exist')
+
+        # A tenth of the rows too, to show that memory does not grow with them
+        runs = [('streaming', options['rows'] // 10 or options['rows']), ('streaming', options['rows'])]
+        if options['legacy_rows']:
+            runs.append(('fpdf', options['legacy_rows']))
+
+        self.stdout.write(f'{"renderer":<10} {"rows":>9} {"seconds":>8} {"rows/s":>9} {"PDF":>9} {"peak RSS":>9} {"growth":>8}')
+        for renderer, rows in dict.fromkeys(runs):
+            # Spawned, so every run starts from the same baseline and its peak is its own
+            executor = ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup
+            )
+            with executor:
+                count, seconds, size, before, after = executor.submit(
+                    run, renderer, rows, username, options['compress']
+                ).result()
+            self.stdout.write(
+                f'{renderer:<10} {count:>9,} {seconds:>8.2f} {count / seconds:>9,.0f} {size / 1024 / 1024:>7.1f}MB '
+                f'{after / 1024:>7.0f}MB {(after - before) / 1024:>6.0f}MB'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'Peak RSS growth of the streaming renderer should stay flat as the row count grows'
+        ))
@@ -0,0 +1,69 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connections
+
+from core.models import Transaction
+
+
+def detect_user(user_id):
+    # Runs in a pool process, which has its own database connection
+    from core.recurring import detect_user
+
+    try:
+        return user_id, detect_user(user_id)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Detect recurring transactions (weekly, monthly, yearly series) for all users or one user'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=str,
+            help='Username to detect series for (if not provided, all users with transactions)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=0,
+            help='Processes to spread the users over (default: CPU count, 1 runs in this process)'
+        )
+
+    def handle(self, *args, **options):
+        username = options.get('user')
+        if username:
+            try:
+                user_ids = [User.objects.get(username=username).pk]
+            except User.DoesNotExist:
+                raise CommandError(f'User "{username}" does not exist')
+        else:
+            user_ids = list(Transaction.objects.order_by('user_id').values_list('user_id', flat=True).distinct())
+
+        workers = options['workers'] or multiprocessing.cpu_count()
+        started = time.perf_counter()
+        total = 0
+        if workers == 1 or len(user_ids) == 1:
+            results = map(detect_user, user_ids)
+        else:
+            # Spawned, not forked, so no process inherits this one's DB connection
+            executor = ProcessPoolExecutor(
+                max_workers=min(workers, len(user_ids)) or 1,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+            with executor:
+                futures = [executor.submit(detect_user, user_id) for user_id in user_ids]
+                results = [future.result() for future in as_completed(futures)]
+        for user_id, found in results:
+            total += found
+            self.stdout.write(f'user {user_id}: {found} series')
+        self.stdout.write(self.style.SUCCESS(
+            f'Found {total} recurring series for {len(user_ids)} user(s) in {time.perf_counter() - started:.1f}s'
+        ))
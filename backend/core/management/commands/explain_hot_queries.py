@@ -0,0 +1,97 @@
+from contextlib import contextmanager
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+from core.models import Transaction
+from core.periods import month_range, previous_month, period_filter
+
+
+def hot_queries(user, year, month):
+    """The transaction queries behind the list, analysis and PDF endpoints, by name"""
+    current = period_filter(*month_range(year, month))
+    previous = period_filter(*month_range(*previous_month(year, month)))
+    return {
+        'list page': Transaction.objects.filter(user=user).order_by('-date', '-id')[:21],
+        'analysis current month': Transaction.objects.filter(user=user, **current),
+        'analysis previous month': Transaction.objects.filter(user=user, **previous),
+        'pdf month': Transaction.objects.filter(user=user, **current).order_by('date'),
+        'category in month': Transaction.objects.filter(user=user, category='food', **current),
+    }
+
+
+@contextmanager
+def prefer_indexes():
+    # On small tables PostgreSQL picks a sequential scan even when an index
+    # fits, so disable it to check that an index scan is possible at all
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        yield
+
+
+def is_full_scan(plan):
+    table = Transaction._meta.db_table
+    for line in plan.splitlines():
+        line = line.strip()
+        if connection.vendor == 'sqlite' and f'SCAN {table}' in line and 'USING' not in line:
+            return True
+        if connection.vendor == 'postgresql' and f'Seq Scan on {table}' in line:
+            return True
+    return False
+
+
+def uses_index(plan, name):
+    """Whether the plan reads core_transaction through the index called `name`"""
+    if connection.vendor == 'sqlite':
+        return any(f'INDEX {name} ' in f'{line} ' for line in plan.splitlines() if 'USING' in line)
+    return any(f'using {name} ' in f'{line} ' or f'on {name} ' in f'{line} ' for line in plan.splitlines())
+
+
+class Command(BaseCommand):
+    help = (
+        'EXPLAIN the hot transaction queries and fail if any of them scans the whole table '
+        '(run against a production-like database; core.tests checks the same on the test database)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=str,
+            help='Username to build the queries for (defaults to the first user)'
+        )
+        parser.add_argument(
+            '--month',
+            type=str,
+            help='Month to query as YYYY-MM (defaults to the current month)'
+        )
+
+    def handle(self, *args, **options):
+        username = options.get('user')
+        user = User.objects.filter(username=username).first() if username else User.objects.order_by('id').first()
+        if user is None:
+            raise CommandError('No user found to build the queries for.')
+
+        if options.get('month'):
+            try:
+                year, month = (int(part) for part in options['month'].split('-'))
+            except ValueError:
+                raise CommandError('Month must be given as YYYY-MM')
+        else:
+            year, month = date.today().year, date.today().month
+
+        failures = []
+        with prefer_indexes():
+            for name, queryset in hot_queries(user, year, month).items():
+                plan = queryset.explain()
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                self.stdout.write(plan)
+                if is_full_scan(plan):
+                    failures.append(name)
+
+        if failures:
+            raise CommandError(f"Full table scan on core_transaction for: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS('All hot queries use an index'))
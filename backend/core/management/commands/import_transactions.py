@@ -0,0 +1,82 @@
+import functools
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+
+from core import categorizer
+from core.importers import (
+    DEFAULT_BATCH_SIZE,
+    IMPORT_FORMATS,
+    StatementImportError,
+    detect_format,
+    import_transactions,
+)
+
+
+class Command(BaseCommand):
+    help = 'Import transactions from a CSV or OFX bank statement file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str, help='Path to the statement file')
+        parser.add_argument(
+            '--user',
+            type=str,
+            required=True,
+            help='Username the transactions belong to'
+        )
+        parser.add_argument(
+            '--file-format',
+            choices=IMPORT_FORMATS,
+            help='Statement format (default: detected from the file extension)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help=f'Rows per validated/inserted chunk (default: {DEFAULT_BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--no-categorize',
+            action='store_true',
+            help='File rows without a known category under miscellaneous instead of asking the local classifier'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f'User "{options["user"]}" does not exist')
+
+        path = options['path']
+        file_format = options.get('file_format') or detect_format(path)
+        started = time.perf_counter()
+
+        def report(chunk):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"chunk {chunk['chunk']}: {chunk['inserted']} inserted, "
+                f"{chunk['rejected']} rejected ({elapsed:.1f}s)"
+            )
+
+        try:
+            with open(path, 'rb') as statement:
+                result = import_transactions(
+                    user, statement, file_format,
+                    batch_size=options['batch_size'],
+                    progress=report,
+                    categorize=None if options['no_categorize'] else functools.partial(categorizer.categorize, user),
+                )
+        except (OSError, StatementImportError) as e:
+            raise CommandError(str(e))
+
+        elapsed = time.perf_counter() - started
+        rate = result['inserted'] / elapsed if elapsed else 0
+        for error in result['errors']:
+            self.stdout.write(self.style.WARNING(f"line {error['line']}: {error['error']}"))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {result['inserted']} transactions ({result['rejected']} rejected) "
+                f"in {elapsed:.1f}s, {rate:,.0f} rows/s"
+            )
+        )
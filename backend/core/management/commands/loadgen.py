@@ -0,0 +1,231 @@
+import asyncio
+import os
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import AsyncClient, Client, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from core.models import AnalysisCache, Transaction
+
+
+# name -> (method, path, is_async); the async endpoints are driven with AsyncClient
+ENDPOINTS = {
+    'list': ('get', '/api/transactions/', False),
+    'analysis': ('get', '/api/analysis/', False),
+    'analysis-async': ('get', '/api/analysis/async/', True),
+    'receipt': ('post', '/api/image-to-trasaction/', False),
+    'receipt-async': ('post', '/api/image-to-trasaction/async/', True),
+}
+
+
+def percentile(values, pct):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[pct - 1]
+
+
+def failed(response):
+    # The analysis views answer 200 with an "error" key when the LLM call failed
+    if response.status_code >= 400:
+        return True
+    if response.get('Content-Type', '').startswith('application/json'):
+        body = response.json()
+        return isinstance(body, dict) and 'error' in body
+    return False
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the Django stack (URLs, middleware, auth, views, DB) in-process against the fake '
+        'LLM backend and report latency percentiles and throughput per endpoint'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=str,
+            help='Username to authenticate as (defaults to the user with the most transactions)'
+        )
+        parser.add_argument(
+            '--endpoints',
+            type=str,
+            default=','.join(ENDPOINTS),
+            help=f'Comma separated endpoints to drive (default: {",".join(ENDPOINTS)})'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Requests per endpoint (default: 200)'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='Concurrent clients per endpoint (default: 8)'
+        )
+        parser.add_argument(
+            '--latency',
+            type=str,
+            choices=['fixed', 'uniform', 'normal', 'lognormal'],
+            help='Fake LLM latency distribution (default: LLM_FAKE_LATENCY)'
+        )
+        parser.add_argument(
+            '--latency-ms',
+            type=float,
+            help='Fake LLM median latency in milliseconds (default: LLM_FAKE_LATENCY_MS)'
+        )
+        parser.add_argument(
+            '--error-rate',
+            type=float,
+            help='Share of fake LLM calls failing with a 429/503 (default: LLM_FAKE_ERROR_RATE)'
+        )
+
+    def handle(self, *args, **options):
+        endpoints = [name.strip() for name in options['endpoints'].split(',') if name.strip()]
+        unknown = [name for name in endpoints if name not in ENDPOINTS]
+        if unknown:
+            raise CommandError(f'Unknown endpoints: {", ".join(unknown)}. Choose from {", ".join(ENDPOINTS)}')
+
+        user = self.get_user(options.get('user'))
+        token = str(RefreshToken.for_user(user).access_token)
+
+        # Always the fake backend: the load generator never spends Gemini quota
+        overrides = {
+            'LLM_BACKEND': 'core.llm_backends.FakeBackend',
+            # The test clients send Host: testserver
+            'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+        }
+        if options.get('latency'):
+            overrides['LLM_FAKE_LATENCY'] = options['latency']
+        if options.get('latency_ms') is not None:
+            overrides['LLM_FAKE_LATENCY_MS'] = options['latency_ms']
+        if options.get('error_rate') is not None:
+            overrides['LLM_FAKE_ERROR_RATE'] = options['error_rate']
+
+        with override_settings(**overrides):
+            self.stdout.write(
+                f'Fake LLM: {settings.LLM_FAKE_LATENCY} latency, median {settings.LLM_FAKE_LATENCY_MS:.0f} ms, '
+                f'error rate {settings.LLM_FAKE_ERROR_RATE:.1%}; {options["requests"]} requests per endpoint, '
+                f'concurrency {options["concurrency"]}'
+            )
+            self.stdout.write(
+                f'{"endpoint":<16} {"req/s":>8} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"max ms":>9} {"errors":>7}'
+            )
+            for name in endpoints:
+                # Every analysis request must reach the LLM, not the cache
+                AnalysisCache.objects.filter(user=user).delete()
+                latencies, errors, elapsed = self.run_endpoint(name, token, options)
+                self.report(name, latencies, errors, elapsed)
+
+    def get_user(self, username):
+        if username:
+            user = User.objects.filter(username=username).first()
+        else:
+            owner = (
+                Transaction.objects.values('user').order_by()
+                .annotate(n=Count('id'))
+                .order_by('-n').first()
+            )
+            user = User.objects.filter(pk=owner['user']).first() if owner else None
+        if user is None:
+            raise CommandError('No user with transactions found. Run generate_fake_transactions first.')
+        return user
+
+    def request_kwargs(self, name, index):
+        if name.startswith('analysis'):
+            # A distinct month per request, far in the past, so no two requests coalesce
+            return {'data': {'month': index % 12 + 1, 'year': 1900 + index // 12}}
+        if name.startswith('receipt'):
+            image = SimpleUploadedFile(
+                f'receipt-{index}.jpg', b'\xff\xd8\xff\xe0' + os.urandom(2048), content_type='image/jpeg'
+            )
+            return {'data': {'image': image}}
+        return {'data': {'page_size': 20}}
+
+    def headers(self, token):
+        return {'Authorization': f'JWT {token}'}
+
+    def run_endpoint(self, name, token, options):
+        method, path, is_async = ENDPOINTS[name]
+        if is_async:
+            return asyncio.run(self.run_async(name, method, path, token, options))
+
+        latencies = []
+        errors = []
+        counter = iter(range(options['requests']))
+        headers = self.headers(token)
+        counter_lock = threading.Lock()
+
+        def worker():
+            client = Client()
+            try:
+                while True:
+                    with counter_lock:
+                        index = next(counter, None)
+                    if index is None:
+                        return
+                    started = time.perf_counter()
+                    response = getattr(client, method)(
+                        path, headers=headers, **self.request_kwargs(name, index)
+                    )
+                    latency = (time.perf_counter() - started) * 1000
+                    if failed(response):
+                        errors.append(response.status_code)
+                    else:
+                        latencies.append(latency)
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(options['concurrency'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, errors, time.perf_counter() - started
+
+    async def run_async(self, name, method, path, token, options):
+        latencies = []
+        errors = []
+        counter = iter(range(options['requests']))
+        headers = self.headers(token)
+        client = AsyncClient()
+
+        async def worker():
+            for index in counter:
+                started = time.perf_counter()
+                response = await getattr(client, method)(
+                    path, headers=headers, **self.request_kwargs(name, index)
+                )
+                latency = (time.perf_counter() - started) * 1000
+                if failed(response):
+                    errors.append(response.status_code)
+                else:
+                    latencies.append(latency)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(options['concurrency'])))
+        return latencies, errors, time.perf_counter() - started
+
+    def report(self, name, latencies, errors, elapsed):
+        throughput = (len(latencies) + len(errors)) / elapsed if elapsed else 0
+        if latencies:
+            row = (
+                f'{name:<16} {throughput:8.1f} {percentile(latencies, 50):9.1f} {percentile(latencies, 95):9.1f} '
+                f'{percentile(latencies, 99):9.1f} {max(latencies):9.1f} {len(errors):>7}'
+            )
+        else:
+            row = f'{name:<16} {throughput:8.1f} {"-":>9} {"-":>9} {"-":>9} {"-":>9} {len(errors):>7}'
+        self.stdout.write(row if not errors else self.style.ERROR(row))
+        if errors:
+            codes = ', '.join(f'{code} x{errors.count(code)}' for code in sorted(set(errors)))
+            self.stdout.write(f'{"":<16} failed responses: {codes}')
@@ -0,0 +1,144 @@
+import asyncio
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test a running server: CRUD latency with and without outstanding Gemini calls. '
+        'Start the server first, e.g. `uvicorn autofinance.asgi:application --workers 1`.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            type=str,
+            default='http://127.0.0.1:8000',
+            help='Base URL of the running server (default: http://127.0.0.1:8000)'
+        )
+        parser.add_argument(
+            '--user',
+            type=str,
+            required=True,
+            help='Username to authenticate as'
+        )
+        parser.add_argument(
+            '--llm-concurrency',
+            type=int,
+            default=20,
+            help='Gemini-backed requests kept outstanding during the loaded phase (default: 20)'
+        )
+        parser.add_argument(
+            '--crud-requests',
+            type=int,
+            default=200,
+            help='CRUD requests timed per phase (default: 200)'
+        )
+        parser.add_argument(
+            '--crud-concurrency',
+            type=int,
+            default=4,
+            help='Concurrent CRUD clients (default: 4)'
+        )
+        parser.add_argument(
+            '--sync',
+            action='store_true',
+            help='Drive the sync /api/analysis/ endpoint instead of /api/analysis/async/ for comparison'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            import httpx
+        except ImportError:
+            raise CommandError('httpx is required for the load test')
+
+        user = User.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(f'User "{options["user"]}" does not exist')
+        token = str(RefreshToken.for_user(user).access_token)
+
+        results = asyncio.run(self.run(httpx, token, options))
+
+        baseline, loaded, llm = results
+        self.stdout.write(f'{"phase":<28} {"p50 ms":>9} {"p95 ms":>9} {"max ms":>9} {"n":>6}')
+        for name, latencies in (('CRUD, idle', baseline), ('CRUD, LLM calls outstanding', loaded)):
+            self.stdout.write(self.format_row(name, latencies))
+        if llm:
+            self.stdout.write(self.format_row('LLM requests', llm))
+
+        if baseline and loaded:
+            ratio = percentile(loaded, 95) / percentile(baseline, 95)
+            style = self.style.SUCCESS if ratio < 2 else self.style.ERROR
+            self.stdout.write(style(f'CRUD p95 under load is {ratio:.2f}x the idle p95'))
+
+    def format_row(self, name, latencies):
+        if not latencies:
+            return f'{name:<28} {"-":>9} {"-":>9} {"-":>9} {0:>6}'
+        return (
+            f'{name:<28} {percentile(latencies, 50):9.1f} {percentile(latencies, 95):9.1f} '
+            f'{max(latencies):9.1f} {len(latencies):>6}'
+        )
+
+    async def run(self, httpx, token, options):
+        base_url = options['url'].rstrip('/')
+        analysis_path = '/api/analysis/' if options['sync'] else '/api/analysis/async/'
+        headers = {'Authorization': f'JWT {token}'}
+        limits = httpx.Limits(max_connections=options['llm_concurrency'] + options['crud_concurrency'] + 4)
+
+        async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=300) as client:
+            response = await client.get('/api/transactions/')
+            if response.status_code != 200:
+                raise CommandError(f'CRUD endpoint answered {response.status_code}: {response.text[:200]}')
+
+            baseline = await self.crud_phase(client, options)
+
+            stop = asyncio.Event()
+            llm_latencies = []
+            llm_tasks = [
+                asyncio.create_task(self.llm_worker(client, analysis_path, worker, stop, llm_latencies))
+                for worker in range(options['llm_concurrency'])
+            ]
+            # Let the LLM calls get in flight before timing CRUD again
+            await asyncio.sleep(0.5)
+            loaded = await self.crud_phase(client, options)
+            stop.set()
+            await asyncio.gather(*llm_tasks)
+
+        return baseline, loaded, llm_latencies
+
+    async def crud_phase(self, client, options):
+        latencies = []
+        remaining = iter(range(options['crud_requests']))
+
+        async def worker():
+            for _ in remaining:
+                started = time.perf_counter()
+                response = await client.get('/api/transactions/', params={'page_size': 20})
+                response.raise_for_status()
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        await asyncio.gather(*(worker() for _ in range(options['crud_concurrency'])))
+        return latencies
+
+    async def llm_worker(self, client, path, worker, stop, latencies):
+        # A distinct month per call, far in the past, so the analysis cache never answers
+        call = 0
+        while not stop.is_set():
+            month = (worker + call) % 12 + 1
+            year = 1900 + (worker * 7 + call) % 100
+            call += 1
+            started = time.perf_counter()
+            response = await client.get(path, params={'month': month, 'year': year})
+            if response.status_code != 200:
+                raise CommandError(f'{path} answered {response.status_code}: {response.text[:200]}')
+            latencies.append((time.perf_counter() - started) * 1000)
+
+
+def percentile(values, pct):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[pct - 1]
@@ -0,0 +1,87 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connections
+
+from core.models import Transaction
+from core.periods import month_range, period_filter, previous_month
+
+
+def prerender_user(user_id, year, month, force):
+    # Runs in a pool process, which has its own database connection
+    from core.statements import prerender
+
+    try:
+        return user_id, prerender(User(pk=user_id), year, month, force=force)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Render and store the PDF statements of a month (default: the previous month) for all users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, help='Year of the month to render')
+        parser.add_argument('--month', type=int, help='Month to render (1-12)')
+        parser.add_argument(
+            '--user',
+            type=str,
+            help='Username to render for (if not provided, all users with transactions in the month)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=0,
+            help='Processes to spread the users over (default: CPU count, 1 runs in this process)'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Render statements that are stored already again'
+        )
+
+    def handle(self, *args, **options):
+        year, month = previous_month(date.today().year, date.today().month)
+        year, month = options['year'] or year, options['month'] or month
+        try:
+            period = month_range(year, month)
+        except ValueError:
+            raise CommandError(f'Invalid month {year}-{month}')
+
+        username = options.get('user')
+        if username:
+            try:
+                user_ids = [User.objects.get(username=username).pk]
+            except User.DoesNotExist:
+                raise CommandError(f'User "{username}" does not exist')
+        else:
+            user_ids = list(
+                Transaction.objects.filter(**period_filter(*period))
+                .order_by('user_id').values_list('user_id', flat=True).distinct()
+            )
+
+        workers = options['workers'] or multiprocessing.cpu_count()
+        started = time.perf_counter()
+        arguments = (year, month, options['force'])
+        if workers == 1 or len(user_ids) <= 1:
+            results = [prerender_user(user_id, *arguments) for user_id in user_ids]
+        else:
+            # Spawned, not forked, so no process inherits this one's DB connection
+            executor = ProcessPoolExecutor(
+                max_workers=min(workers, len(user_ids)),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+            with executor:
+                futures = [executor.submit(prerender_user, user_id, *arguments) for user_id in user_ids]
+                results = [future.result() for future in as_completed(futures)]
+        rendered = sum(1 for _user_id, done in results if done)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {rendered} statement(s) for {year}-{month:02d}, {len(user_ids) - rendered} already stored '
+            f'or empty, in {time.perf_counter() - started:.1f}s'
+        ))
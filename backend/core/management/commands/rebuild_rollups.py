@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+
+from core import rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the monthly category rollup table from raw transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=str,
+            help='Username whose rollups should be rebuilt (if not provided, rebuilds for all users)'
+        )
+
+    def handle(self, *args, **options):
+        username = options.get('user')
+        user = None
+        if username:
+            try:
+                user = User.objects.get(username=username)
+            except User.DoesNotExist:
+                self.stdout.write(
+                    self.style.ERROR(f'User "{username}" does not exist')
+                )
+                return
+
+        written = rollups.rebuild(user=user)
+        scope = f'user {username}' if username else 'all users'
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt {written} rollup rows for {scope}')
+        )
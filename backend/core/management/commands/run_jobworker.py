@@ -0,0 +1,135 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core import jobs
+from core.models import Job
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs (analysis, receipt extraction, PDF statements) from the database queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='Jobs run at the same time (default: 4)'
+        )
+        parser.add_argument(
+            '--pool',
+            type=str,
+            choices=['thread', 'process'],
+            default='thread',
+            help='Run jobs on threads (I/O bound LLM calls) or processes (CPU bound PDFs) (default: thread)'
+        )
+        parser.add_argument(
+            '--kinds',
+            type=str,
+            help=f'Comma separated job kinds to run (default: all of {", ".join(k for k, _ in Job.KIND_CHOICES)})'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when the queue is drained instead of polling for new jobs'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            help='Seconds between polls of an empty queue (default: JOB_POLL_INTERVAL)'
+        )
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        if concurrency < 1:
+            raise CommandError('--concurrency must be at least 1')
+        kinds = None
+        if options.get('kinds'):
+            kinds = [kind.strip() for kind in options['kinds'].split(',') if kind.strip()]
+            unknown = set(kinds) - {kind for kind, _ in Job.KIND_CHOICES}
+            if unknown:
+                raise CommandError(f'Unknown job kinds: {", ".join(sorted(unknown))}')
+        poll_interval = options.get('poll_interval') or getattr(settings, 'JOB_POLL_INTERVAL', 1)
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+
+        if options['pool'] == 'process':
+            executor = ProcessPoolExecutor(
+                max_workers=concurrency,
+                # Spawned, not forked, so no process inherits the parent's DB
+                # connection; each sets Django up itself before importing core.jobs
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+        else:
+            executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='jobworker')
+
+        stopping = []
+
+        def stop(signum, frame):
+            if not stopping:
+                self.stdout.write('Stopping after the running jobs finish...')
+            stopping.append(signum)
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        backend = 'SKIP LOCKED' if connection.features.has_select_for_update_skip_locked else 'compare-and-swap'
+        self.stdout.write(
+            f'Worker {worker}: {concurrency} {options["pool"]}(s), claiming with {backend}'
+        )
+
+        counts = {}
+        in_flight = {}
+        try:
+            while not stopping:
+                # Fill the free slots; claims happen here so a job is only leased
+                # when a slot is ready to run it
+                claimed_any = False
+                while len(in_flight) < concurrency and not stopping:
+                    # Each claim its own holder id: a job reclaimed after its
+                    # lease expired cannot be finished by this process's older run
+                    holder = jobs.lease_holder(worker)
+                    job = jobs.claim(holder, kinds=kinds)
+                    if job is None:
+                        break
+                    claimed_any = True
+                    in_flight[executor.submit(jobs.execute, job.pk, holder)] = job
+
+                if not in_flight:
+                    if options['once'] and not claimed_any:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+                done, _ = wait(list(in_flight), timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = in_flight.pop(future)
+                    self.report(job, future, counts)
+        finally:
+            for future in wait(list(in_flight)).done:
+                self.report(in_flight[future], future, counts)
+            executor.shutdown(wait=True)
+            connection.close()
+
+        summary = ', '.join(f'{count} {status}' for status, count in sorted(counts.items())) or 'no jobs'
+        self.stdout.write(self.style.SUCCESS(f'Worker {worker} finished: {summary}'))
+
+    def report(self, job, future, counts):
+        try:
+            new_status = future.result()
+        except Exception as e:
+            # execute() records handler failures itself, this is the worker failing
+            self.stderr.write(self.style.ERROR(f'Job {job.pk} ({job.kind}) crashed the worker: {e}'))
+            new_status = 'crashed'
+        new_status = new_status or 'lease lost'
+        counts[new_status] = counts.get(new_status, 0) + 1
+        style = self.style.SUCCESS if new_status == Job.STATUS_SUCCEEDED else self.style.WARNING
+        self.stdout.write(style(f'Job {job.pk} ({job.kind}, attempt {job.attempts}): {new_status}'))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+
+from core import anomalies
+
+
+class Command(BaseCommand):
+    help = 'Recompute spending statistics and rescore anomalies for all users or one user (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=str,
+            help='Username to rescore (if not provided, all users in one vectorized pass)'
+        )
+
+    def handle(self, *args, **options):
+        username = options.get('user')
+        user_ids = None
+        if username:
+            try:
+                user_ids = [User.objects.get(username=username).pk]
+            except User.DoesNotExist:
+                raise CommandError(f'User "{username}" does not exist')
+
+        started = time.perf_counter()
+        users, scored, found = anomalies.rescore(user_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Scored {scored} transactions of {users} user(s), {found} anomalies, '
+            f'in {time.perf_counter() - started:.1f}s'
+        ))
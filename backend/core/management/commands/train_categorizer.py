@@ -0,0 +1,94 @@
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+
+from core import categorizer
+from core.models import Transaction
+
+
+class Command(BaseCommand):
+    help = (
+        'Train the local category classifier on the stored transactions: the global model and '
+        'every user\'s own model, incrementally unless --rebuild'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=str,
+            help='Username whose model should be trained (if not provided, trains all models)'
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Start from empty models, e.g. after categories of old transactions were edited'
+        )
+        parser.add_argument(
+            '--evaluate',
+            action='store_true',
+            help='Only measure accuracy and latency: train in memory on 80%% of the rows, predict the rest'
+        )
+
+    def handle(self, *args, **options):
+        if options['evaluate']:
+            return self.evaluate()
+
+        username = options.get('user')
+        if username:
+            try:
+                user_ids = [User.objects.get(username=username).pk]
+            except User.DoesNotExist:
+                raise CommandError(f'User "{username}" does not exist')
+        else:
+            user_ids = [None] + list(
+                Transaction.objects.order_by('user_id').values_list('user_id', flat=True).distinct()
+            )
+
+        started = time.perf_counter()
+        for user_id in user_ids:
+            model = categorizer.train(user_id, rebuild=options['rebuild'])
+            name = 'global' if user_id is None else f'user {user_id}'
+            self.stdout.write(f'{name}: {model.examples} examples, up to transaction {model.last_transaction_id}')
+        self.stdout.write(
+            self.style.SUCCESS(f'Trained {len(user_ids)} model(s) in {time.perf_counter() - started:.1f}s')
+        )
+
+    def evaluate(self):
+        # Guessed categories are no ground truth
+        rows = Transaction.objects.filter(category_guessed=False).order_by('id').values_list(
+            'id', 'user_id', 'description', 'category'
+        )
+        train, test = [], []
+        for row in rows.iterator(chunk_size=2000):
+            (test if row[0] % 5 == 0 else train).append(row)
+        if not train or not test:
+            raise CommandError('Not enough transactions to evaluate')
+
+        shared = categorizer.CentroidModel()
+        personal = defaultdict(categorizer.CentroidModel)
+        started = time.perf_counter()
+        for transaction_id, user_id, description, category in train:
+            shared.learn([(transaction_id, description, category)])
+            personal[user_id].learn([(transaction_id, description, category)])
+        training = time.perf_counter() - started
+
+        correct = 0
+        timings = []
+        for _, user_id, description, category in test:
+            score = categorizer.scorer(personal[user_id], shared)
+            started = time.perf_counter()
+            scores = score(description)
+            timings.append(time.perf_counter() - started)
+            correct += scores is not None and categorizer.CATEGORIES[scores.argmax()] == category
+        timings.sort()
+        size = len(shared.dumps())
+        self.stdout.write(
+            f'Trained on {len(train)} transactions in {training:.2f}s, global model {size / 1024:.0f}KB stored'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Accuracy {correct / len(test):.1%} on {len(test)} held out transactions, '
+            f'prediction median {timings[len(timings) // 2] * 1e6:.0f}us, '
+            f'p99 {timings[int(len(timings) * 0.99)] * 1e6:.0f}us'
+        ))
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.3 on 2026-10-18 09:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+
+def populate_rollups(apps, schema_editor):
+    Transaction = apps.get_model('core', 'Transaction')
+    MonthlyCategoryRollup = apps.get_model('core', 'MonthlyCategoryRollup')
+
+    rows = (
+        Transaction.objects
+        .annotate(year=ExtractYear('date'), month=ExtractMonth('date'))
+        .values('user_id', 'year', 'month', 'category')
+        .annotate(
+            total_amount=Sum('amount'),
+            transaction_count=Count('id'),
+            recurring_count=Count('id', filter=Q(is_recurring=True)),
+        )
+        .order_by()
+    )
+    MonthlyCategoryRollup.objects.bulk_create(
+        (MonthlyCategoryRollup(**row) for row in rows.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_transactionimage_alter_transaction_date'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='transaction',
+            options={'ordering': ['-date']},
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='category',
+            field=models.CharField(choices=[('income', 'Income'), ('food', 'Food'), ('transport', 'Transport'), ('utilities', 'Utilities'), ('entertainment', 'Entertainment'), ('health', 'Health'), ('education', 'Education'), ('clothing', 'Clothing'), ('housing', 'Housing'), ('savings', 'Savings'), ('investment', 'Investment'), ('miscellaneous', 'Miscellaneous'), ('tax', 'Tax')], max_length=50),
+        ),
+        migrations.CreateModel(
+            name='MonthlyCategoryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('category', models.CharField(choices=[('income', 'Income'), ('food', 'Food'), ('transport', 'Transport'), ('utilities', 'Utilities'), ('entertainment', 'Entertainment'), ('health', 'Health'), ('education', 'Education'), ('clothing', 'Clothing'), ('housing', 'Housing'), ('savings', 'Savings'), ('investment', 'Investment'), ('miscellaneous', 'Miscellaneous'), ('tax', 'Tax')], max_length=50)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('transaction_count', models.IntegerField(default=0)),
+                ('recurring_count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-year', '-month', 'category'],
+                'constraints': [models.UniqueConstraint(fields=('user', 'year', 'month', 'category'), name='unique_monthly_category_rollup')],
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_alter_transaction_options_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', '-date', '-id'], name='txn_user_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'category', 'date'], name='txn_user_category_date_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_transaction_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('model_name', models.CharField(max_length=100)),
+                ('prompt_version', models.CharField(max_length=20)),
+                ('result', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='analysis_cache', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'year', 'month'], name='analysis_cache_period_idx'), models.Index(fields=['user', 'last_used_at'], name='analysis_cache_lru_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:29
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_analysiscache'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('analysis', 'Monthly analysis'), ('receipt', 'Receipt extraction'), ('pdf', 'PDF statement')], max_length=20)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('dead', 'Dead')], default='queued', max_length=20)),
+                ('priority', models.SmallIntegerField(default=0)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('input_file', models.FileField(blank=True, upload_to='job_inputs/')),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('result_file', models.FileField(blank=True, upload_to='job_results/')),
+                ('error', models.TextField(blank=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('max_attempts', models.PositiveSmallIntegerField(default=3)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', '-priority', 'run_after', 'id'], name='job_claim_idx'), models.Index(fields=['user', '-created_at'], name='job_user_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:52
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transactionimage',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='transactionimage',
+            name='hits',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='transactionimage',
+            name='last_used_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='transactionimage',
+            name='model_name',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='transactionimage',
+            name='phash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transactionimage',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='transactionimage',
+            name='size',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='transactionimage',
+            name='transactions',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name='transactionimage',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='receipt_images', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='transactionimage',
+            index=models.Index(fields=['user', 'sha256'], name='receipt_user_sha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionimage',
+            index=models.Index(fields=['user', 'last_used_at'], name='receipt_user_last_used_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionimage',
+            index=models.Index(fields=['last_used_at'], name='receipt_last_used_idx'),
+        ),
+    ]
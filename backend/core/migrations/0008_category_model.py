@@ -0,0 +1,29 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_receipt_cache'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=50, unique=True)),
+                ('feature_version', models.PositiveSmallIntegerField()),
+                ('weights', models.BinaryField()),
+                ('examples', models.PositiveIntegerField(default=0)),
+                ('last_transaction_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='category_models', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_category_model'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('analysis', 'Monthly analysis'), ('receipt', 'Receipt extraction'), ('pdf', 'PDF statement'), ('recurring', 'Recurring transaction detection')], max_length=20),
+        ),
+        migrations.CreateModel(
+            name='RecurringSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255)),
+                ('description', models.CharField(max_length=255)),
+                ('category', models.CharField(choices=[('income', 'Income'), ('food', 'Food'), ('transport', 'Transport'), ('utilities', 'Utilities'), ('entertainment', 'Entertainment'), ('health', 'Health'), ('education', 'Education'), ('clothing', 'Clothing'), ('housing', 'Housing'), ('savings', 'Savings'), ('investment', 'Investment'), ('miscellaneous', 'Miscellaneous'), ('tax', 'Tax')], max_length=50)),
+                ('period', models.CharField(choices=[('weekly', 'Weekly'), ('monthly', 'Monthly'), ('yearly', 'Yearly')], max_length=10)),
+                ('interval_days', models.FloatField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('occurrences', models.PositiveIntegerField()),
+                ('first_date', models.DateField()),
+                ('last_date', models.DateField()),
+                ('next_date', models.DateField()),
+                ('active', models.BooleanField(default=True)),
+                ('detected_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recurring_series', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['next_date'],
+                'indexes': [models.Index(fields=['user', 'next_date'], name='recurring_user_next_idx')],
+            },
+        ),
+    ]
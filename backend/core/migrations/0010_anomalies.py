@@ -0,0 +1,47 @@
+# Generated by Django 5.2.3 on 2026-10-18 21:07
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_recurring_series'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnomalyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('arrays', models.BinaryField()),
+                ('computed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='anomaly_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Anomaly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('transaction', 'Unusual transaction'), ('month', 'Unusual monthly total')], max_length=20)),
+                ('category', models.CharField(choices=[('income', 'Income'), ('food', 'Food'), ('transport', 'Transport'), ('utilities', 'Utilities'), ('entertainment', 'Entertainment'), ('health', 'Health'), ('education', 'Education'), ('clothing', 'Clothing'), ('housing', 'Housing'), ('savings', 'Savings'), ('investment', 'Investment'), ('miscellaneous', 'Miscellaneous'), ('tax', 'Tax')], max_length=50)),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('expected', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('score', models.FloatField()),
+                ('detected_at', models.DateTimeField(auto_now_add=True)),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='anomalies', to='core.transaction')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='anomalies', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-score'],
+                'indexes': [models.Index(fields=['user', 'year', 'month'], name='anomaly_user_period_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_monthly_statements'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('analysis', 'Monthly analysis'), ('receipt', 'Receipt extraction'), ('pdf', 'PDF statement'), ('recurring', 'Recurring transaction detection'), ('categorizer', 'Category classifier training')], max_length=20),
+        ),
+    ]
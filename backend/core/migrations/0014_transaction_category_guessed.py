@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 22:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_job_kind_categorizer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='category_guessed',
+            field=models.BooleanField(default=False),
+        ),
+    ]
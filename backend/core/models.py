@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 from .constants import catagory_choices
@@ -13,13 +14,296 @@ class Transaction(models.Model):
     description = models.CharField(max_length=255)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     is_recurring = models.BooleanField(default=False)
+    # Category guessed by core.categorizer or defaulted on import rather than given,
+    # not learned by the categorizer until the user sets it
+    category_guessed = models.BooleanField(default=False)
     
     class Meta:
         ordering = ['-date']
+        indexes = [
+            # List view: a user's rows newest first, with id as the keyset tie-breaker
+            models.Index(fields=['user', '-date', '-id'], name='txn_user_date_id_idx'),
+            # Category filters and per-period analysis/PDF range scans
+            models.Index(fields=['user', 'category', 'date'], name='txn_user_category_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.description} - {self.amount} BDT"
     
 
 class TransactionImage(models.Model):
+    """A receipt image already read by Gemini and the transactions extracted from it, see core.receipt_cache"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='receipt_images', null=True, blank=True)
     image = models.ImageField(upload_to='transaction_images/')
+    # SHA-256 of the preprocessed image and its perceptual hash
+    sha256 = models.CharField(max_length=64, blank=True)
+    phash = models.BigIntegerField(null=True, blank=True)
+    model_name = models.CharField(max_length=100, blank=True)
+    transactions = models.JSONField(default=list)
+    size = models.PositiveIntegerField(default=0)
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    last_used_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'sha256'], name='receipt_user_sha_idx'),
+            # Least recently used first, for eviction
+            models.Index(fields=['user', 'last_used_at'], name='receipt_user_last_used_idx'),
+            models.Index(fields=['last_used_at'], name='receipt_last_used_idx'),
+        ]
+
+
+class MonthlyCategoryRollup(models.Model):
+    """Per-user monthly totals by category, kept in sync by core.rollups."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_rollups')
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    category = models.CharField(max_length=50, choices=catagory_choices)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    transaction_count = models.IntegerField(default=0)
+    recurring_count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['-year', '-month', 'category']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'year', 'month', 'category'],
+                name='unique_monthly_category_rollup',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.year}-{self.month:02d} {self.category}: {self.total_amount} BDT"
+
+
+
+class AnalysisCache(models.Model):
+    """Stored Gemini analysis for a user's month, see core.analysis_cache."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='analysis_cache')
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    key = models.CharField(max_length=64, unique=True)
+    fingerprint = models.CharField(max_length=64)
+    model_name = models.CharField(max_length=100)
+    prompt_version = models.CharField(max_length=20)
+    result = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'year', 'month'], name='analysis_cache_period_idx'),
+            models.Index(fields=['user', 'last_used_at'], name='analysis_cache_lru_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.year}-{self.month:02d} ({self.model_name} v{self.prompt_version})"
+
+
+class Job(models.Model):
+    """Background work item run by the run_jobworker command, see core.jobs."""
+    KIND_ANALYSIS = 'analysis'
+    KIND_RECEIPT = 'receipt'
+    KIND_PDF = 'pdf'
+    KIND_RECURRING = 'recurring'
+    KIND_CATEGORIZER = 'categorizer'
+    KIND_CHOICES = [
+        (KIND_ANALYSIS, 'Monthly analysis'),
+        (KIND_RECEIPT, 'Receipt extraction'),
+        (KIND_PDF, 'PDF statement'),
+        (KIND_RECURRING, 'Recurring transaction detection'),
+        (KIND_CATEGORIZER, 'Category classifier training'),
+    ]
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_DEAD = 'dead'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        # Out of attempts or failed permanently (dead letter)
+        (STATUS_DEAD, 'Dead'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    # Higher runs first
+    priority = models.SmallIntegerField(default=0)
+    payload = models.JSONField(default=dict, blank=True)
+    input_file = models.FileField(upload_to='job_inputs/', blank=True)
+    result = models.JSONField(null=True, blank=True)
+    result_file = models.FileField(upload_to='job_results/', blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    worker = models.CharField(max_length=100, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Claim order of the worker: runnable jobs by priority, then age
+            models.Index(fields=['status', '-priority', 'run_after', 'id'], name='job_claim_idx'),
+            models.Index(fields=['user', '-created_at'], name='job_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job {self.pk} ({self.status})"
+
+
+class CategoryModel(models.Model):
+    """Stored category classifier of one user, or of all users when user is None, see core.categorizer."""
+    key = models.CharField(max_length=50, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='category_models', null=True, blank=True)
+    feature_version = models.PositiveSmallIntegerField()
+    # Compressed numpy arrays: per-category feature sums and example counts
+    weights = models.BinaryField()
+    examples = models.PositiveIntegerField(default=0)
+    # Transactions up to this id have been learned
+    last_transaction_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.examples} examples)"
+
+
+class RecurringSeries(models.Model):
+    """Transactions repeating at a regular interval, found by core.recurring."""
+    PERIOD_WEEKLY = 'weekly'
+    PERIOD_MONTHLY = 'monthly'
+    PERIOD_YEARLY = 'yearly'
+    PERIOD_CHOICES = [
+        (PERIOD_WEEKLY, 'Weekly'),
+        (PERIOD_MONTHLY, 'Monthly'),
+        (PERIOD_YEARLY, 'Yearly'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recurring_series')
+    # Normalized description the transactions were grouped by
+    key = models.CharField(max_length=255)
+    # Description and category of the latest occurrence
+    description = models.CharField(max_length=255)
+    category = models.CharField(max_length=50, choices=catagory_choices)
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    interval_days = models.FloatField()
+    # Expected amount of the next occurrence
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    occurrences = models.PositiveIntegerField()
+    first_date = models.DateField()
+    last_date = models.DateField()
+    next_date = models.DateField()
+    # False once an expected occurrence is overdue
+    active = models.BooleanField(default=True)
+    detected_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['next_date']
+        indexes = [
+            models.Index(fields=['user', 'next_date'], name='recurring_user_next_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.description} ({self.period}, {self.amount} BDT)"
+
+
+class AnomalyStats(models.Model):
+    """Per-category spending statistics of a user, as one numpy array, see core.anomalies."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='anomaly_stats')
+    arrays = models.BinaryField()
+    computed_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user} (computed {self.computed_at:%Y-%m-%d %H:%M})"
+
+
+class Anomaly(models.Model):
+    """An unusually large transaction, or category month, found by core.anomalies."""
+    KIND_TRANSACTION = 'transaction'
+    KIND_MONTH = 'month'
+    KIND_CHOICES = [
+        (KIND_TRANSACTION, 'Unusual transaction'),
+        (KIND_MONTH, 'Unusual monthly total'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='anomalies')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    transaction = models.ForeignKey(
+        Transaction, on_delete=models.CASCADE, related_name='anomalies', null=True, blank=True
+    )
+    category = models.CharField(max_length=50, choices=catagory_choices)
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+    # What was expected: the category's typical transaction or month
+    expected = models.DecimalField(max_digits=14, decimal_places=2)
+    # Robust z-score, deviations from the median in MAD units
+    score = models.FloatField()
+    detected_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-score']
+        indexes = [
+            models.Index(fields=['user', 'year', 'month'], name='anomaly_user_period_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} anomaly {self.category} {self.year}-{self.month:02d} ({self.score:.1f})"
+
+
+class ForecastCurve(models.Model):
+    """A user's cumulative daily spending in one past month, by category, see core.forecast."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='forecast_curves')
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    # Hash of the recurring series left out of the curve, a new set rebuilds it
+    signature = models.CharField(max_length=64)
+    cumulative = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'year', 'month'], name='unique_forecast_curve'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.year}-{self.month:02d}"
+
+
+class DataVersion(models.Model):
+    """Counter bumped on every write to a user's transactions, see core.statements."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='data_version')
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user} v{self.version}"
+
+
+class MonthlyStatement(models.Model):
+    """A rendered PDF statement of a user's month, see core.statements."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='statements')
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    # The user's DataVersion when the statement was rendered
+    data_version = models.PositiveBigIntegerField()
+    # statements.RENDERER_VERSION, statements of another layout are rendered again
+    renderer_version = models.PositiveSmallIntegerField()
+    file = models.FileField(upload_to='statements/')
+    size = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'year', 'month'], name='unique_monthly_statement'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.year}-{self.month:02d} ({self.size} bytes)"
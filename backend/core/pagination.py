@@ -1,7 +1,17 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, BasePagination
 from rest_framework.response import Response
 from collections import OrderedDict
 import math
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q
+from datetime import date
+from decimal import Decimal, InvalidOperation
+import base64
+import hashlib
+import json
 
 class DefaultPagination(PageNumberPagination):
     page_size = 20
@@ -17,4 +27,189 @@ class DefaultPagination(PageNumberPagination):
             ('next', self.get_next_link()),
             ('previous', self.get_previous_link()),
             ('results', data)
-        ]))
\ No newline at end of file
+        ]))
+
+
+class KeysetPagination(BasePagination):
+    """
+    Seek-based pagination over (ordering field, id).
+
+    Every page is fetched with a WHERE clause on the last row seen instead of an
+    OFFSET, so page N costs the same as page 1. The cursor handed to the client is
+    an opaque base64 token; a malformed one is a 400. Totals are optional
+    (`?total=exact|estimate`) and cached per user and filter set, see cached().
+    """
+    page_size = 20
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    total_query_param = 'total'
+    default_ordering = '-date'
+    total_cache_timeout = 60
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.field, self.descending = self.get_ordering(request, view)
+        cursor = self.decode_cursor(request)
+        self.reverse = bool(cursor and cursor.get('r'))
+
+        # Fetching backwards flips the ordering, the page is reversed afterwards
+        descending = self.descending != self.reverse
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(f'{prefix}{self.field}', f'{prefix}id')
+
+        base_queryset = queryset
+        if cursor:
+            op = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__{op}': cursor['v']})
+                | Q(**{self.field: cursor['v'], f'id__{op}': cursor['id']})
+            )
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not self.reverse else True
+        self.has_previous = bool(cursor) if not self.reverse else has_more
+        self.first_row = rows[0] if rows else None
+        self.last_row = rows[-1] if rows else None
+        self.total = self.get_total(request, base_queryset)
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_ordering(self, request, view):
+        allowed = getattr(view, 'ordering_fields', None) or ['date']
+        ordering = request.query_params.get('ordering', self.default_ordering).split(',')[0].strip()
+        field = ordering.lstrip('-')
+        if field not in allowed:
+            ordering = self.default_ordering
+            field = ordering.lstrip('-')
+        return field, ordering.startswith('-')
+
+    def decode_cursor(self, request):
+        """The cursor's position with its value parsed, None on the first page"""
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            cursor = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            if cursor['f'] != self.field:
+                raise ValueError('Cursor was issued for a different ordering')
+            return {'v': self.parse_value(cursor['v']), 'id': int(cursor['id']), 'r': cursor.get('r')}
+        except (KeyError, TypeError, ValueError, UnicodeError, InvalidOperation, AttributeError):
+            raise ParseError('Invalid cursor')
+
+    def encode_cursor(self, row, reverse):
+        value = self.row_value(row, self.field)
+        payload = {'f': self.field, 'v': self.format_value(value), 'id': self.row_value(row, 'id')}
+        if reverse:
+            payload['r'] = 1
+        raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def row_value(row, name):
+        # Rows are model instances for the regular list, dicts for .values() reads
+        if isinstance(row, dict):
+            return row[name]
+        return getattr(row, name)
+
+    @staticmethod
+    def format_value(value):
+        if isinstance(value, date):
+            return value.isoformat()
+        return str(value)
+
+    def parse_value(self, raw):
+        if not isinstance(raw, str):
+            raise TypeError('Cursor value must be a string')
+        if self.field == 'date':
+            return date.fromisoformat(raw)
+        if self.field == 'amount':
+            value = Decimal(raw)
+            if not value.is_finite():
+                raise ValueError('Cursor amount must be finite')
+            return value
+        return raw
+
+    def wants_total(self, request):
+        return request.query_params.get(self.total_query_param) in ('exact', 'estimate')
+
+    def get_total(self, request, queryset):
+        if not self.wants_total(request):
+            return None
+        mode = request.query_params.get(self.total_query_param)
+
+        def count():
+            filtered = queryset.order_by()
+            total = self.estimate_count(filtered) if mode == 'estimate' else None
+            return filtered.count() if total is None else total
+        return self.cached(request, 'count', count)
+
+    def cached(self, request, name, compute):
+        """
+        compute() cached for total_cache_timeout seconds per user and filter
+        set, so totals are not recomputed on every page of a walk
+        """
+        key = self.get_total_cache_key(request, name)
+        value = cache.get(key)
+        if value is None:
+            value = compute()
+            cache.set(key, value, self.total_cache_timeout)
+        return value
+
+    def get_total_cache_key(self, request, name='count'):
+        params = sorted(
+            (k, v) for k, v in request.query_params.items()
+            if k not in (self.cursor_query_param, self.page_size_query_param)
+        )
+        digest = hashlib.sha1(json.dumps(params).encode('utf-8')).hexdigest()
+        return f'keyset-{name}:{request.user.pk}:{digest}'
+
+    @staticmethod
+    def estimate_count(queryset):
+        """Planner row estimate on PostgreSQL, None elsewhere."""
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def get_next_link(self):
+        if not self.has_next or self.last_row is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last_row, False))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.first_row is None:
+            return remove_query_param(url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.first_row, True))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.total),
+            ('page_size', self.page_size),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
@@ -0,0 +1,370 @@
+import bisect
+import functools
+import itertools
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+
+from fpdf.fonts import CORE_FONTS_CHARWIDTHS
+
+
+# Streaming PDF statement writer for ranges of any size (a month, a quarter,
+# years of transactions). Unlike transaction_to_pdf, which builds the whole FPDF
+# document in memory, statement_chunks() takes the rows from an iterator, fills
+# one page (ROWS_PER_PAGE rows) at a time and yields it as finished PDF bytes,
+# so memory stays bounded by a page plus one offset per PDF object.
+#
+# Totals for the summary are added up in the same pass. The summary page is
+# written last, once they are known, but listed first in the page tree (/Kids),
+# so it is the first page readers show.
+#
+# The standard Helvetica fonts need no embedding; text widths for centering,
+# right alignment and truncation come from their metrics. Everything that is
+# the same on every page (header, table header, grid) is built once, and each
+# page draws its text grouped by colour: three colour changes a page instead
+# of four per row.
+
+MM = 72 / 25.4
+PAGE_WIDTH, PAGE_HEIGHT = 595.28, 841.89
+MARGIN = 10 * MM
+CELL_PADDING = 1 * MM
+
+# Date, description, amount, category, in mm like transaction_to_pdf
+COLUMN_WIDTHS = [width * MM for width in (30, 85, 35, 40)]
+COLUMN_LEFTS = [MARGIN + sum(COLUMN_WIDTHS[:i]) for i in range(len(COLUMN_WIDTHS))]
+TABLE_RIGHT = MARGIN + sum(COLUMN_WIDTHS)
+TABLE_TOP = 34 * MM
+HEADER_ROW_HEIGHT = 10 * MM
+ROW_HEIGHT = 8 * MM
+ROWS_TOP = TABLE_TOP + HEADER_ROW_HEIGHT
+ROWS_PER_PAGE = int((PAGE_HEIGHT - 25 * MM - ROWS_TOP) // ROW_HEIGHT)
+
+FONTS = {'F1': 'Helvetica', 'F2': 'Helvetica-Bold', 'F3': 'Helvetica-Oblique'}
+# Glyph widths by character code
+_WIDTH_TABLES = {
+    name: [CORE_FONTS_CHARWIDTHS[metrics].get(chr(code), 556) for code in range(256)]
+    for name, metrics in (('F1', 'helvetica'), ('F2', 'helveticaB'), ('F3', 'helveticaI'))
+}
+BLACK, GREEN, RED = b'0 g', b'0 0.502 0 rg', b'1 0 0 rg'
+
+# Fixed object numbers, pages follow
+CATALOG, PAGES, RESOURCES, INFO = 1, 2, 3, 4
+FONT_OBJECTS = {name: 5 + i for i, name in enumerate(FONTS)}
+FIRST_PAGE_OBJECT = 5 + len(FONTS)
+
+TITLE = 'Auto Finance AI Transcript'
+MOTTO = '- Smarter Budgets, Better Habits.'
+TABLE_HEADER = ('Date', 'Description', 'Amount (BDT)', 'Category')
+
+
+def _encode(text):
+    """Text as WinAnsiEncoding bytes, one byte per character"""
+    return text.replace('\r', ' ').replace('\n', ' ').encode('cp1252', 'replace')
+
+
+def _units(data, font):
+    # Glyph widths in 1/1000 of the font size
+    return sum(map(_WIDTH_TABLES[font].__getitem__, data))
+
+
+def text_width(text, font, size):
+    return _units(_encode(text), font) * size / 1000
+
+
+def fit(data, font, size, width):
+    """Encoded text cut to `width` points, ending in '...' when cut"""
+    room = width * 1000 / size
+    if _units(data, font) <= room:
+        return data
+    cut = bisect.bisect_right(
+        list(itertools.accumulate(map(_WIDTH_TABLES[font].__getitem__, data))),
+        room - _units(b'...', font),
+    )
+    return data[:cut] + b'...'
+
+
+def _literal(data):
+    """A PDF string literal of encoded text"""
+    return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def _show(font, size, text, x, top, height):
+    """Text operators placing `text` vertically centred in a cell starting at `top` (from the page top)"""
+    baseline = PAGE_HEIGHT - (top + height / 2 + 0.35 * size)
+    return b'/%s %g Tf 1 0 0 1 %.2f %.2f Tm %s Tj' % (font.encode(), size, x, baseline, _literal(_encode(text)))
+
+
+def _centered(font, size, text, left, width, top, height):
+    return _show(font, size, text, left + (width - text_width(text, font, size)) / 2, top, height)
+
+
+def _right(font, size, text, right, top, height):
+    return _show(font, size, text, right - CELL_PADDING - text_width(text, font, size), top, height)
+
+
+def _grid(top, row_heights, edges=None):
+    """Cell borders of a table with columns between `edges` x positions, as one path"""
+    edges = edges or COLUMN_LEFTS + [TABLE_RIGHT]
+    bottom = top + sum(row_heights)
+    lines = []
+    y = top
+    for height in [0] + row_heights:
+        y += height
+        lines.append(b'%.2f %.2f m %.2f %.2f l' % (edges[0], PAGE_HEIGHT - y, edges[-1], PAGE_HEIGHT - y))
+    for x in edges:
+        lines.append(b'%.2f %.2f m %.2f %.2f l' % (x, PAGE_HEIGHT - top, x, PAGE_HEIGHT - bottom))
+    return b'\n'.join(lines) + b'\nS'
+
+
+def _page_head():
+    """The header and table header texts every row page starts with"""
+    content_width = PAGE_WIDTH - 2 * MARGIN
+    texts = [
+        _centered('F2', 16, TITLE, MARGIN, content_width, 10 * MM, 10 * MM),
+        _centered('F3', 10, MOTTO, MARGIN, content_width, 20 * MM, 6 * MM),
+    ]
+    texts += [
+        _centered('F2', 10, label, left, width, TABLE_TOP, HEADER_ROW_HEIGHT)
+        for label, left, width in zip(TABLE_HEADER, COLUMN_LEFTS, COLUMN_WIDTHS)
+    ]
+    return b'0.57 w\n' + b'BT\n' + b'\n'.join(texts) + b'\nET\n'
+
+
+PAGE_HEAD = _page_head()
+FULL_PAGE_GRID = _grid(TABLE_TOP, [HEADER_ROW_HEIGHT] + [ROW_HEIGHT] * ROWS_PER_PAGE)
+
+
+def _footer(page_number):
+    text = f'Page {page_number}'
+    return b'BT\n' + BLACK + b'\n' + _centered('F3', 8, text, MARGIN, PAGE_WIDTH - 2 * MARGIN, PAGE_HEIGHT - 15 * MM, 10 * MM) + b'\nET\n'
+
+
+def _format_date(value):
+    if isinstance(value, (date, datetime)):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
+
+
+class Summary:
+    """Totals of the rows written so far"""
+
+    def __init__(self):
+        self.count = 0
+        self.income = Decimal('0')
+        self.expenses = Decimal('0')
+        # category -> [count, total]
+        self.categories = {}
+        self.first_date = None
+        self.last_date = None
+
+    def add(self, day, amount, category):
+        self.count += 1
+        if self.first_date is None:
+            self.first_date = day
+        self.last_date = day
+        if category.lower() == 'income':
+            self.income += amount
+        else:
+            self.expenses += amount
+        totals = self.categories.setdefault(category, [0, Decimal('0')])
+        totals[0] += 1
+        totals[1] += amount
+
+
+# Row text positions, computed once
+ROW_FONT_SIZE = 9
+ROW_BASELINES = [
+    PAGE_HEIGHT - (ROWS_TOP + i * ROW_HEIGHT + ROW_HEIGHT / 2 + 0.35 * ROW_FONT_SIZE) for i in range(ROWS_PER_PAGE)
+]
+DATE_CENTER = COLUMN_LEFTS[0] + COLUMN_WIDTHS[0] / 2
+DESCRIPTION_LEFT = COLUMN_LEFTS[1] + CELL_PADDING
+DESCRIPTION_WIDTH = COLUMN_WIDTHS[1] - 2 * CELL_PADDING
+AMOUNT_RIGHT = COLUMN_LEFTS[2] + COLUMN_WIDTHS[2] - CELL_PADDING
+CATEGORY_CENTER = COLUMN_LEFTS[3] + COLUMN_WIDTHS[3] / 2
+ROW_TEXT = b'1 0 0 1 %.2f %.2f Tm %s Tj'
+
+
+@functools.lru_cache(maxsize=256)
+def _category_cell(category):
+    """(x offset from the column centre, literal) of a category, there are only a few"""
+    label = category.title()
+    return -text_width(label, 'F1', ROW_FONT_SIZE) / 2, _literal(_encode(label))
+
+
+def _row_page(rows, page_number):
+    """Content stream of one page of table rows"""
+    black, green, red = [], [], []
+    for baseline, (date_text, description, amount, category) in zip(ROW_BASELINES, rows):
+        colored = green if category.lower() == 'income' else red
+        date_data, amount_data = _encode(date_text), f'{amount:,.2f}'.encode('ascii')
+        colored.append(ROW_TEXT % (
+            DATE_CENTER - _units(date_data, 'F1') * ROW_FONT_SIZE / 2000, baseline, _literal(date_data)
+        ))
+        colored.append(ROW_TEXT % (
+            AMOUNT_RIGHT - _units(amount_data, 'F1') * ROW_FONT_SIZE / 1000, baseline, b'(%s)' % amount_data
+        ))
+        black.append(ROW_TEXT % (
+            DESCRIPTION_LEFT, baseline, _literal(fit(_encode(description), 'F1', ROW_FONT_SIZE, DESCRIPTION_WIDTH))
+        ))
+        offset, label = _category_cell(category)
+        black.append(ROW_TEXT % (CATEGORY_CENTER + offset, baseline, label))
+    grid = FULL_PAGE_GRID if len(rows) == ROWS_PER_PAGE else _grid(
+        TABLE_TOP, [HEADER_ROW_HEIGHT] + [ROW_HEIGHT] * len(rows)
+    )
+    parts = [PAGE_HEAD, grid, b'\nBT\n/F1 %d Tf\n' % ROW_FONT_SIZE, BLACK, b'\n', b'\n'.join(black)]
+    if green:
+        parts += [b'\n', GREEN, b'\n', b'\n'.join(green)]
+    if red:
+        parts += [b'\n', RED, b'\n', b'\n'.join(red)]
+    parts += [b'\nET\n', _footer(page_number)]
+    return b''.join(parts)
+
+
+def _summary_page(summary, generated_on):
+    content_width = PAGE_WIDTH - 2 * MARGIN
+    first, last = _format_date(summary.first_date or ''), _format_date(summary.last_date or '')
+    texts = [
+        _centered('F2', 16, TITLE, MARGIN, content_width, 10 * MM, 10 * MM),
+        _centered('F3', 10, MOTTO, MARGIN, content_width, 20 * MM, 6 * MM),
+        _centered('F2', 14, f'Transactions from {first} to {last}', MARGIN, content_width, 34 * MM, 10 * MM),
+        _right('F1', 10, f'Generated on: {generated_on:%Y-%m-%d %H:%M:%S}', PAGE_WIDTH - MARGIN + CELL_PADDING, 49 * MM, 10 * MM),
+        _show('F2', 12, 'Summary', MARGIN, 64 * MM, 10 * MM),
+    ]
+    lines = [
+        f'Total Income: BDT {summary.income:,.2f}',
+        f'Total Expenses: BDT {summary.expenses:,.2f}',
+        f'Net Amount: BDT {summary.income - summary.expenses:,.2f}',
+        f'Total Transactions: {summary.count}',
+    ]
+    top = 74 * MM
+    for line in lines:
+        texts.append(_show('F1', 10, line, MARGIN, top, 8 * MM))
+        top += 8 * MM
+
+    top += 10 * MM
+    texts.append(_show('F2', 12, 'By category', MARGIN, top, 10 * MM))
+    top += 10 * MM
+    categories = sorted(summary.categories.items(), key=lambda item: item[1][1], reverse=True)
+    texts += [
+        _centered('F2', 10, label, left, width, top, HEADER_ROW_HEIGHT)
+        for label, left, width in zip(('Category', 'Transactions', 'Total (BDT)'), COLUMN_LEFTS, COLUMN_WIDTHS)
+    ]
+    grid_top = top
+    top += HEADER_ROW_HEIGHT
+    for category, (count, total) in categories:
+        texts.append(_centered('F1', 9, category.title(), COLUMN_LEFTS[0], COLUMN_WIDTHS[0], top, ROW_HEIGHT))
+        texts.append(_centered('F1', 9, f'{count:,}', COLUMN_LEFTS[1], COLUMN_WIDTHS[1], top, ROW_HEIGHT))
+        texts.append(_right('F1', 9, f'{total:,.2f}', COLUMN_LEFTS[2] + COLUMN_WIDTHS[2], top, ROW_HEIGHT))
+        top += ROW_HEIGHT
+    # The first three columns of the transaction table
+    grid = _grid(grid_top, [HEADER_ROW_HEIGHT] + [ROW_HEIGHT] * len(categories), COLUMN_LEFTS)
+    return b''.join([b'0.57 w\n', grid, b'\nBT\n', b'\n'.join(texts), b'\nET\n', _footer(1)])
+
+
+class _Objects:
+    """Numbers PDF objects and remembers where each starts in the output"""
+
+    def __init__(self):
+        self.position = 0
+        self.offsets = {}
+
+    def header(self):
+        data = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+        self.position += len(data)
+        return data
+
+    def write(self, number, body):
+        self.offsets[number] = self.position
+        data = b'%d 0 obj\n%s\nendobj\n' % (number, body)
+        self.position += len(data)
+        return data
+
+    def stream(self, number, content, compress):
+        if compress:
+            content = zlib.compress(content, compress)
+            return self.write(number, b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(content), content))
+        return self.write(number, b'<< /Length %d >>\nstream\n%s\nendstream' % (len(content), content))
+
+    def trailer(self):
+        size = max(self.offsets) + 1
+        entries = [b'0000000000 65535 f \n']
+        entries += [
+            b'%010d 00000 n \n' % self.offsets[number] if number in self.offsets else b'0000000000 65535 f \n'
+            for number in range(1, size)
+        ]
+        return b'xref\n0 %d\n%s' % (size, b''.join(entries)) + (
+            b'trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+            % (size, CATALOG, INFO, self.position)
+        )
+
+
+def _page(objects, number, content_number):
+    return objects.write(
+        number,
+        b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f] /Resources %d 0 R /Contents %d 0 R >>'
+        % (PAGES, PAGE_WIDTH, PAGE_HEIGHT, RESOURCES, content_number),
+    )
+
+
+def statement_chunks(rows, generated_on=None, compress=6, summary=None):
+    """
+    Writes a statement PDF, one page at a time.
+
+    Args:
+        rows (iterable): (date, description, amount, category) tuples in date
+            order, e.g. a values_list() iterator
+        generated_on (datetime, optional): Shown on the summary page, defaults to now
+        compress (int): zlib level for the page contents, 0 leaves them uncompressed
+        summary (Summary, optional): Filled with the totals, for callers that
+            need them once the PDF is written
+
+    Yields:
+        bytes: Consecutive parts of the PDF
+    """
+    generated_on = generated_on or datetime.now()
+    summary = summary if summary is not None else Summary()
+    objects = _Objects()
+    yield objects.header()
+    fonts = b''.join(
+        objects.write(FONT_OBJECTS[name], b'<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>' % base.encode())
+        for name, base in FONTS.items()
+    )
+    resources = b' '.join(b'/%s %d 0 R' % (name.encode(), FONT_OBJECTS[name]) for name in FONTS)
+    yield fonts + objects.write(RESOURCES, b'<< /Font << %s >> >>' % resources)
+
+    page_objects = []
+    next_object = FIRST_PAGE_OBJECT
+    page = []
+
+    def flush():
+        nonlocal next_object
+        content = _row_page(page, len(page_objects) + 2)
+        data = objects.stream(next_object, content, compress) + _page(objects, next_object + 1, next_object)
+        page_objects.append(next_object + 1)
+        next_object += 2
+        page.clear()
+        return data
+
+    for day, description, amount, category in rows:
+        amount = amount if isinstance(amount, Decimal) else Decimal(str(amount))
+        category = category or ''
+        summary.add(day, amount, category)
+        page.append((_format_date(day), description or '', amount, category))
+        if len(page) == ROWS_PER_PAGE:
+            yield flush()
+    if page:
+        yield flush()
+
+    summary_content = _summary_page(summary, generated_on)
+    summary_page = next_object + 1
+    data = objects.stream(next_object, summary_content, compress) + _page(objects, summary_page, next_object)
+    kids = b' '.join(b'%d 0 R' % number for number in [summary_page] + page_objects)
+    data += objects.write(PAGES, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(page_objects) + 1))
+    data += objects.write(CATALOG, b'<< /Type /Catalog /Pages %d 0 R >>' % PAGES)
+    data += objects.write(INFO, b'<< /Producer (AutoFinanceAI) /CreationDate (D:%s) >>' % generated_on.strftime('%Y%m%d%H%M%S').encode())
+    yield data + objects.trailer()
+
+
+def statement_pdf(rows, **kwargs):
+    """The whole statement as bytes, for small ranges such as a month"""
+    return b''.join(statement_chunks(rows, **kwargs))
@@ -0,0 +1,59 @@
+from datetime import date
+
+
+# Periods are half-open [start, end) date ranges so queries compile to
+# `date >= start AND date < end`, which can use the (user, date) indexes,
+# unlike `date__year`/`date__month` lookups that wrap the column in a function.
+
+
+def month_range(year, month):
+    """Returns (first day of the month, first day of the next month)."""
+    start = date(year, month, 1)
+    if month == 12:
+        return start, date(year + 1, 1, 1)
+    return start, date(year, month + 1, 1)
+
+
+def quarter_range(year, quarter):
+    """Returns the half-open range of a quarter (1-4)."""
+    if not 1 <= quarter <= 4:
+        raise ValueError("Quarter must be between 1 and 4")
+    first_month = 3 * (quarter - 1) + 1
+    start, _ = month_range(year, first_month)
+    _, end = month_range(year, first_month + 2)
+    return start, end
+
+
+def year_range(year):
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+
+def previous_month(year, month):
+    """Returns (year, month) of the month before."""
+    if month == 1:
+        return year - 1, 12
+    return year, month - 1
+
+
+def period_range(year, month=None, quarter=None):
+    """
+    Turns a month, quarter or year selection into a half-open date range.
+
+    Args:
+        year (int): Calendar year
+        month (int, optional): Month 1-12, takes precedence over quarter
+        quarter (int, optional): Quarter 1-4
+
+    Returns:
+        tuple: (start, end) dates, end exclusive
+    """
+    if month is not None:
+        return month_range(year, month)
+    if quarter is not None:
+        return quarter_range(year, quarter)
+    return year_range(year)
+
+
+def period_filter(start, end):
+    """Keyword arguments filtering `date` into [start, end)."""
+    return {'date__gte': start, 'date__lt': end}
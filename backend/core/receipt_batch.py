@@ -0,0 +1,194 @@
+import logging
+import posixpath
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, NamedTuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+
+# Batch receipt upload: many images in one request, each uploaded file either
+# an image or a zip of images. The receipts are read concurrently, at most
+# RECEIPT_BATCH_CONCURRENCY at a time per request, and every receipt's outcome
+# is reported as soon as it is known, so one unreadable photo does not fail the
+# rest of the shoebox.
+#
+# Images are read lazily, when a worker picks them up, so a batch only holds
+# about RECEIPT_BATCH_CONCURRENCY images in memory rather than all of them.
+#
+# Each receipt that is not in core.receipt_cache costs a Gemini call, and a user
+# may spend at most RECEIPT_BATCH_RATE_LIMIT of them per RECEIPT_BATCH_RATE_PERIOD
+# seconds on batches. The counter lives in Django's cache; it is shared by the
+# worker processes when the cache backend is (Redis, Memcached, database).
+
+MAX_IMAGE_BYTES = 5 * 1024 * 1024
+MAX_ARCHIVE_BYTES = 100 * 1024 * 1024
+ZIP_SIGNATURE = b'PK\x03\x04'
+
+
+class RateBudgetExceeded(Exception):
+    """The user has used up their Gemini calls for the current period"""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f'Receipt rate budget exceeded, retry in {retry_after:.0f}s')
+
+
+class BatchImage(NamedTuple):
+    name: str
+    # Returns the image bytes, raises ValueError when the entry is unusable
+    read: Callable[[], bytes]
+
+
+def max_images():
+    return getattr(settings, 'RECEIPT_BATCH_MAX_IMAGES', 50)
+
+
+def concurrency():
+    return max(1, getattr(settings, 'RECEIPT_BATCH_CONCURRENCY', 4))
+
+
+def take_budget(user):
+    """
+    Spends one Gemini call of the user's batch budget.
+
+    Raises:
+        RateBudgetExceeded: The budget of the current period is used up
+    """
+    limit = getattr(settings, 'RECEIPT_BATCH_RATE_LIMIT', 100)
+    if not limit:
+        return
+    period = getattr(settings, 'RECEIPT_BATCH_RATE_PERIOD', 3600)
+    now = time.time()
+    window = int(now // period)
+    key = f'receipt-budget:{user.pk}:{window}'
+    cache.add(key, 0, timeout=period)
+    try:
+        used = cache.incr(key)
+    except ValueError:
+        # Expired between add() and incr()
+        cache.set(key, 1, timeout=period)
+        used = 1
+    if used > limit:
+        raise RateBudgetExceeded((window + 1) * period - now)
+
+
+def _read_upload(upload):
+    def read():
+        if upload.size > MAX_IMAGE_BYTES:
+            raise ValueError('Image file size exceeds 5MB limit.')
+        return upload.read()
+    return read
+
+
+def _read_member(archive, info):
+    def read():
+        if info.file_size > MAX_IMAGE_BYTES:
+            raise ValueError('Image file size exceeds 5MB limit.')
+        with archive.open(info) as member:
+            # The size in the zip header is not trusted
+            data = member.read(MAX_IMAGE_BYTES + 1)
+        if len(data) > MAX_IMAGE_BYTES:
+            raise ValueError('Image file size exceeds 5MB limit.')
+        return data
+    return read
+
+
+def _failed(error):
+    def read():
+        raise ValueError(error)
+    return read
+
+
+def _is_zip(upload):
+    start = upload.read(len(ZIP_SIGNATURE))
+    upload.seek(0)
+    return start == ZIP_SIGNATURE
+
+
+def collect_images(uploads):
+    """
+    Lists the receipts of a batch upload, expanding zip archives.
+
+    Args:
+        uploads (list): UploadedFile objects, images or zips of images
+
+    Returns:
+        list: BatchImage per receipt, in upload (and archive) order
+
+    Raises:
+        ValueError: More than max_images() receipts
+    """
+    images = []
+
+    def add(image):
+        # Checked per entry, so an archive of millions of entries stops early
+        if len(images) >= max_images():
+            raise ValueError(f'At most {max_images()} receipts per batch.')
+        images.append(image)
+
+    for upload in uploads:
+        if not _is_zip(upload):
+            add(BatchImage(upload.name, _read_upload(upload)))
+            continue
+        if upload.size > MAX_ARCHIVE_BYTES:
+            add(BatchImage(upload.name, _failed('Zip file size exceeds 100MB limit.')))
+            continue
+        try:
+            # Large uploads are temporary files, read in place rather than loaded
+            archive = zipfile.ZipFile(upload.file)
+        except zipfile.BadZipFile as e:
+            add(BatchImage(upload.name, _failed(f'Invalid zip file: {e}')))
+            continue
+        for info in archive.infolist():
+            base_name = posixpath.basename(info.filename)
+            # Folders and macOS metadata (__MACOSX/, ._name, .DS_Store)
+            if info.is_dir() or info.filename.startswith('__MACOSX/') or base_name.startswith('.'):
+                continue
+            add(BatchImage(f'{upload.name}/{info.filename}', _read_member(archive, info)))
+    return images
+
+
+def run_batch(user, images, extract):
+    """
+    Reads a batch's receipts on a thread pool, at most concurrency() at a time.
+
+    Args:
+        user (User): The uploader, charged for Gemini calls
+        images (list): BatchImage per receipt
+        extract (callable): extract(user, image_bytes, budget) -> transaction list,
+                            calls budget() before calling Gemini
+
+    Yields:
+        tuple: (index, image, transactions or None, exception or None) as each
+               receipt is done, in completion order
+    """
+    def work(image):
+        try:
+            return extract(user, image.read(), lambda: take_budget(user))
+        finally:
+            # The pool's threads are not request threads, nothing else closes their connections
+            connections.close_all()
+
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, min(concurrency(), len(images))), thread_name_prefix='receipt-batch'
+    )
+    try:
+        futures = {executor.submit(work, image): index for index, image in enumerate(images)}
+        for future in as_completed(futures):
+            index = futures[future]
+            error = future.exception()
+            if error is not None:
+                logger.info('Batch receipt %s of user %s failed: %s', images[index].name, user.pk, error)
+                yield index, images[index], None, error
+            else:
+                yield index, images[index], future.result(), None
+    finally:
+        # Also reached when the client disconnects: queued receipts are dropped
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,190 @@
+import hashlib
+import logging
+import mimetypes
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import DatabaseError
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .image_to_transaction import RECEIPT_MODEL
+from .models import TransactionImage
+from .receipt_images import hamming_distance, same_picture
+
+
+logger = logging.getLogger(__name__)
+
+
+# Receipts already read by Gemini are kept per user as TransactionImage rows:
+# the preprocessed image, its SHA-256 and perceptual hash, and the extracted
+# transactions. A re-upload of the same file matches the SHA-256 and the stored
+# transactions are returned without calling Gemini.
+#
+# Near matches are off by default (RECEIPT_CACHE_PHASH_THRESHOLD = -1): receipts
+# of the same shop are often within a few bits of each other, so a perceptual
+# hash alone would hand one receipt's transactions to another. When enabled,
+# the stored receipts within the threshold are candidates only, served when
+# receipt_images.same_picture() confirms the pixels match (the same picture
+# re-encoded), and flagged as a NearMatch so the response can say so and the
+# client can ask for a fresh extraction (near=False).
+#
+# Each user keeps the RECEIPT_CACHE_MAX_ENTRIES most recently used receipts, and
+# the stored images of all users together stay under RECEIPT_CACHE_MAX_BYTES,
+# least recently used evicted first.
+
+
+def _max_entries():
+    return getattr(settings, 'RECEIPT_CACHE_MAX_ENTRIES', 100)
+
+
+def _max_bytes():
+    return getattr(settings, 'RECEIPT_CACHE_MAX_BYTES', 500 * 1024 * 1024)
+
+
+def _threshold():
+    return getattr(settings, 'RECEIPT_CACHE_PHASH_THRESHOLD', -1)
+
+
+# Candidates within the threshold compared pixel by pixel, nearest first
+NEAR_CANDIDATES = 3
+
+
+class NearMatch(list):
+    """The transactions of a stored receipt the upload is not byte-identical to, see get()"""
+
+
+def image_digest(image):
+    return hashlib.sha256(image.data).hexdigest()
+
+
+def get(user, image, near=True):
+    """
+    Looks up the transactions of an already read receipt.
+
+    Args:
+        user (User): Owner of the receipt
+        image (PreparedImage): The preprocessed upload
+        near (bool): Whether a confirmed near match may be served, see above
+
+    Returns:
+        list or None: The stored transactions on a hit, a NearMatch when the
+                      upload only matched pixel by pixel
+    """
+    if not _max_entries():
+        return None
+    entries = TransactionImage.objects.filter(user=user, model_name=RECEIPT_MODEL)
+    try:
+        entry = entries.filter(sha256=image_digest(image)).only('transactions').first()
+        matched_near = False
+        if entry is None and near and image.phash is not None and _threshold() >= 0:
+            entry = _near_match(entries, image)
+            matched_near = entry is not None
+        if entry is None:
+            return None
+        TransactionImage.objects.filter(pk=entry.pk).update(hits=F('hits') + 1, last_used_at=timezone.now())
+    except DatabaseError as e:
+        logger.warning('Could not look up cached receipts for user %s: %s', user.pk, e)
+        return None
+    if matched_near:
+        logger.info('Receipt of user %s served from near match %s', user.pk, entry.pk)
+        return NearMatch(entry.transactions)
+    return entry.transactions
+
+
+def _near_match(entries, image):
+    """The stored receipt within the hash threshold whose pixels match the upload, if any"""
+    # A user has at most _max_entries() receipts, compared here
+    candidates = sorted(
+        (distance, pk)
+        for distance, pk in (
+            (hamming_distance(phash, image.phash), pk)
+            for pk, phash in entries.exclude(phash=None).values_list('pk', 'phash')
+        )
+        if distance <= _threshold()
+    )
+    for _distance, pk in candidates[:NEAR_CANDIDATES]:
+        entry = entries.filter(pk=pk).only('transactions', 'image').first()
+        if entry is None or not entry.image:
+            continue
+        try:
+            with entry.image.open('rb') as stored_file:
+                stored = stored_file.read()
+        except OSError as e:
+            logger.warning('Cached receipt image %s is unreadable: %s', entry.image.name, e)
+            continue
+        if same_picture(stored, image.data):
+            return entry
+    return None
+
+
+def put(user, image, transactions):
+    """Stores a read receipt and evicts least recently used ones past the limits."""
+    if not transactions or not _max_entries():
+        return
+    digest = image_digest(image)
+    extension = mimetypes.guess_extension(image.mime_type) or ''
+    entry = TransactionImage(
+        user=user,
+        sha256=digest,
+        phash=image.phash,
+        model_name=RECEIPT_MODEL,
+        transactions=transactions,
+        size=len(image.data),
+    )
+    try:
+        entry.image.save(f'{digest[:32]}{extension}', ContentFile(image.data), save=False)
+        entry.save()
+    except DatabaseError as e:
+        # Caching is best effort, the transactions are still returned
+        logger.warning('Could not cache receipt for user %s: %s', user.pk, e)
+        entry.image.delete(save=False)
+        return
+    try:
+        evict(user)
+    except DatabaseError as e:
+        logger.warning('Could not evict cached receipts for user %s: %s', user.pk, e)
+
+
+def storing(user, image, transactions):
+    """Passes streamed transactions through and stores them once the stream is complete"""
+    collected = []
+    for transaction_data in transactions:
+        collected.append(transaction_data)
+        yield transaction_data
+    put(user, image, collected)
+
+
+async def astoring(user, image, transactions):
+    """Async counterpart of storing()"""
+    collected = []
+    async for transaction_data in transactions:
+        collected.append(transaction_data)
+        yield transaction_data
+    await sync_to_async(put)(user, image, collected)
+
+
+def delete(entries):
+    """Deletes receipt rows together with their stored images"""
+    entries = list(entries)
+    for entry in entries:
+        entry.image.delete(save=False)
+    TransactionImage.objects.filter(pk__in=[entry.pk for entry in entries]).delete()
+
+
+def evict(user):
+    stale = TransactionImage.objects.filter(user=user).order_by('-last_used_at')[_max_entries():]
+    delete(stale.only('pk', 'image'))
+
+    total = TransactionImage.objects.aggregate(total=Sum('size'))['total'] or 0
+    excess = total - _max_bytes()
+    if excess <= 0:
+        return
+    oldest = []
+    for entry in TransactionImage.objects.order_by('last_used_at').only('pk', 'image', 'size').iterator():
+        if excess <= 0:
+            break
+        oldest.append(entry)
+        excess -= entry.size
+    delete(oldest)
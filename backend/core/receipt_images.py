@@ -0,0 +1,227 @@
+import asyncio
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+logger = logging.getLogger(__name__)
+
+
+# Receipt images are shrunk before they are sent to Gemini: the real format is
+# sniffed (uploads are not always JPEGs), then the image is auto-oriented from
+# its EXIF tag, converted to grayscale, downsampled to at most
+# RECEIPT_IMAGE_MAX_PIXELS (plenty for reading printed text; a pixel budget
+# rather than a longest side, so long narrow receipts keep legible widths) and
+# re-encoded as a JPEG of RECEIPT_IMAGE_QUALITY. A phone photo of several MB
+# typically ends up around a tenth of that, which is less to upload (inline
+# image data travels base64 encoded) and fewer image tokens for the model.
+#
+# Decoding and resizing are CPU bound, so they run on a small shared thread
+# pool (Pillow releases the GIL meanwhile): async views await it without
+# blocking the event loop, and sync workers never run more than
+# RECEIPT_IMAGE_WORKERS conversions at once.
+#
+# Images Pillow cannot decode (HEIC without the pillow-heif plugin, truncated
+# files) are sent unchanged, labelled with their sniffed type.
+#
+# The same pass computes a perceptual hash of the picture, which lets
+# core.receipt_cache find the stored receipts an upload looks like.
+
+
+# Leading bytes -> MIME type, the formats Gemini accepts
+_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+# ISO base media "ftyp" brands of HEIF images
+_HEIF_BRANDS = {b'heic': 'image/heic', b'heix': 'image/heic', b'heim': 'image/heic', b'heis': 'image/heic',
+                b'mif1': 'image/heif', b'msf1': 'image/heif', b'heif': 'image/heif'}
+
+
+def sniff_mime_type(data):
+    """
+    The image type from its leading bytes, regardless of the file name.
+
+    Returns:
+        str or None: e.g. 'image/png', None if the format is not recognized
+    """
+    for signature, mime_type in _SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[4:8] == b'ftyp':
+        return _HEIF_BRANDS.get(data[8:12])
+    return None
+
+
+class PreparedImage(NamedTuple):
+    data: bytes
+    mime_type: str
+    # perceptual_hash() of the picture, None when it could not be decoded
+    phash: int = None
+
+
+def _dct_matrix(size):
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    return np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+
+
+_DCT = _dct_matrix(32)
+
+
+def perceptual_hash(image):
+    """
+    64-bit DCT hash (pHash) of a grayscale image: the signs of its lowest
+    frequencies against their median. Pictures of the same thing (rescaled,
+    re-encoded, slightly re-framed) differ in only a few bits.
+
+    Returns:
+        int: Signed, so it fits a BigIntegerField
+    """
+    pixels = np.asarray(image.resize((32, 32), Image.Resampling.BOX), dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:8, :8].flatten()
+    value = 0
+    for bit in low > np.median(low[1:]):
+        value = value << 1 | int(bit)
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def hamming_distance(a, b):
+    return ((a ^ b) & 0xFFFFFFFFFFFFFFFF).bit_count()
+
+
+# Receipts of one shop share their layout, so their perceptual hashes are often
+# only a few bits apart. same_picture() compares two images pixel by pixel at
+# COMPARE_WIDTH, allowing each pixel to move by one: the same picture
+# re-encoded stays within COMPARE_MAX_TILE_DIFFERENCE in every COMPARE_TILE
+# square, a single changed digit does not. Rescaled copies blur digits about as
+# much as an edit changes them, so they are not recognised.
+COMPARE_WIDTH = 768
+COMPARE_TILE = 4
+COMPARE_MAX_TILE_DIFFERENCE = 32
+COMPARE_MAX_ASPECT_DIFFERENCE = 0.02
+
+
+def _compare_pixels(data, size):
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image).convert('L')
+        aspect = image.height / image.width
+        if size is None:
+            size = (COMPARE_WIDTH, max(COMPARE_TILE, round(COMPARE_WIDTH * aspect)))
+        return aspect, np.asarray(image.resize(size, Image.Resampling.BOX), dtype=np.float32)
+
+
+def _shifted_difference(a, b):
+    """Per pixel of `a`, its smallest difference to the pixels of `b` at most a pixel away"""
+    padded = np.pad(b, 1, mode='edge')
+    height, width = a.shape
+    return np.min([
+        np.abs(a - padded[dy:dy + height, dx:dx + width]) for dy in range(3) for dx in range(3)
+    ], axis=0)
+
+
+def same_picture(a, b):
+    """
+    Whether two encoded images show the same picture, pixel by pixel: the
+    same receipt re-encoded does, another receipt with the same layout or a
+    rescaled copy does not.
+
+    Returns:
+        bool: False as well when either image cannot be decoded
+    """
+    try:
+        aspect_a, pixels_a = _compare_pixels(a, None)
+        aspect_b, pixels_b = _compare_pixels(b, pixels_a.shape[::-1])
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        return False
+    if abs(aspect_a - aspect_b) > COMPARE_MAX_ASPECT_DIFFERENCE * aspect_a:
+        return False
+    difference = np.maximum(_shifted_difference(pixels_a, pixels_b), _shifted_difference(pixels_b, pixels_a))
+    height = difference.shape[0] // COMPARE_TILE * COMPARE_TILE
+    tiles = difference[:height].reshape(height // COMPARE_TILE, COMPARE_TILE, -1, COMPARE_TILE).mean(axis=(1, 3))
+    return float(tiles.max()) <= COMPARE_MAX_TILE_DIFFERENCE
+
+
+def _enabled():
+    return getattr(settings, 'RECEIPT_IMAGE_PREPROCESS', True)
+
+
+def _target_size(size, max_pixels):
+    scale = min(1.0, (max_pixels / (size[0] * size[1])) ** 0.5)
+    return max(1, int(size[0] * scale)), max(1, int(size[1] * scale))
+
+
+def preprocess(data):
+    """
+    Shrinks a receipt image for OCR by the model.
+
+    Args:
+        data (bytes): The uploaded image
+
+    Returns:
+        PreparedImage: The bytes to send, the original ones when re-encoding
+                       is impossible or would not make them smaller
+
+    Raises:
+        ValueError: The data is not an image format Gemini accepts
+    """
+    mime_type = sniff_mime_type(data)
+    if mime_type is None:
+        raise ValueError('Unsupported image format, upload a JPEG, PNG, WebP, HEIC or GIF image.')
+    if not _enabled():
+        return PreparedImage(data, mime_type)
+
+    max_pixels = getattr(settings, 'RECEIPT_IMAGE_MAX_PIXELS', 2_000_000)
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # Lets the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding,
+            # as far as it stays at least the target size
+            image.draft('L', _target_size(image.size, max_pixels))
+            image = ImageOps.exif_transpose(image).convert('L')
+            image.thumbnail(_target_size(image.size, max_pixels), Image.Resampling.LANCZOS)
+            phash = perceptual_hash(image)
+            output = io.BytesIO()
+            image.save(output, 'JPEG', quality=getattr(settings, 'RECEIPT_IMAGE_QUALITY', 80), optimize=True)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        logger.info('Sending the %s receipt image unprocessed: %s', mime_type, e)
+        return PreparedImage(data, mime_type)
+
+    processed = output.getvalue()
+    if len(processed) >= len(data):
+        return PreparedImage(data, mime_type, phash)
+    logger.debug('Receipt image %s %d -> %d bytes', mime_type, len(data), len(processed))
+    return PreparedImage(processed, 'image/jpeg', phash)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = getattr(settings, 'RECEIPT_IMAGE_WORKERS', 0) or min(4, os.cpu_count() or 1)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='receipt-image')
+        return _executor
+
+
+def prepare(data):
+    """preprocess() on the shared pool, for sync callers"""
+    return _get_executor().submit(preprocess, data).result()
+
+
+async def aprepare(data):
+    """preprocess() on the shared pool, awaited without blocking the event loop"""
+    return await asyncio.wrap_future(_get_executor().submit(preprocess, data))
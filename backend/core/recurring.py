@@ -0,0 +1,303 @@
+import calendar
+import logging
+import re
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import NamedTuple
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Job, RecurringSeries, Transaction
+from .periods import month_range
+from . import jobs
+
+
+logger = logging.getLogger(__name__)
+
+
+# Recurring transaction detection. A user's history is grouped by normalized
+# description (case, digits and punctuation dropped, so "NETFLIX #4411" and
+# "Netflix 4412" match) and, within a description, into amount bands: sorted
+# amounts are split wherever one is more than RECURRING_AMOUNT_TOLERANCE above
+# the previous, so a varying utility bill stays one group while two different
+# subscriptions at the same merchant do not.
+#
+# Each group's dates are sorted and the intervals between them scored against
+# the weekly, monthly and yearly windows below with numpy, for all groups of a
+# user at once (bincount over the group ids). A group is a series when at least
+# RECURRING_MIN_REGULARITY of its intervals fall in one window and it has that
+# period's minimum number of occurrences.
+#
+# Writes schedule a "recurring" background job for the user (core.jobs, at most
+# one queued per user, collecting the months written meanwhile). The job only
+# re-detects the descriptions the changed months touch: those of the rows now in
+# them and of the stored series spanning them; their whole history is read, the
+# other series are left alone. Removing an irregular row of a description that
+# is not a series yet, and the `active` flags of series nothing was written to,
+# are only caught by the detect_recurring command, which re-detects every series
+# of all users on a process pool and is meant to run daily.
+
+
+class Period(NamedTuple):
+    name: str
+    # Accepted interval between occurrences, in days
+    min_days: int
+    max_days: int
+    min_occurrences: int
+    # Calendar step to the next occurrence
+    months: int = 0
+    days: int = 0
+
+
+PERIODS = [
+    Period(RecurringSeries.PERIOD_WEEKLY, 5, 9, 4, days=7),
+    Period(RecurringSeries.PERIOD_MONTHLY, 26, 35, 3, months=1),
+    Period(RecurringSeries.PERIOD_YEARLY, 350, 380, 2, months=12),
+]
+
+_SEPARATORS = re.compile(r'[\W\d_]+')
+# Occurrences whose amounts the expected amount is the median of
+RECENT_AMOUNTS = 3
+# Descriptions per `description IN (...)` query, below every backend's parameter limit
+DESCRIPTION_BATCH = 500
+
+
+def normalize(description):
+    return ' '.join(_SEPARATORS.sub(' ', description.casefold()).split())
+
+
+def add_months(day, months):
+    """`day` moved by whole months, clamped to the end of shorter months"""
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def next_occurrence(last_date, period):
+    if period.months:
+        return add_months(last_date, period.months)
+    return last_date + timedelta(days=period.days)
+
+
+def group_ids(keys, amounts, tolerance):
+    """
+    Group of every transaction: same normalized description and amount band.
+
+    Args:
+        keys (ndarray): Integer id of each transaction's normalized description
+        amounts (ndarray): Transaction amounts
+        tolerance (float): Relative step between sorted amounts that starts a new band
+
+    Returns:
+        ndarray: Group ids, 0..groups-1
+    """
+    order = np.lexsort((amounts, keys))
+    sorted_keys, sorted_amounts = keys[order], amounts[order]
+    starts = np.empty(len(order), dtype=bool)
+    starts[:1] = True
+    starts[1:] = (sorted_keys[1:] != sorted_keys[:-1]) | (sorted_amounts[1:] > sorted_amounts[:-1] * (1 + tolerance))
+    groups = np.empty(len(order), dtype=np.int64)
+    groups[order] = np.cumsum(starts) - 1
+    return groups
+
+
+def find_series(groups, days, min_regularity):
+    """
+    Scores the intervals of every group against PERIODS at once.
+
+    Args:
+        groups (ndarray): Group id per transaction, from group_ids()
+        days (ndarray): Day number per transaction
+        min_regularity (float): Share of intervals that must fit the period
+
+    Returns:
+        tuple: (order, starts, counts, periods): `order` sorts the transactions
+               by group and date with same-day duplicates dropped, `starts` and
+               `counts` locate each group in it, `periods` holds each group's
+               PERIODS index or -1 when it does not recur
+    """
+    order = np.lexsort((days, groups))
+    g, d = groups[order], days[order]
+    # One occurrence per group and day
+    unique = np.empty(len(order), dtype=bool)
+    unique[:1] = True
+    unique[1:] = (g[1:] != g[:-1]) | (d[1:] != d[:-1])
+    order, g, d = order[unique], g[unique], d[unique]
+
+    group_count = int(groups.max()) + 1 if len(groups) else 0
+    counts = np.bincount(g, minlength=group_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    same = g[1:] == g[:-1]
+    interval_groups = g[1:][same]
+    intervals = (d[1:] - d[:-1])[same]
+    interval_counts = np.maximum(np.bincount(interval_groups, minlength=group_count), 1)
+
+    regularity = np.zeros((len(PERIODS), group_count))
+    for i, period in enumerate(PERIODS):
+        fits = (intervals >= period.min_days) & (intervals <= period.max_days)
+        regularity[i] = np.bincount(interval_groups, weights=fits, minlength=group_count) / interval_counts
+        regularity[i, counts < period.min_occurrences] = 0
+    best = regularity.argmax(axis=0)
+    periods = np.where(regularity[best, np.arange(group_count)] >= min_regularity, best, -1)
+    return order, starts, counts, periods
+
+
+def detect(rows, today=None):
+    """
+    Finds the recurring series in one user's transactions.
+
+    Args:
+        rows (list): (date, description, amount, category) tuples
+        today (date, optional): For the `active` flag, defaults to today
+
+    Returns:
+        list: Unsaved RecurringSeries without a user
+    """
+    if not rows:
+        return []
+    today = today or date.today()
+    dates, descriptions, amounts, categories = zip(*rows)
+    normalized = [normalize(description) for description in descriptions]
+    key_ids = {}
+    keys = np.array([key_ids.setdefault(key, len(key_ids)) for key in normalized], dtype=np.int64)
+    amount_values = np.array([float(amount) for amount in amounts])
+    days = np.array(dates, dtype='datetime64[D]').astype(np.int64)
+
+    groups = group_ids(keys, amount_values, getattr(settings, 'RECURRING_AMOUNT_TOLERANCE', 0.2))
+    order, starts, counts, periods = find_series(
+        groups, days, getattr(settings, 'RECURRING_MIN_REGULARITY', 0.75)
+    )
+
+    series = []
+    for group in np.flatnonzero(periods >= 0):
+        period = PERIODS[periods[group]]
+        members = order[starts[group]:starts[group] + counts[group]]
+        if not normalized[members[-1]]:
+            # Descriptions without letters ("12345") are not one merchant
+            continue
+        last = members[-1]
+        last_date = dates[last]
+        next_date = next_occurrence(last_date, period)
+        member_days = days[members]
+        series.append(RecurringSeries(
+            key=normalized[last][:255],
+            description=descriptions[last],
+            category=categories[last],
+            period=period.name,
+            interval_days=round(float(np.median(np.diff(member_days))), 2),
+            amount=Decimal(str(round(float(np.median(amount_values[members[-RECENT_AMOUNTS:]])), 2))),
+            occurrences=len(members),
+            first_date=dates[members[0]],
+            last_date=last_date,
+            next_date=next_date,
+            # Overdue by more than the period's slack
+            active=today <= next_date + timedelta(days=period.max_days - period.min_days),
+        ))
+    return series
+
+
+def changed_keys(user_id, months):
+    """
+    Normalized descriptions whose series the changed months may affect.
+
+    Args:
+        user_id (int): Owner of the transactions
+        months (iterable): (year, month) tuples that were written to
+
+    Returns:
+        set: Keys of the rows in those months and of the stored series spanning them
+    """
+    in_months, spanning = Q(), Q()
+    for year, month in months:
+        start, end = month_range(year, month)
+        in_months |= Q(date__gte=start, date__lt=end)
+        spanning |= Q(first_date__lt=end, last_date__gte=start)
+    if not in_months:
+        return set()
+    descriptions = (
+        Transaction.objects.filter(in_months, user_id=user_id)
+        .order_by().values_list('description', flat=True).distinct()
+    )
+    keys = {normalize(description) for description in descriptions}
+    keys.update(RecurringSeries.objects.filter(spanning, user_id=user_id).values_list('key', flat=True))
+    return keys
+
+
+def _history(user_id, keys):
+    """(date, description, amount, category) of the user's rows whose description normalizes to one of `keys`"""
+    rows = Transaction.objects.filter(user_id=user_id).order_by()
+    if keys is None:
+        return list(rows.values_list('date', 'description', 'amount', 'category'))
+    descriptions = [
+        description for description in rows.values_list('description', flat=True).distinct()
+        if normalize(description) in keys
+    ]
+    history = []
+    for start in range(0, len(descriptions), DESCRIPTION_BATCH):
+        history += rows.filter(description__in=descriptions[start:start + DESCRIPTION_BATCH]).values_list(
+            'date', 'description', 'amount', 'category'
+        )
+    return history
+
+
+def detect_user(user_id, today=None, months=None):
+    """
+    Re-detects a user's recurring series and replaces the stored ones.
+
+    Args:
+        user_id (int): Whose series to detect
+        today (date, optional): For the `active` flag, defaults to today
+        months (iterable, optional): (year, month) tuples that changed, only the
+            series of the descriptions they touch are re-detected (see above)
+
+    Returns:
+        int: Number of series found, among the re-detected descriptions
+    """
+    keys = None
+    stored = RecurringSeries.objects.filter(user_id=user_id)
+    if months is not None:
+        keys = changed_keys(user_id, months)
+        if not keys:
+            return 0
+        stored = stored.filter(key__in=keys)
+    series = detect(_history(user_id, keys), today=today)
+    for item in series:
+        item.user_id = user_id
+    with transaction.atomic():
+        stored.delete()
+        RecurringSeries.objects.bulk_create(series)
+    return len(series)
+
+
+def schedule(months):
+    """
+    Queues a detection job of the changed months for each user. A job still
+    waiting gets the months added instead; a waiting job without months
+    re-detects everything anyway.
+
+    Args:
+        months (iterable): (user_id, year, month) tuples
+    """
+    by_user = {}
+    for user_id, year, month in months:
+        by_user.setdefault(user_id, set()).add(f'{year:04d}-{month:02d}')
+    if not by_user:
+        return
+    existing = set(User.objects.filter(pk__in=by_user).values_list('pk', flat=True))
+    waiting = Job.objects.filter(kind=Job.KIND_RECURRING, status=Job.STATUS_QUEUED, user_id__in=existing)
+    for job in waiting.order_by('id'):
+        if job.user_id not in existing:
+            continue
+        payload = job.payload
+        if 'months' in payload:
+            payload = {**payload, 'months': sorted(set(payload['months']) | by_user[job.user_id])}
+        # Only while no worker has claimed it, otherwise queue another job below
+        if Job.objects.filter(pk=job.pk, status=Job.STATUS_QUEUED).update(payload=payload):
+            existing.discard(job.user_id)
+    for user_id in existing:
+        jobs.submit(User(pk=user_id), Job.KIND_RECURRING, payload={'months': sorted(by_user[user_id])}, priority=-5)
@@ -0,0 +1,29 @@
+from decimal import Decimal
+
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+
+def _default(value):
+    # Matches DRF's encoder with COERCE_DECIMAL_TO_STRING = False
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON renderer backed by orjson, used for the flat transaction list.
+    Falls back to DRF's JSONRenderer when orjson is not installed.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
@@ -0,0 +1,196 @@
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum, Count, Q
+from django.db.models.functions import ExtractYear, ExtractMonth
+
+from .models import Transaction, MonthlyCategoryRollup
+
+
+# Query parameters the rollup table can answer. Anything in UNANSWERABLE_PARAMS
+# needs row-level data, so the list view falls back to aggregating raw rows.
+UNANSWERABLE_PARAMS = ('search', 'amount__gte', 'amount__lte')
+
+
+def _as_date(value):
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    return value
+
+
+def collect_deltas(rows, sign=1, deltas=None):
+    """
+    Groups transactions into rollup deltas.
+
+    Args:
+        rows (iterable): Transaction instances or dicts with user_id, date, category, amount, is_recurring
+        sign (int): 1 to add the rows to the rollups, -1 to remove them
+        deltas (dict, optional): Existing deltas to accumulate into
+
+    Returns:
+        dict: {(user_id, year, month, category): [amount, count, recurring_count]}
+    """
+    if deltas is None:
+        deltas = defaultdict(lambda: [Decimal('0'), 0, 0])
+    for row in rows:
+        if isinstance(row, dict):
+            user_id, day, category = row['user_id'], row['date'], row['category']
+            amount, is_recurring = row['amount'], row['is_recurring']
+        else:
+            user_id, day, category = row.user_id, row.date, row.category
+            amount, is_recurring = row.amount, row.is_recurring
+        day = _as_date(day)
+        delta = deltas[(user_id, day.year, day.month, category)]
+        delta[0] += sign * Decimal(str(amount))
+        delta[1] += sign
+        delta[2] += sign if is_recurring else 0
+    return deltas
+
+
+def apply_deltas(deltas):
+    """
+    Applies deltas from collect_deltas with atomic F() increments.
+
+    Returns:
+        set: (user_id, year, month) of every month the deltas touched
+    """
+    months = set()
+    for (user_id, year, month, category), (amount, count, recurring) in deltas.items():
+        months.add((user_id, year, month))
+        if not amount and not count and not recurring:
+            continue
+        key = dict(user_id=user_id, year=year, month=month, category=category)
+        increments = dict(
+            total_amount=F('total_amount') + amount,
+            transaction_count=F('transaction_count') + count,
+            recurring_count=F('recurring_count') + recurring,
+        )
+        with transaction.atomic():
+            if MonthlyCategoryRollup.objects.filter(**key).update(**increments):
+                continue
+            # Nothing to remove from a bucket that does not exist, e.g. while a
+            # user's rollups are being cascade-deleted together with the user
+            if count <= 0:
+                continue
+            try:
+                with transaction.atomic():
+                    MonthlyCategoryRollup.objects.create(
+                        total_amount=amount,
+                        transaction_count=count,
+                        recurring_count=recurring,
+                        **key
+                    )
+            except IntegrityError:
+                # Another request created the row first
+                MonthlyCategoryRollup.objects.filter(**key).update(**increments)
+    return months
+
+
+def add_transactions(rows):
+    return apply_deltas(collect_deltas(rows, sign=1))
+
+
+def remove_transactions(rows):
+    return apply_deltas(collect_deltas(rows, sign=-1))
+
+
+def rebuild(user=None):
+    """
+    Recomputes the rollup table from raw transactions.
+
+    Args:
+        user (User, optional): Only rebuild this user's rollups
+
+    Returns:
+        int: Number of rollup rows written
+    """
+    transactions_qs = Transaction.objects.all()
+    rollups_qs = MonthlyCategoryRollup.objects.all()
+    if user is not None:
+        transactions_qs = transactions_qs.filter(user=user)
+        rollups_qs = rollups_qs.filter(user=user)
+
+    rows = (
+        transactions_qs
+        .annotate(year=ExtractYear('date'), month=ExtractMonth('date'))
+        .values('user_id', 'year', 'month', 'category')
+        .annotate(
+            total_amount=Sum('amount'),
+            transaction_count=Count('id'),
+            recurring_count=Count('id', filter=Q(is_recurring=True)),
+        )
+        .order_by()
+    )
+    with transaction.atomic():
+        rollups_qs.delete()
+        created = MonthlyCategoryRollup.objects.bulk_create(
+            (MonthlyCategoryRollup(**row) for row in rows.iterator()),
+            batch_size=1000,
+        )
+    return len(created)
+
+
+def _month_bounds(query_params):
+    """
+    Returns ((year, month) start, (year, month) end) for the date filter, with None
+    for open ends, or False when the range does not cover whole months.
+    """
+    try:
+        after = query_params.get('date_after')
+        before = query_params.get('date_before')
+        after = date.fromisoformat(after) if after else None
+        before = date.fromisoformat(before) if before else None
+    except ValueError:
+        return False
+
+    if after and after.day != 1:
+        return False
+    if before and (before + timedelta(days=1)).day != 1:
+        return False
+    return (
+        (after.year, after.month) if after else None,
+        (before.year, before.month) if before else None,
+    )
+
+
+def totals_from_rollups(user, query_params):
+    """
+    Answers the transaction list totals from the rollup table.
+
+    Args:
+        user (User): Requesting user, staff users see totals across all users
+        query_params (QueryDict): The list request's query parameters
+
+    Returns:
+        dict or None: Same keys as the raw aggregate in TransactionViewSet.list,
+        or None if the active filters need row-level data
+    """
+    if any(query_params.get(param) for param in UNANSWERABLE_PARAMS):
+        return None
+    bounds = _month_bounds(query_params)
+    if bounds is False:
+        return None
+
+    rollups = MonthlyCategoryRollup.objects.all()
+    if not user.is_staff:
+        rollups = rollups.filter(user=user)
+    category = query_params.get('category')
+    if category:
+        rollups = rollups.filter(category=category)
+
+    start, end = bounds
+    if start:
+        rollups = rollups.filter(Q(year__gt=start[0]) | Q(year=start[0], month__gte=start[1]))
+    if end:
+        rollups = rollups.filter(Q(year__lt=end[0]) | Q(year=end[0], month__lte=end[1]))
+
+    totals = rollups.aggregate(
+        total_income=Sum('total_amount', filter=Q(category='income')),
+        total_expenses=Sum('total_amount', filter=~Q(category='income')),
+        total_amount=Sum('total_amount'),
+        transaction_count=Sum('transaction_count'),
+    )
+    totals['transaction_count'] = totals['transaction_count'] or 0
+    return totals
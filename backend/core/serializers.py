@@ -1,5 +1,8 @@
 from rest_framework import serializers
-from .models import Transaction, TransactionImage
+from .models import Transaction, TransactionImage, Job, RecurringSeries, Anomaly
+from .periods import month_range
+from . import rollups
+from .signals import transactions_changed
 
 from djoser.serializers import UserCreateSerializer,PasswordSerializer
 
@@ -51,6 +54,9 @@ class TransactionSerializer(serializers.ModelSerializer):
         model = Transaction
         fields = ['id', 'user', 'date', 'description', 'amount', 'category', 'is_recurring']
 
+# Columns read with .values() by the flat transaction list (?mode=flat)
+FLAT_LIST_FIELDS = ('id', 'user', 'date', 'description', 'amount', 'category', 'is_recurring')
+
 class TransactionViewSerializer(serializers.ModelSerializer):
     user = UserViewSerializer(read_only=True)
     class Meta:
@@ -58,11 +64,18 @@ class TransactionViewSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'date', 'description', 'amount', 'category', 'is_recurring']
     
 
+class TransactionListCreateSerializer(serializers.ListSerializer):
+    def create(self, validated_data):
+        # Hand the whole list to the child so it is inserted with one bulk_create
+        return self.child.create(validated_data)
+
+
 class TransactionCreateSerializer(serializers.ModelSerializer):
     date = serializers.DateField()
     class Meta:
         model = Transaction
         fields = ['date', 'description', 'amount', 'category', 'is_recurring']
+        list_serializer_class = TransactionListCreateSerializer
     
     def validate_amount(self, value):
         if value <= 0:
@@ -75,7 +88,11 @@ class TransactionCreateSerializer(serializers.ModelSerializer):
         if isinstance(validated_data, list):
             for item in validated_data:
                 item['user'] = user
-            return Transaction.objects.bulk_create([Transaction(**item) for item in validated_data])
+            transactions = Transaction.objects.bulk_create([Transaction(**item) for item in validated_data])
+            # bulk_create skips model signals, so update the rollups here
+            months = rollups.add_transactions(transactions)
+            transactions_changed.send(sender=Transaction, months=months, created=transactions)
+            return transactions
         else:
             validated_data['user'] = user
             return super().create(validated_data)
@@ -91,9 +108,87 @@ class TransactionUpdateSerializer(serializers.ModelSerializer):
         if value is not None and value <= 0:
             raise serializers.ValidationError("Amount must be greater than zero.")
         return value
+
+    def update(self, instance, validated_data):
+        if 'category' in validated_data:
+            # Set by the user now, the categorizer may learn it
+            validated_data['category_guessed'] = False
+        return super().update(instance, validated_data)
     
 
 class TransactionImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = TransactionImage
-        fields = ['id', 'image']
\ No newline at end of file
+        fields = ['id', 'image', 'transactions', 'hits', 'created_at', 'last_used_at']
+        read_only_fields = ['transactions', 'hits', 'created_at', 'last_used_at']
+
+
+class JobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'status', 'priority', 'payload', 'result', 'error', 'download_url',
+            'attempts', 'max_attempts', 'created_at', 'started_at', 'finished_at',
+        ]
+        read_only_fields = fields
+
+    def get_download_url(self, obj):
+        if obj.status != Job.STATUS_SUCCEEDED or not obj.result_file:
+            return None
+        request = self.context.get('request')
+        path = f'/api/jobs/{obj.pk}/download/'
+        return request.build_absolute_uri(path) if request else path
+
+
+class JobCreateSerializer(serializers.Serializer):
+    kind = serializers.ChoiceField(choices=Job.KIND_CHOICES)
+    priority = serializers.IntegerField(default=0, min_value=-10, max_value=10)
+    year = serializers.IntegerField(required=False)
+    month = serializers.IntegerField(required=False)
+    image = serializers.FileField(required=False)
+
+    def validate(self, attrs):
+        if attrs['kind'] == Job.KIND_RECEIPT:
+            image = attrs.get('image')
+            if not image:
+                raise serializers.ValidationError({'image': 'No image file provided.'})
+            # Check file size limit (5MB)
+            if image.size > 5 * 1024 * 1024:
+                raise serializers.ValidationError({'image': 'Image file size exceeds 5MB limit.'})
+            return attrs
+
+        if attrs['kind'] in (Job.KIND_RECURRING, Job.KIND_CATEGORIZER):
+            return attrs
+
+        if 'year' not in attrs or 'month' not in attrs:
+            raise serializers.ValidationError('year and month are required.')
+        try:
+            month_range(attrs['year'], attrs['month'])
+        except ValueError:
+            raise serializers.ValidationError('Invalid month or year parameter')
+        return attrs
+
+
+class RecurringSeriesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RecurringSeries
+        fields = [
+            'id', 'description', 'category', 'period', 'interval_days', 'amount', 'occurrences',
+            'first_date', 'last_date', 'next_date', 'active', 'detected_at',
+        ]
+        read_only_fields = fields
+
+
+class AnomalySerializer(serializers.ModelSerializer):
+    description = serializers.CharField(source='transaction.description', default=None, read_only=True)
+    date = serializers.DateField(source='transaction.date', default=None, read_only=True)
+
+    class Meta:
+        model = Anomaly
+        fields = [
+            'id', 'kind', 'transaction', 'description', 'date', 'category', 'year', 'month',
+            'amount', 'expected', 'score', 'detected_at',
+        ]
+        read_only_fields = fields
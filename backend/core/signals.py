@@ -0,0 +1,102 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver, Signal
+
+from .models import MonthlyStatement, Transaction
+from . import rollups
+from . import analysis_cache
+from . import forecast
+from . import statements
+from . import recurring
+from . import categorizer
+from . import anomalies
+
+
+# Sent after transactions were written, including bulk inserts that skip the
+# model signals. `months` is a set of (user_id, year, month) tuples; bulk inserts
+# that have the new rows at hand pass them as `created`.
+transactions_changed = Signal()
+
+
+ROLLUP_FIELDS = ('user_id', 'date', 'category', 'amount', 'is_recurring')
+
+
+@receiver(pre_save, sender=Transaction)
+def remember_previous_state(sender, instance, raw=False, **kwargs):
+    """Keep the stored row so post_save can move it out of its old rollup bucket"""
+    instance._rollup_previous = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    instance._rollup_previous = (
+        Transaction.objects.filter(pk=instance.pk).values(*ROLLUP_FIELDS).first()
+    )
+
+
+@receiver(post_save, sender=Transaction)
+def update_rollups_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_rollup_previous', None)
+    deltas = rollups.collect_deltas([previous], sign=-1) if previous else None
+    deltas = rollups.collect_deltas([instance], sign=1, deltas=deltas)
+    months = rollups.apply_deltas(deltas)
+    transactions_changed.send(sender=Transaction, months=months)
+
+
+@receiver(post_save, sender=Transaction)
+def score_anomaly_on_save(sender, instance, created, raw=False, **kwargs):
+    # Registered after update_rollups_on_save, so the month total is current
+    if raw or not getattr(settings, 'ANOMALY_SCORE_ON_WRITE', True):
+        return
+    anomalies.score_transaction(instance, created)
+
+
+@receiver(transactions_changed)
+def score_anomalies_on_bulk_insert(sender, months, created=None, **kwargs):
+    # Single saves are scored by score_anomaly_on_save
+    if created and getattr(settings, 'ANOMALY_SCORE_ON_WRITE', True):
+        anomalies.score_transactions(created)
+
+
+@receiver(post_delete, sender=Transaction)
+def update_rollups_on_delete(sender, instance, **kwargs):
+    months = rollups.remove_transactions([instance])
+    transactions_changed.send(sender=Transaction, months=months)
+
+
+@receiver(transactions_changed)
+def invalidate_analysis_cache(sender, months, **kwargs):
+    analysis_cache.invalidate(months)
+
+
+@receiver(transactions_changed)
+def invalidate_forecast_curves(sender, months, **kwargs):
+    forecast.invalidate(months)
+
+
+@receiver(transactions_changed)
+def invalidate_statements(sender, months, **kwargs):
+    statements.invalidate(months)
+
+
+@receiver(post_delete, sender=MonthlyStatement)
+def delete_statement_file(sender, instance, **kwargs):
+    # Also for statements deleted together with their user
+    statements.delete_file(instance)
+
+
+@receiver(transactions_changed)
+def schedule_recurring_detection(sender, months, **kwargs):
+    if getattr(settings, 'RECURRING_DETECT_ON_WRITE', True):
+        months = set(months)
+        # After the commit: the rows are visible to the worker, and a user
+        # deleted together with their transactions gets no job
+        transaction.on_commit(lambda: recurring.schedule(months))
+
+
+@receiver(transactions_changed)
+def schedule_categorizer_training(sender, months, **kwargs):
+    if getattr(settings, 'CATEGORIZER_TRAIN_ON_WRITE', True):
+        user_ids = {user_id for user_id, _year, _month in months}
+        transaction.on_commit(lambda: categorizer.schedule(user_ids))
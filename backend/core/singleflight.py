@@ -0,0 +1,225 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from filelock import FileLock, Timeout
+
+
+logger = logging.getLogger(__name__)
+
+
+# Coalesces concurrent identical LLM calls (two dashboard tabs, frontend
+# retries). Within a process the first caller for a key runs the call and
+# everyone else waits for its result. Across worker processes the caller also
+# holds a file lock lease for the key while the call runs and leaves a shareable
+# result next to it; a process that waited for the lease reads that result
+# instead of calling Gemini again.
+#
+# Keys must identify the exact request, e.g. the analysis cache key or a hash
+# of the receipt bytes, and results must be JSON serializable.
+
+_MISSING = object()
+SWEEP_INTERVAL = 3600
+
+_lock = threading.Lock()
+_flights = {}
+_async_flights = weakref.WeakKeyDictionary()
+_last_sweep = 0.0
+
+
+def _directory():
+    path = getattr(settings, 'SINGLEFLIGHT_DIR', '') or os.path.join(
+        tempfile.gettempdir(), 'autofinance-singleflight'
+    )
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _lease_timeout():
+    return getattr(settings, 'SINGLEFLIGHT_LEASE_TIMEOUT', 120)
+
+
+def _paths(key):
+    base = os.path.join(_directory(), key)
+    return base + '.lock', base + '.json'
+
+
+def _read_result(path, since):
+    """The result another process stored after `since`, or _MISSING"""
+    try:
+        if os.stat(path).st_mtime < since:
+            return _MISSING
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return _MISSING
+
+
+def _write_result(path, result):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        os.replace(temp_path, path)
+    except (OSError, TypeError, ValueError):
+        logger.warning('Could not store single-flight result %s', path, exc_info=True)
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+    _sweep()
+
+
+def _sweep():
+    """
+    Removes results and idle lock files older than the lease timeout, at most
+    once per SWEEP_INTERVAL per process. A lock file is only unlinked while
+    holding it; a process racing the unlink at worst makes one duplicate call.
+    """
+    global _last_sweep
+    now = time.time()
+    with _lock:
+        if now - _last_sweep < SWEEP_INTERVAL:
+            return
+        _last_sweep = now
+
+    max_age = max(_lease_timeout(), 60)
+    for entry in os.scandir(_directory()):
+        try:
+            if now - entry.stat().st_mtime < max_age:
+                continue
+            if entry.name.endswith('.lock'):
+                lock = FileLock(entry.path)
+                lock.acquire(timeout=0)
+                try:
+                    os.unlink(entry.path)
+                finally:
+                    lock.release()
+            else:
+                os.unlink(entry.path)
+        except (OSError, Timeout):
+            continue
+
+
+def _run_with_lease(key, fn, shareable):
+    started = time.time()
+    lock_path, result_path = _paths(key)
+    lock = FileLock(lock_path)
+    try:
+        lock.acquire(timeout=_lease_timeout())
+    except Timeout:
+        # The lease holder is stuck, call upstream ourselves rather than wait longer
+        return fn()
+    try:
+        shared = _read_result(result_path, started)
+        if shared is not _MISSING:
+            return shared
+        result = fn()
+        if shareable(result):
+            _write_result(result_path, result)
+        return result
+    finally:
+        lock.release()
+
+
+async def _arun_with_lease(key, coro_fn, shareable):
+    started = time.time()
+    lock_path, result_path = _paths(key)
+    lock = FileLock(lock_path)
+    deadline = time.monotonic() + _lease_timeout()
+    # Poll instead of blocking a thread, so a cancelled request never leaves
+    # behind a thread that acquires the lease later
+    acquired = False
+    while not acquired:
+        try:
+            lock.acquire(timeout=0)
+            acquired = True
+        except Timeout:
+            if time.monotonic() >= deadline:
+                return await coro_fn()
+            await asyncio.sleep(0.05)
+    try:
+        shared = _read_result(result_path, started)
+        if shared is not _MISSING:
+            return shared
+        result = await coro_fn()
+        if shareable(result):
+            _write_result(result_path, result)
+        return result
+    finally:
+        lock.release()
+
+
+def do(key, fn, shareable=lambda result: True):
+    """
+    Runs fn() once for all concurrent callers with the same key.
+
+    Args:
+        key (str): Identifies the request, used as a file name
+        fn (callable): Makes the upstream call
+        shareable (callable, optional): Whether a result may be handed to other processes
+
+    Returns:
+        The result of fn(), possibly computed by another thread or process.
+        Exceptions raised by fn() reach every waiting thread.
+    """
+    with _lock:
+        future = _flights.get(key)
+        leader = future is None
+        if leader:
+            future = _flights[key] = concurrent.futures.Future()
+    if not leader:
+        return future.result()
+
+    try:
+        result = _run_with_lease(key, fn, shareable)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _lock:
+            _flights.pop(key, None)
+
+
+class _AsyncFlight:
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+async def ado(key, coro_fn, shareable=lambda result: True):
+    """
+    Async counterpart of do() for coroutines on the running event loop.
+
+    The call runs in its own task, so one waiter disconnecting does not cancel
+    it for the others; it is cancelled when the last waiter goes away.
+    """
+    loop = asyncio.get_running_loop()
+    flights = _async_flights.setdefault(loop, {})
+    flight = flights.get(key)
+    if flight is None:
+        flight = flights[key] = _AsyncFlight(loop.create_task(_arun_with_lease(key, coro_fn, shareable)))
+        flight.task.add_done_callback(
+            lambda task: flights.pop(key) if flights.get(key) is flight else None
+        )
+
+    flight.waiters += 1
+    try:
+        return await asyncio.shield(flight.task)
+    except asyncio.CancelledError:
+        if flight.waiters == 1 and not flight.task.done():
+            flight.task.cancel()
+        raise
+    finally:
+        flight.waiters -= 1
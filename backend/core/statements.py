@@ -0,0 +1,167 @@
+import itertools
+import logging
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F, Q
+
+from .models import DataVersion, MonthlyStatement
+from .periods import month_range, period_filter
+from .pdf_stream import statement_pdf
+
+
+logger = logging.getLogger(__name__)
+
+
+# Rendered PDF statements are kept in MonthlyStatement, the file in the default
+# storage (MEDIA_ROOT unless configured otherwise), one per user and month.
+# Downloads and PDF jobs serve the stored file; only a missing statement is
+# rendered. The prerender_statements command renders the previous month of all
+# users at month close, so most downloads never render at all.
+#
+# Any write inside a month drops that month's statement (see core.signals) and
+# bumps the user's DataVersion. A statement is stored with the version read
+# before its transactions were, and is dropped again if the version moved while
+# it was rendered, so a write racing a render never leaves a stale PDF behind.
+
+# Bumped when the PDF layout changes, statements of another version are rendered again
+RENDERER_VERSION = 2
+
+
+def statement_rows(user, start, end):
+    """
+    The (date, description, amount, category) rows of a statement over [start, end),
+    streamed from the database.
+
+    Returns:
+        iterator or None: The rows in date order, None when there are none
+    """
+    rows = user.transactions.filter(**period_filter(start, end)).order_by('date', 'id').values_list(
+        'date', 'description', 'amount', 'category'
+    ).iterator(chunk_size=2000)
+    first = next(rows, None)
+    if first is None:
+        return None
+    return itertools.chain([first], rows)
+
+
+def render(user, year, month):
+    """
+    Renders a user's month as a PDF statement (core.pdf_stream).
+
+    Returns:
+        bytes or None: The PDF, None when the month has no transactions
+    """
+    rows = statement_rows(user, *month_range(year, month))
+    if rows is None:
+        return None
+    return statement_pdf(rows)
+
+
+def current_version(user):
+    return DataVersion.objects.get_or_create(user=user)[0].version
+
+
+def _stored(user, year, month):
+    entry = MonthlyStatement.objects.filter(
+        user=user, year=year, month=month, renderer_version=RENDERER_VERSION
+    ).first()
+    if entry is None:
+        return None
+    try:
+        with entry.file.open('rb') as statement_file:
+            return statement_file.read()
+    except OSError as e:
+        # Removed from the storage behind our back
+        logger.warning('Stored statement %s is unreadable: %s', entry.file.name, e)
+        MonthlyStatement.objects.filter(pk=entry.pk).delete()
+        return None
+
+
+def store(user, year, month, version, pdf_data):
+    """Stores a rendered statement unless the user's data changed since `version` was read."""
+    entry = MonthlyStatement(
+        user=user, year=year, month=month, data_version=version,
+        renderer_version=RENDERER_VERSION, size=len(pdf_data),
+    )
+    try:
+        MonthlyStatement.objects.filter(user=user, year=year, month=month).exclude(
+            renderer_version=RENDERER_VERSION
+        ).delete()
+        entry.file.save(f'{user.pk}_{year}_{month:02d}.pdf', ContentFile(pdf_data), save=False)
+        entry.save()
+    except IntegrityError:
+        # Stored by a concurrent render
+        entry.file.delete(save=False)
+        return
+    except DatabaseError as e:
+        # Storing is best effort, the statement is still returned
+        logger.warning('Could not store the %s-%02d statement of user %s: %s', year, month, user.pk, e)
+        entry.file.delete(save=False)
+        return
+    if not DataVersion.objects.filter(user=user, version=version).exists():
+        entry.delete()
+
+
+def statement(user, year, month):
+    """
+    The PDF statement of a user's month, stored or rendered and stored.
+
+    Returns:
+        bytes or None: The PDF, None when the month has no transactions
+    """
+    pdf_data = _stored(user, year, month)
+    if pdf_data is not None:
+        return pdf_data
+    version = current_version(user)
+    pdf_data = render(user, year, month)
+    if pdf_data is not None:
+        store(user, year, month, version, pdf_data)
+    return pdf_data
+
+
+def prerender(user, year, month, force=False):
+    """
+    Renders and stores a statement unless it is stored already (or `force`).
+
+    Returns:
+        bool: Whether a statement was rendered
+    """
+    if not force and MonthlyStatement.objects.filter(
+        user=user, year=year, month=month, renderer_version=RENDERER_VERSION
+    ).exists():
+        return False
+    version = current_version(user)
+    pdf_data = render(user, year, month)
+    if pdf_data is None:
+        return False
+    MonthlyStatement.objects.filter(user=user, year=year, month=month).delete()
+    store(user, year, month, version, pdf_data)
+    return True
+
+
+def delete_file(entry):
+    """Removes a deleted statement's file once the deletion is committed"""
+    name = entry.file.name
+    if name:
+        transaction.on_commit(lambda: default_storage.delete(name))
+
+
+def invalidate(months):
+    """
+    Drops the statements of changed months and bumps their users' versions.
+
+    Args:
+        months (iterable): (user_id, year, month) tuples
+    """
+    condition = Q()
+    user_ids = set()
+    for user_id, year, month in months:
+        condition |= Q(user_id=user_id, year=year, month=month)
+        user_ids.add(user_id)
+    if not user_ids:
+        return
+    # Only existing counters: one is created before any render reads the data
+    DataVersion.objects.filter(user_id__in=user_ids).update(version=F('version') + 1)
+    MonthlyStatement.objects.filter(condition).delete()
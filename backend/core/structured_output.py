@@ -0,0 +1,145 @@
+import datetime
+import enum
+import logging
+
+from django.core.cache import cache
+from google import genai
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from . import llm_client
+from .constants import catagory_choices
+
+
+logger = logging.getLogger(__name__)
+
+
+# Response schemas of the Gemini calls. They are sent with the request
+# (structured output), so the model can only answer JSON of that shape, and the
+# same schemas validate the answer in a single pydantic-core pass instead of
+# fence stripping, json.loads and ad-hoc checks.
+#
+# Every parse is counted per task in the Django cache, so the share of calls
+# wasted on unusable answers is measurable (the llm/parse-stats/ endpoint). The
+# counts are shared between processes when CACHES is a shared backend.
+
+
+Category = enum.Enum('Category', [(key.upper(), key) for key, _ in catagory_choices], type=str)
+
+
+class ReceiptTransaction(BaseModel):
+    date: datetime.date
+    description: str
+    amount: float
+    category: Category
+
+
+class Analysis(BaseModel):
+    overview: str
+    quick_tips: list[str]
+    warnings: list[str]
+    good_habits: list[str]
+
+
+SCHEMAS = {
+    llm_client.TASK_ANALYSIS: Analysis,
+    llm_client.TASK_RECEIPT: list[ReceiptTransaction],
+}
+
+_adapters = {task: TypeAdapter(schema) for task, schema in SCHEMAS.items()}
+_receipt_line = TypeAdapter(ReceiptTransaction)
+
+
+class ParseError(ValueError):
+    """The model answer does not match the task's schema"""
+
+
+def response_config(task):
+    """Generation config asking Gemini for JSON matching the task's schema"""
+    return genai.types.GenerateContentConfig(
+        response_mime_type='application/json',
+        response_schema=SCHEMAS[task],
+    )
+
+
+def _validate(adapter, text):
+    try:
+        value = adapter.validate_json(text or '')
+    except ValidationError as e:
+        raise ParseError(f'Answer does not match the schema: {e.errors(include_url=False)[0]["msg"]}') from e
+    # Plain JSON types: ISO date strings, category keys
+    return adapter.dump_python(value, mode='json')
+
+
+def parse(task, text):
+    """
+    Validates a complete model answer and records the outcome.
+
+    Args:
+        task (str): llm_client.TASK_ANALYSIS or TASK_RECEIPT
+        text (str): The model output
+
+    Returns:
+        dict or list: The answer as plain JSON types
+
+    Raises:
+        ParseError: The answer is not valid JSON of the task's schema
+    """
+    try:
+        value = _validate(_adapters[task], text)
+    except ParseError as e:
+        record(task, e)
+        raise
+    record(task)
+    return value
+
+
+def parse_receipt_line(text):
+    """Validates one element of a streamed receipt answer, the caller records the outcome"""
+    return _validate(_receipt_line, text)
+
+
+def _stat_key(task, name):
+    return f'llm-parse:{task}:{name}'
+
+
+def _incr(key):
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
+
+
+def record(task, error=None):
+    """Counts one parsed (error=None) or unusable answer of `task`"""
+    if error is None:
+        _incr(_stat_key(task, 'parsed'))
+        return
+    logger.warning('Unusable %s answer from Gemini: %s', task, error)
+    _incr(_stat_key(task, 'failed'))
+    cache.set(_stat_key(task, 'last_error'), str(error)[:500], timeout=None)
+
+
+def parse_stats():
+    """
+    Returns:
+        dict: Per task the parsed and failed answer counts, the failure rate
+              and the last failure
+    """
+    stats = {}
+    for task in SCHEMAS:
+        parsed = cache.get(_stat_key(task, 'parsed'), 0)
+        failed = cache.get(_stat_key(task, 'failed'), 0)
+        total = parsed + failed
+        stats[task] = {
+            'parsed': parsed,
+            'failed': failed,
+            'failure_rate': round(failed / total, 4) if total else 0.0,
+            'last_error': cache.get(_stat_key(task, 'last_error')),
+        }
+    return stats
+
+
+def reset_stats():
+    cache.delete_many([_stat_key(task, name) for task in SCHEMAS for name in ('parsed', 'failed', 'last_error')])
@@ -1,3 +1,1160 @@
-from django.test import TestCase
+import base64
+import csv
+import functools
+import gzip
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import urlencode
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction as db_transaction
+from django.db.models import Sum
+from django.http import QueryDict
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from filelock import FileLock
+from PIL import Image, ImageDraw
+from rest_framework.test import APIClient
+
+from . import (
+    anomalies, categorizer, jobs, receipt_batch, receipt_cache, receipt_images, recurring, rollups, singleflight,
+)
+from .exporters import EXPORT_FIELDS
+from .filters import TransactionFilters
+from .importers import PARSERS, StatementImportError, import_transactions, parse_ofx
+from .json_stream import JSONArrayStream
+from .management.commands.explain_hot_queries import hot_queries, is_full_scan, prefer_indexes, uses_index
+from .models import Anomaly, Job, MonthlyCategoryRollup, RecurringSeries, Transaction, TransactionImage
+from .pdf_stream import ROWS_PER_PAGE, TABLE_HEADER, Summary, statement_chunks, statement_pdf
+from .receipt_batch import (
+    MAX_IMAGE_BYTES, ZIP_SIGNATURE, RateBudgetExceeded, collect_images, run_batch, take_budget,
+)
+
+
+class HotQueryPlanTests(TestCase):
+    """The list, analysis and PDF queries must be answered from an index, not a full table scan"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+        other = User.objects.create_user('bob', 'bob@example.com', 'password')
+        Transaction.objects.bulk_create([
+            Transaction(
+                user=cls.user if i % 2 else other,
+                date=date(2025, 1, 1) + timedelta(days=i % 120),
+                description=f'Transaction {i}',
+                amount=Decimal(10 + i % 50),
+                category=('food', 'transport', 'utilities')[i % 3],
+            )
+            for i in range(300)
+        ])
+
+    # The composite indexes of migration 0004 each query should be read through;
+    # the user_id foreign key index alone would also avoid a full scan
+    EXPECTED_INDEXES = {
+        'list page': 'txn_user_date_id_idx',
+        'analysis current month': 'txn_user_date_id_idx',
+        'analysis previous month': 'txn_user_date_id_idx',
+        'pdf month': 'txn_user_date_id_idx',
+        'category in month': 'txn_user_category_date_idx',
+    }
+
+    def test_hot_queries_use_the_composite_indexes(self):
+        with prefer_indexes():
+            queries = hot_queries(self.user, 2025, 3)
+            self.assertEqual(set(queries), set(self.EXPECTED_INDEXES))
+            for name, queryset in queries.items():
+                with self.subTest(query=name):
+                    plan = queryset.explain()
+                    self.assertFalse(is_full_scan(plan), f'{name} scans the whole table:\n{plan}')
+                    self.assertTrue(
+                        uses_index(plan, self.EXPECTED_INDEXES[name]),
+                        f'{name} does not use {self.EXPECTED_INDEXES[name]}:\n{plan}',
+                    )
+
+    def test_full_scan_is_detected(self):
+        # Guards the check itself: no index covers the description
+        with prefer_indexes():
+            plan = Transaction.objects.filter(description='Transaction 1').explain()
+        self.assertTrue(is_full_scan(plan), plan)
+
+
+class KeysetPaginationTests(TestCase):
+    """?pagination=cursor walks must return the ORM order exactly once, in both directions"""
+
+    PAGE_SIZE = 7
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+        other = User.objects.create_user('bob', 'bob@example.com', 'password')
+        # Few distinct dates and amounts, so most seeks fall back to the id tie-breaker
+        Transaction.objects.bulk_create([
+            Transaction(
+                user=cls.user,
+                date=date(2025, 1, 1) + timedelta(days=i % 9),
+                description=f'Transaction {i}',
+                amount=Decimal(5 * (i % 6)) + Decimal('0.25'),
+                category=('food', 'income')[i % 2],
+            )
+            for i in range(50)
+        ] + [
+            Transaction(user=other, date=date(2025, 1, 3), description='Other', amount=Decimal('1'), category='food')
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def expected_ids(self, ordering):
+        field = ordering.lstrip('-')
+        prefix = '-' if ordering.startswith('-') else ''
+        return list(
+            Transaction.objects.filter(user=self.user).order_by(f'{prefix}{field}', f'{prefix}id')
+            .values_list('id', flat=True)
+        )
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def first_page(self, ordering, **params):
+        return self.get(
+            '/api/transactions/', pagination='cursor', ordering=ordering, page_size=self.PAGE_SIZE, **params
+        )
+
+    def walk_forward(self, ordering):
+        pages = [self.first_page(ordering)]
+        while pages[-1]['next']:
+            pages.append(self.get(pages[-1]['next']))
+        return pages
+
+    def test_forward_walk_matches_orm_order(self):
+        for ordering in ('-date', 'date', 'amount', '-amount'):
+            with self.subTest(ordering=ordering):
+                pages = self.walk_forward(ordering)
+                ids = [row['id'] for page in pages for row in page['results']]
+                self.assertEqual(ids, self.expected_ids(ordering))
+                self.assertTrue(all(len(page['results']) == self.PAGE_SIZE for page in pages[:-1]))
+                self.assertIsNone(pages[0]['previous'])
+
+    def test_backward_walk_matches_orm_order(self):
+        for ordering in ('-date', 'date', 'amount', '-amount'):
+            with self.subTest(ordering=ordering):
+                page = self.walk_forward(ordering)[-1]
+                pages = [page]
+                while page['previous']:
+                    page = self.get(page['previous'])
+                    pages.insert(0, page)
+                ids = [row['id'] for page in pages for row in page['results']]
+                self.assertEqual(ids, self.expected_ids(ordering))
+                # The walk ends on the first page, whose previous link is gone
+                self.assertEqual(pages[0]['results'], self.first_page(ordering)['results'])
+
+    def test_flat_mode_walk_matches_orm_order(self):
+        page = self.first_page('-date', mode='flat')
+        ids = [row['id'] for row in page['results']]
+        while page['next']:
+            page = self.get(page['next'])
+            ids.extend(row['id'] for row in page['results'])
+        self.assertEqual(ids, self.expected_ids('-date'))
+
+    def cursor(self, payload):
+        raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    def test_tampered_cursor_is_rejected(self):
+        tampered = {
+            'not base64': '***',
+            'not json': base64.urlsafe_b64encode(b'{"f": "date"').decode('ascii'),
+            'not an object': self.cursor([1, 2]),
+            'other ordering': self.cursor({'f': 'amount', 'v': '5.25', 'id': 1}),
+            'bad date': self.cursor({'f': 'date', 'v': 'yesterday', 'id': 1}),
+            'non-string value': self.cursor({'f': 'date', 'v': 20250101, 'id': 1}),
+            'bad id': self.cursor({'f': 'date', 'v': '2025-01-01', 'id': '1 OR 1=1'}),
+            'missing id': self.cursor({'f': 'date', 'v': '2025-01-01'}),
+        }
+        for name, token in tampered.items():
+            with self.subTest(cursor=name):
+                response = self.client.get('/api/transactions/', {'ordering': '-date', 'cursor': token})
+                self.assertEqual(response.status_code, 400, response.content)
+        for value in ('NaN', 'abc'):
+            with self.subTest(amount=value):
+                token = self.cursor({'f': 'amount', 'v': value, 'id': 1})
+                response = self.client.get('/api/transactions/', {'ordering': 'amount', 'cursor': token})
+                self.assertEqual(response.status_code, 400, response.content)
+
+    def test_totals_only_on_request_and_cached(self):
+        # ?search= cannot be answered from the rollups, the totals need a row aggregate
+        with CaptureQueriesContext(connection) as queries:
+            page = self.first_page('-date', search='Transaction')
+        self.assertIsNone(page['totals'])
+        self.assertIsNone(page['count'])
+        self.assertFalse([query for query in queries if 'SUM(' in query['sql'] or 'COUNT(' in query['sql']])
+
+        page = self.first_page('-date', search='Transaction', total='exact')
+        self.assertEqual(page['count'], 50)
+        self.assertEqual(page['totals']['total_transactions'], 50)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.get(page['next'])
+        self.assertEqual(second['totals'], page['totals'])
+        self.assertEqual(second['count'], 50)
+        self.assertFalse([query for query in queries if 'SUM(' in query['sql'] or 'COUNT(' in query['sql']])
+
+
+def rollup_rows():
+    # Buckets emptied by deletes stay behind with zeros, a rebuild drops them
+    rows = MonthlyCategoryRollup.objects.exclude(transaction_count=0, total_amount=0, recurring_count=0)
+    return sorted(rows.values_list(
+        'user_id', 'year', 'month', 'category', 'total_amount', 'transaction_count', 'recurring_count'
+    ))
+
+
+class RollupAssertions:
+
+    def assertRollupsMatchRebuild(self):
+        incremental = rollup_rows()
+        with db_transaction.atomic():
+            rollups.rebuild()
+            rebuilt = rollup_rows()
+            db_transaction.set_rollback(True)
+        self.assertEqual(incremental, rebuilt)
+        self.assertTrue(rebuilt)
+
+
+class RollupTests(RollupAssertions, TestCase):
+    """The incrementally maintained rollups must always equal a rebuild from the rows"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.other = User.objects.create_user('bob', 'bob@example.com', 'password')
+        cls.staff = User.objects.create_user('carol', 'carol@example.com', 'password', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, data):
+        response = self.client.post('/api/transactions/', data, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def create_rows(self):
+        created = self.post({
+            'date': '2025-01-15', 'description': 'Groceries', 'amount': '12.50', 'category': 'food',
+        })
+        self.post([
+            {'date': '2025-01-20', 'description': 'Bus', 'amount': '2.75', 'category': 'transport'},
+            {'date': '2025-02-01', 'description': 'Salary', 'amount': '1000.00', 'category': 'income'},
+            {'date': '2025-02-03', 'description': 'Rent', 'amount': '400.00', 'category': 'housing',
+             'is_recurring': True},
+        ])
+        Transaction.objects.create(
+            user=self.other, date=date(2025, 1, 10), description='Other', amount=Decimal('9'), category='food'
+        )
+        return Transaction.objects.get(description='Groceries', user=self.user)
+
+    def test_writes_keep_rollups_in_sync(self):
+        groceries = self.create_rows()
+        self.assertRollupsMatchRebuild()
+
+        steps = {
+            'amount': {'amount': '20.00'},
+            'category': {'category': 'entertainment'},
+            'month': {'date': '2025-03-02'},
+            'recurring': {'is_recurring': True},
+            'everything': {'date': '2024-12-31', 'amount': '7.10', 'category': 'health', 'is_recurring': False},
+        }
+        for name, data in steps.items():
+            with self.subTest(edit=name):
+                response = self.client.patch(f'/api/transactions/{groceries.pk}/', data, format='json')
+                self.assertEqual(response.status_code, 200, response.content)
+                self.assertRollupsMatchRebuild()
+
+        response = self.client.delete(f'/api/transactions/{groceries.pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertRollupsMatchRebuild()
+
+    def test_list_totals_match_row_aggregate(self):
+        self.create_rows()
+        filters = {
+            'everything': {},
+            'category': {'category': 'food'},
+            'whole months': {'date_after': '2025-02-01', 'date_before': '2025-02-28'},
+            'open start': {'date_before': '2025-01-31'},
+            # Not whole months or UNANSWERABLE_PARAMS: aggregated from the rows
+            'part of a month': {'date_after': '2025-01-16'},
+            'search': {'search': 'Bus'},
+            'amount range': {'amount__gte': '5', 'amount__lte': '500'},
+        }
+        for user in (self.user, self.staff):
+            self.client.force_authenticate(user)
+            rows = Transaction.objects.all() if user.is_staff else Transaction.objects.filter(user=user)
+            for name, params in filters.items():
+                with self.subTest(user=user.username, filters=name):
+                    totals = self.client.get('/api/transactions/', params).json()['totals']
+                    expected = TransactionFilters(params, queryset=rows).qs
+                    if params.get('search'):
+                        expected = expected.filter(description__icontains=params['search'])
+                    income = sum(row.amount for row in expected if row.category == 'income')
+                    expenses = sum(row.amount for row in expected if row.category != 'income')
+                    self.assertEqual(totals, {
+                        'total_income': float(income),
+                        'total_expenses': float(expenses),
+                        'net_amount': float(income - expenses),
+                        'total_transactions': len(expected),
+                    })
+
+        # Only the filters the rollups can answer skip the row aggregate
+        for name in ('search', 'amount range', 'part of a month'):
+            self.assertIsNone(rollups.totals_from_rollups(self.user, QueryDict(urlencode(filters[name]))))
+        self.assertIsNotNone(rollups.totals_from_rollups(self.user, QueryDict(urlencode(filters['whole months']))))
+
+
+class StatementPDFTests(SimpleTestCase):
+    """The hand-written statement PDF must have a valid cross-reference table, page tree and totals"""
+
+    def rows(self, count):
+        return [
+            (
+                date(2025, 1, 1) + timedelta(days=i // 10),
+                f'Row {i} (paid)',
+                Decimal(f'{i % 37}.{i % 100:02d}'),
+                ('income', 'food', 'transport')[i % 3],
+            )
+            for i in range(count)
+        ]
+
+    def parse(self, data):
+        """{object number: body} read through the xref table, checking every offset on the way"""
+        self.assertTrue(data.startswith(b'%PDF-1.4\n'))
+        self.assertTrue(data.endswith(b'%%EOF\n'))
+        startxref = int(re.search(rb'startxref\n(\d+)\n%%EOF\n$', data).group(1))
+        self.assertTrue(data[startxref:].startswith(b'xref\n'))
+        first, size = map(int, re.match(rb'xref\n(\d+) (\d+)\n', data[startxref:]).groups())
+        self.assertEqual(first, 0)
+        self.assertIn(b'/Size %d ' % size, data[startxref:])
+        table = data[startxref:].split(b'\n', 2)[2]
+        objects = {}
+        for number in range(size):
+            entry = table[number * 20:(number + 1) * 20]
+            offset, _generation, kind = entry.split()
+            if kind == b'f':
+                continue
+            offset = int(offset)
+            header = b'%d 0 obj\n' % number
+            self.assertEqual(data[offset:offset + len(header)], header, f'xref entry of object {number}')
+            objects[number] = data[offset + len(header):data.index(b'\nendobj\n', offset)]
+        return objects
+
+    def contents(self, objects, page):
+        number = int(re.search(rb'/Contents (\d+) 0 R', objects[page]).group(1))
+        body = objects[number]
+        length = int(re.search(rb'/Length (\d+)', body).group(1))
+        stream = body[body.index(b'stream\n') + 7:][:length]
+        return zlib.decompress(stream) if b'/FlateDecode' in body else stream
+
+    def pages(self, data):
+        objects = self.parse(data)
+        catalog = objects[int(re.search(rb'/Root (\d+) 0 R', data[data.rindex(b'trailer'):]).group(1))]
+        tree = objects[int(re.search(rb'/Pages (\d+) 0 R', catalog).group(1))]
+        kids = [int(number) for number in re.findall(rb'(\d+) 0 R', re.search(rb'/Kids \[(.*?)\]', tree).group(1))]
+        self.assertEqual(int(re.search(rb'/Count (\d+)', tree).group(1)), len(kids))
+        self.assertEqual(len(kids), len([body for body in objects.values() if b'/Type /Page ' in body]))
+        return [self.contents(objects, kid) for kid in kids]
+
+    def assertSummary(self, page, rows):
+        income = sum((amount for _day, _description, amount, category in rows if category == 'income'), Decimal(0))
+        expenses = sum((amount for _day, _description, amount, category in rows if category != 'income'), Decimal(0))
+        for line in (
+            f'Total Income: BDT {income:,.2f}',
+            f'Total Expenses: BDT {expenses:,.2f}',
+            f'Net Amount: BDT {income - expenses:,.2f}',
+            f'Total Transactions: {len(rows)}',
+        ):
+            self.assertIn(b'(%s) Tj' % line.encode(), page)
+
+    def test_pages_offsets_and_totals(self):
+        sizes = {
+            'one full page': ROWS_PER_PAGE,
+            'last page full': 2 * ROWS_PER_PAGE,
+            'last page partial': 2 * ROWS_PER_PAGE + 3,
+        }
+        for name, count in sizes.items():
+            for compress in (6, 0):
+                with self.subTest(rows=name, compress=compress):
+                    rows = self.rows(count)
+                    summary = Summary()
+                    data = b''.join(statement_chunks(iter(rows), compress=compress, summary=summary))
+                    pages = self.pages(data)
+                    # The summary comes first, then no empty page after a full one
+                    self.assertEqual(len(pages), 1 + -(-count // ROWS_PER_PAGE))
+                    self.assertSummary(pages[0], rows)
+                    self.assertEqual(summary.count, count)
+                    written = [page.count(b' Tj') for page in pages[1:]]
+                    # Four cells a row, the page head and the footer
+                    self.assertEqual(sum(written), 4 * count + (len(TABLE_HEADER) + 3) * len(written))
+                    self.assertIn(b'\\(paid\\)', pages[1])
+
+    def test_empty_range(self):
+        pages = self.pages(statement_pdf(iter([])))
+        self.assertEqual(len(pages), 1)
+        self.assertSummary(pages[0], [])
+
+
+class JSONArrayStreamTests(SimpleTestCase):
+    """Elements must come out of any chunking exactly as json.loads reads the whole array"""
+
+    ANSWER = '```json\n' + json.dumps([
+        {'description': 'Tea "large" [2x]', 'amount': 3.5, 'notes': '{not an object}'},
+        {'description': 'Back\\slash \\"', 'tags': ['a]', '[b', {'c': '}'}]},
+        7,
+        'a scalar with ] and }',
+        [1, [2, {'d': []}]],
+        {'description': 'Café ☺', 'amount': -1e3},
+    ], indent=1, ensure_ascii=False) + '\n```'
+    EXPECTED = [item for item in json.loads(ANSWER[8:-4]) if isinstance(item, (dict, list))]
+
+    def read(self, chunks):
+        stream = JSONArrayStream()
+        items = [item for chunk in chunks for item in stream.feed(chunk)]
+        stream.close()
+        return items
+
+    def test_every_split(self):
+        for i in range(len(self.ANSWER) + 1):
+            with self.subTest(split=i):
+                self.assertEqual(self.read([self.ANSWER[:i], self.ANSWER[i:]]), self.EXPECTED)
+        self.assertEqual(self.read(self.ANSWER), self.EXPECTED)
+
+    def test_truncated_answer(self):
+        end = self.ANSWER.rindex(']')
+        for i in range(end):
+            with self.subTest(length=i):
+                stream = JSONArrayStream()
+                items = stream.feed(self.ANSWER[:i])
+                # Only the elements that closed are returned, then close() reports the rest
+                self.assertEqual(items, self.EXPECTED[:len(items)])
+                with self.assertRaises(ValueError):
+                    stream.close()
+        with self.assertRaisesMessage(ValueError, 'No JSON array'):
+            self.read(['Sorry, I cannot read this receipt.'])
+
+    def test_malformed_element_is_reported(self):
+        for answer in ('[{"a": 1}, {"b": 2,}]', '[{"a": 1}, {"b": 2]]', '[{"a": 1}, {"b": tru}]'):
+            with self.subTest(answer=answer):
+                stream = JSONArrayStream()
+                self.assertEqual(stream.feed(answer[:10]), [{'a': 1}])
+                with self.assertRaises(ValueError):
+                    stream.feed(answer[10:])
+
+
+class SingleFlightTests(SimpleTestCase):
+    """Concurrent identical calls must reach the backend once, in one process and across processes"""
+
+    WAITERS = 8
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings_override = self.settings(SINGLEFLIGHT_DIR=self.directory, SINGLEFLIGHT_LEASE_TIMEOUT=5)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.calls = 0
+        self.release = threading.Event()
+        self.entered = threading.Event()
+
+    def backend(self, result=None, error=None):
+        def call():
+            self.calls += 1
+            self.entered.set()
+            self.release.wait(5)
+            if error:
+                raise error
+            return result
+        return call
+
+    def run_concurrently(self, fn):
+        """Calls do('key', fn) from WAITERS threads while the first call is in flight"""
+        outcomes = [None] * self.WAITERS
+
+        def caller(i):
+            try:
+                outcomes[i] = ('result', singleflight.do('key', fn))
+            except Exception as e:
+                outcomes[i] = ('error', e)
+
+        threads = [threading.Thread(target=caller, args=(i,)) for i in range(self.WAITERS)]
+        threads[0].start()
+        self.assertTrue(self.entered.wait(5))
+        for thread in threads[1:]:
+            thread.start()
+        # The followers find the flight and block on it
+        time.sleep(0.2)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_concurrent_callers_share_one_call(self):
+        outcomes = self.run_concurrently(self.backend(result={'total': 42}))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(outcomes, [('result', {'total': 42})] * self.WAITERS)
+
+    def test_error_reaches_every_waiter_and_is_not_cached(self):
+        error = RuntimeError('Gemini is down')
+        outcomes = self.run_concurrently(self.backend(error=error))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(outcomes, [('error', error)] * self.WAITERS)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'key.json')))
+
+        self.assertEqual(singleflight.do('key', self.backend(result='retried')), 'retried')
+        self.assertEqual(self.calls, 2)
+
+    def test_waiter_for_the_lease_reads_the_shared_result(self):
+        # Another process holds the lease and stores its result before releasing it
+        lock_path, result_path = singleflight._paths('key')
+        lease = FileLock(lock_path)
+        lease.acquire()
+        outcome = []
+        thread = threading.Thread(target=lambda: outcome.append(singleflight.do('key', self.backend(result='own'))))
+        thread.start()
+        time.sleep(0.2)
+        singleflight._write_result(result_path, 'shared')
+        lease.release()
+        thread.join(5)
+        self.assertEqual(outcome, ['shared'])
+        self.assertEqual(self.calls, 0)
+
+        # Not shareable: the next caller makes its own call
+        self.release.set()
+        self.assertIsNone(singleflight.do('key', self.backend(result=None), shareable=bool))
+        self.assertEqual(singleflight.do('key', self.backend(result='again'), shareable=bool), 'again')
+        self.assertEqual(self.calls, 2)
+
+    def test_stale_lease_is_swept_and_called_again(self):
+        self.release.set()
+        stale = time.time() - 3600
+        lock_path, result_path = singleflight._paths('stale')
+        singleflight._write_result(result_path, 'old')
+        with FileLock(lock_path):
+            pass
+        for path in (lock_path, result_path):
+            self.assertTrue(os.path.exists(path))
+            os.utime(path, (stale, stale))
+
+        # Storing any result sweeps leftovers older than the lease timeout
+        singleflight._last_sweep = 0.0
+        self.assertEqual(singleflight.do('fresh', self.backend(result='fresh')), 'fresh')
+        self.assertFalse(os.path.exists(lock_path))
+        self.assertFalse(os.path.exists(result_path))
+
+        self.assertEqual(singleflight.do('stale', self.backend(result='new')), 'new')
+        self.assertEqual(self.calls, 2)
+
+
+class JobLeaseTests(TestCase):
+    """Only the latest claim of a job may finish it, and running jobs keep their lease"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+
+    def test_expired_lease_is_reclaimed_and_old_holder_refused(self):
+        job = jobs.submit(self.user, Job.KIND_RECURRING)
+        # Two pool threads of one worker process
+        first, second = jobs.lease_holder('host:1'), jobs.lease_holder('host:1')
+        self.assertNotEqual(first, second)
+
+        old = jobs.claim(first, lease_seconds=60)
+        self.assertEqual((old.pk, old.worker, old.attempts), (job.pk, first, 1))
+        self.assertIsNone(jobs.claim(second))
+        self.assertTrue(jobs.renew(old, first))
+
+        Job.objects.filter(pk=job.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        new = jobs.claim(second)
+        self.assertEqual((new.pk, new.worker, new.attempts), (job.pk, second, 2))
+
+        # The first run finishing late changes nothing
+        self.assertFalse(jobs.renew(old, first))
+        self.assertIsNone(jobs._succeed(old, first, {'series': 1}))
+        self.assertIsNone(jobs._fail(old, first, RuntimeError('late')))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker, job.result), (Job.STATUS_RUNNING, second, None))
+
+        self.assertEqual(jobs._succeed(new, second, {'series': 2}), Job.STATUS_SUCCEEDED)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), (Job.STATUS_SUCCEEDED, {'series': 2}))
+
+    def test_heartbeat_renews_until_stopped_or_lost(self):
+        job = jobs.submit(self.user, Job.KIND_RECURRING)
+        renewals = []
+
+        def renew(job, worker):
+            renewals.append(worker)
+            return len(renewals) < 3
+
+        with self.settings(JOB_LEASE_SECONDS=0.03), mock.patch.object(jobs, 'renew', renew):
+            heartbeat = jobs._Heartbeat(job, 'host:1:a')
+            with self.assertLogs('core.jobs', 'WARNING'):
+                heartbeat.start()
+                heartbeat.join(5)
+            # Gave up once the lease was lost
+            self.assertFalse(heartbeat.is_alive())
+            self.assertEqual(renewals, ['host:1:a'] * 3)
+
+            heartbeat = jobs._Heartbeat(job, 'host:1:b')
+            heartbeat.start()
+            heartbeat.stop()
+            self.assertFalse(heartbeat.is_alive())
+
+
+class StatementImportTests(RollupAssertions, TestCase):
+    """CSV and OFX statements must import exactly the rows they contain and keep the rollups in sync"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+
+    def rows(self):
+        return sorted(Transaction.objects.filter(user=self.user).values_list(
+            'date', 'description', 'amount', 'category', 'is_recurring', 'category_guessed'
+        ))
+
+    def import_csv(self, text, **kwargs):
+        return import_transactions(self.user, io.BytesIO(text.encode('utf-8')), 'csv', **kwargs)
+
+    def test_csv_round_trip(self):
+        result = self.import_csv(
+            '\ufeffDate,Description,Amount,Category,Recurring\n'
+            '2025-01-05,Salary,"1,500.00",Salary,no\n'
+            '06/01/2025,"Corner shop, milk",-3.20,groceries,\n'
+            '2025-02-01,Rent,(400.00),Housing,yes\n'
+            '2025-02-03,Mystery,12.00,not a category,\n',
+            batch_size=2,
+        )
+        self.assertEqual((result['inserted'], result['rejected'], len(result['chunks'])), (4, 0, 2))
+        self.assertEqual(self.rows(), [
+            (date(2025, 1, 5), 'Salary', Decimal('1500.00'), 'income', False, False),
+            (date(2025, 1, 6), 'Corner shop, milk', Decimal('3.20'), 'food', False, False),
+            (date(2025, 2, 1), 'Rent', Decimal('400.00'), 'housing', True, False),
+            (date(2025, 2, 3), 'Mystery', Decimal('12.00'), 'miscellaneous', False, True),
+        ])
+        self.assertRollupsMatchRebuild()
+
+    def test_csv_type_column_sets_the_direction(self):
+        self.import_csv(
+            'Posted Date,Payee,Amount,Type\n'
+            '2025-03-01,Employer,2000.00,CREDIT\n'
+            '2025-03-02,Bakery,4.50,DEBIT\n'
+            '2025-03-03,Refund,-9.99,credit\n'
+            '2025-03-04,Cinema,-12.00,\n',
+            categorize=lambda descriptions: ['food' if name == 'Bakery' else None for name in descriptions],
+        )
+        self.assertEqual(self.rows(), [
+            (date(2025, 3, 1), 'Employer', Decimal('2000.00'), 'income', False, True),
+            (date(2025, 3, 2), 'Bakery', Decimal('4.50'), 'food', False, True),
+            (date(2025, 3, 3), 'Refund', Decimal('9.99'), 'income', False, True),
+            (date(2025, 3, 4), 'Cinema', Decimal('12.00'), 'miscellaneous', False, True),
+        ])
+
+    def test_ofx_round_trip(self):
+        for dialect, close in (('SGML', ''), ('XML', '</TRNAMT>')):
+            with self.subTest(dialect=dialect):
+                Transaction.objects.filter(user=self.user).delete()
+                transactions = ''.join(
+                    f'<STMTTRN><TRNTYPE>{kind}<DTPOSTED>{day}[-5:EST]<TRNAMT>{amount}{close}'
+                    f'<NAME>{name}<MEMO>{memo}</STMTTRN>\n'
+                    for kind, day, amount, name, memo in (
+                        ('CREDIT', '20250410120000', '250.00', 'ACME PAYROLL', 'ACME PAYROLL'),
+                        ('DEBIT', '20250411', '-18.75', 'FUEL STATION', 'Pump 4'),
+                    )
+                )
+                statement = f'OFXHEADER:100\nDATA:OFXSGML\n<OFX><BANKTRANLIST>\n{transactions}</BANKTRANLIST></OFX>\n'
+                # Small reads split the tags across buffers
+                with mock.patch.dict(PARSERS, ofx=functools.partial(parse_ofx, read_size=7)):
+                    result = import_transactions(self.user, io.BytesIO(statement.encode('utf-8')), 'ofx')
+                self.assertEqual(result['inserted'], 2)
+                self.assertEqual(self.rows(), [
+                    (date(2025, 4, 10), 'ACME PAYROLL', Decimal('250.00'), 'income', False, True),
+                    (date(2025, 4, 11), 'FUEL STATION - Pump 4', Decimal('18.75'), 'miscellaneous', False, True),
+                ])
+                self.assertRollupsMatchRebuild()
+
+    def test_validation_errors_are_reported_by_line(self):
+        result = self.import_csv(
+            'date,description,amount\n'
+            '2025-05-01,Valid,10.00\n'
+            'yesterday,Bad date,10.00\n'
+            '2025-05-02,Bad amount,ten\n'
+            '2025-05-03,,10.00\n'
+            '2025-05-04,Zero,0\n'
+            '2025-05-05,Huge,100000000.00\n'
+            '2025-05-06,Not a number,NaN\n'
+            '2025-05-07,Also valid,-2.50\n',
+            batch_size=3,
+        )
+        self.assertEqual((result['inserted'], result['rejected']), (2, 6))
+        self.assertEqual(result['errors'], [
+            {'line': 3, 'error': 'Invalid date'},
+            {'line': 4, 'error': 'Invalid amount'},
+            {'line': 5, 'error': 'Missing description'},
+            {'line': 6, 'error': 'Amount must be greater than zero.'},
+            {'line': 7, 'error': 'Amount is too large'},
+            {'line': 8, 'error': 'Invalid amount'},
+        ])
+        self.assertEqual([row[1] for row in self.rows()], ['Valid', 'Also valid'])
+        self.assertRollupsMatchRebuild()
+
+        with self.assertRaises(StatementImportError):
+            self.import_csv('when,what\n2025-01-01,Nothing\n')
+
+
+def receipt_image(lines, image_format='PNG', quality=95):
+    """A synthetic receipt: the same layout with different lines is another shop visit"""
+    image = Image.new('L', (360, 540), 255)
+    draw = ImageDraw.Draw(image)
+    draw.text((120, 20), 'CORNER SHOP', fill=0)
+    draw.line((20, 50, 340, 50), fill=0, width=2)
+    for i, line in enumerate(lines):
+        draw.text((30, 70 + 24 * i), line, fill=0)
+    output = io.BytesIO()
+    image.save(output, image_format, **({'quality': quality} if image_format == 'JPEG' else {}))
+    return output.getvalue()
+
+
+def use_temporary_media(testcase):
+    directory = tempfile.TemporaryDirectory()
+    testcase.addCleanup(directory.cleanup)
+    override = testcase.settings(MEDIA_ROOT=directory.name)
+    override.enable()
+    testcase.addCleanup(override.disable)
+
+
+class ReceiptCacheTests(TestCase):
+    """Only byte-identical receipts are served by default, and the stored images stay within the limits"""
+
+    LINES = ['Milk 2L            3.20', 'Bread              2.10', 'Eggs x12           4.80', 'TOTAL             10.10']
+    TRANSACTIONS = [{'description': 'Corner shop', 'amount': 10.1, 'category': 'food', 'date': '2025-06-01'}]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.other = User.objects.create_user('bob', 'bob@example.com', 'password')
+
+    def setUp(self):
+        use_temporary_media(self)
+
+    def test_exact_copy_hits(self):
+        upload = receipt_image(self.LINES)
+        receipt_cache.put(self.user, receipt_images.preprocess(upload), self.TRANSACTIONS)
+
+        cached = receipt_cache.get(self.user, receipt_images.preprocess(upload))
+        self.assertEqual(cached, self.TRANSACTIONS)
+        self.assertNotIsInstance(cached, receipt_cache.NearMatch)
+        self.assertEqual(TransactionImage.objects.get().hits, 1)
+        # Per user
+        self.assertIsNone(receipt_cache.get(self.other, receipt_images.preprocess(upload)))
+
+    def test_near_match_is_not_served_by_default(self):
+        receipt_cache.put(self.user, receipt_images.preprocess(receipt_image(self.LINES)), self.TRANSACTIONS)
+        reencoded = receipt_images.preprocess(receipt_image(self.LINES, 'JPEG', quality=70))
+        other_visit = receipt_images.preprocess(
+            receipt_image(self.LINES[:2] + ['Eggs x12           4.90', 'TOTAL             10.20'])
+        )
+        stored = TransactionImage.objects.get()
+        self.assertNotEqual(receipt_cache.image_digest(reencoded), stored.sha256)
+        # Both look alike to the perceptual hash
+        self.assertLessEqual(receipt_images.hamming_distance(reencoded.phash, stored.phash), 8)
+        self.assertLessEqual(receipt_images.hamming_distance(other_visit.phash, stored.phash), 8)
+
+        self.assertIsNone(receipt_cache.get(self.user, reencoded))
+        self.assertIsNone(receipt_cache.get(self.user, other_visit))
+
+        with self.settings(RECEIPT_CACHE_PHASH_THRESHOLD=8):
+            # Enabled, the pixels still have to match
+            self.assertIsNone(receipt_cache.get(self.user, other_visit))
+            cached = receipt_cache.get(self.user, reencoded)
+            self.assertIsInstance(cached, receipt_cache.NearMatch)
+            self.assertEqual(cached, self.TRANSACTIONS)
+            self.assertIsNone(receipt_cache.get(self.user, reencoded, near=False))
+
+    def test_eviction_stays_within_the_limits(self):
+        images = [receipt_images.preprocess(receipt_image([f'Visit {i}'] + self.LINES)) for i in range(6)]
+        limit = sum(len(image.data) for image in images[:3]) + 1
+        with self.settings(RECEIPT_CACHE_MAX_BYTES=limit):
+            for i, image in enumerate(images):
+                receipt_cache.put(self.user if i % 2 else self.other, image, self.TRANSACTIONS)
+                # Keeps the first receipt in use, so the others go first
+                receipt_cache.get(self.other, images[0])
+                self.assertLessEqual(TransactionImage.objects.aggregate(total=Sum('size'))['total'], limit)
+
+        kept = {entry.sha256 for entry in TransactionImage.objects.all()}
+        self.assertIn(receipt_cache.image_digest(images[0]), kept)
+        self.assertIn(receipt_cache.image_digest(images[-1]), kept)
+        self.assertLess(len(kept), len(images))
+        # Evicted rows take their files with them
+        stored = os.listdir(os.path.join(settings.MEDIA_ROOT, 'transaction_images'))
+        self.assertEqual(len(stored), len(kept))
+
+        with self.settings(RECEIPT_CACHE_MAX_ENTRIES=1):
+            receipt_cache.put(self.user, images[1], self.TRANSACTIONS)
+        self.assertEqual(TransactionImage.objects.filter(user=self.user).count(), 1)
+
+
+class ReceiptBatchTests(SimpleTestCase):
+    """Batches must refuse oversized archives and extra Gemini calls, and report receipts one by one"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User(pk=1, username='alice')
+
+    def archive(self, members, name='receipts.zip'):
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for member_name, data in members.items():
+                archive.writestr(member_name, data)
+        return SimpleUploadedFile(name, output.getvalue())
+
+    def test_archive_limits(self):
+        png = receipt_image(['Tea 1.00'])
+        # Six compressed kilobytes that inflate to 6MB
+        bomb = self.archive({
+            'bomb.png': b'\0' * (MAX_IMAGE_BYTES + 1024 * 1024), 'ok.png': png, '__MACOSX/._ok.png': b'',
+        })
+        images = collect_images([bomb])
+        self.assertLess(bomb.size, 100 * 1024)
+        self.assertEqual([image.name for image in images], ['receipts.zip/bomb.png', 'receipts.zip/ok.png'])
+        with self.assertRaisesMessage(ValueError, '5MB'):
+            images[0].read()
+        self.assertEqual(images[1].read(), png)
+
+        with self.settings(RECEIPT_BATCH_MAX_IMAGES=3):
+            with self.assertRaisesMessage(ValueError, 'At most 3 receipts'):
+                collect_images([self.archive({f'{i}.png': png for i in range(1000)})])
+            with self.assertRaisesMessage(ValueError, 'At most 3 receipts'):
+                collect_images([SimpleUploadedFile(f'{i}.png', png) for i in range(4)])
+
+        with mock.patch.object(receipt_batch, 'MAX_ARCHIVE_BYTES', 64):
+            (image,) = collect_images([self.archive({'ok.png': png})])
+        with self.assertRaisesMessage(ValueError, 'Zip file size exceeds'):
+            image.read()
+
+        (image,) = collect_images([SimpleUploadedFile('broken.zip', ZIP_SIGNATURE + b'not really')])
+        with self.assertRaisesMessage(ValueError, 'Invalid zip file'):
+            image.read()
+
+    def test_budget_window_refuses_extra_calls(self):
+        with self.settings(RECEIPT_BATCH_RATE_LIMIT=2, RECEIPT_BATCH_RATE_PERIOD=3600):
+            take_budget(self.user)
+            take_budget(self.user)
+            with self.assertRaises(RateBudgetExceeded) as refused:
+                take_budget(self.user)
+            self.assertTrue(0 < refused.exception.retry_after <= 3600)
+            # Per user
+            take_budget(User(pk=2, username='bob'))
+
+            # The next window starts afresh
+            with mock.patch('core.receipt_batch.time.time', return_value=time.time() + 3600):
+                take_budget(self.user)
+
+    def test_failed_receipt_does_not_cancel_the_batch(self):
+        def extract(user, image_bytes, budget):
+            if image_bytes == b'unreadable':
+                raise ValueError('Failed to extract transactions from image.')
+            budget()
+            return [{'description': image_bytes.decode()}]
+
+        uploads = [SimpleUploadedFile(name, name.encode()) for name in ('a', 'b', 'c', 'd')]
+        uploads.insert(1, SimpleUploadedFile('unreadable', b'unreadable'))
+        with self.settings(RECEIPT_BATCH_RATE_LIMIT=3, RECEIPT_BATCH_CONCURRENCY=2):
+            outcomes = sorted(run_batch(self.user, collect_images(uploads), extract), key=lambda outcome: outcome[0])
+
+        self.assertEqual([index for index, *_ in outcomes], list(range(5)))
+        self.assertIsInstance(outcomes[1][3], ValueError)
+        succeeded = [outcome for outcome in outcomes if outcome[3] is None]
+        refused = [outcome for outcome in outcomes if isinstance(outcome[3], RateBudgetExceeded)]
+        # Three calls in the budget, the fourth readable receipt is refused
+        self.assertEqual((len(succeeded), len(refused)), (3, 1))
+        for _index, image, transactions, _error in succeeded:
+            self.assertEqual(transactions, [{'description': image.name}])
+
+
+class CategorizerTests(TestCase):
+    """Suggestions come from the background training job, which learns only categories users gave"""
+
+    LABELLED = [
+        ('Uber trip to office', 'transport'), ('Uber ride home', 'transport'), ('Metro card top up', 'transport'),
+        ('Starbucks coffee', 'food'), ('Pizza Hut dinner', 'food'), ('Corner grocery store', 'food'),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+
+    def setUp(self):
+        categorizer._models.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def suggest(self, description):
+        response = self.client.get('/api/transactions/suggest-category/', {'description': description})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def run_jobs(self):
+        ran = 0
+        while (job := jobs.claim('test', kinds=[Job.KIND_CATEGORIZER])) is not None:
+            self.assertEqual(jobs._succeed(job, 'test', jobs.HANDLERS[job.kind](job)), Job.STATUS_SUCCEEDED)
+            ran += 1
+        return ran
+
+    def test_suggestions_after_training_job_and_guesses_not_learned(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/transactions/', [
+                {'date': '2025-01-01', 'description': description, 'amount': '5.00', 'category': category}
+                for description, category in self.LABELLED
+            ], format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        # Nothing learned in the request
+        self.assertEqual(self.suggest('Uber to the airport'), {'category': None, 'suggestions': []})
+
+        # An import the classifier could not categorize: defaulted to miscellaneous
+        statement = SimpleUploadedFile(
+            'statement.csv', b'date,description,amount\n2025-01-02,Netflix subscription,-15.00\n'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/transactions/import/', {'file': statement}, format='multipart')
+        self.assertEqual(response.json()['inserted'], 1)
+        imported = Transaction.objects.get(description='Netflix subscription')
+        self.assertEqual((imported.category, imported.category_guessed), ('miscellaneous', True))
+
+        # Both writes queued one job between them
+        self.assertEqual(self.run_jobs(), 1)
+        self.assertEqual(self.suggest('Uber to the airport')['category'], 'transport')
+        self.assertEqual(self.suggest('Coffee at Starbucks')['category'], 'food')
+
+        model = categorizer.load(self.user.pk)
+        self.assertEqual(model.examples, len(self.LABELLED))
+        self.assertEqual(model.counts[categorizer.CATEGORIES.index('miscellaneous')], 0)
+        self.assertEqual(categorizer.load(None).examples, len(self.LABELLED))
+        self.assertNotIn('miscellaneous', [s['category'] for s in self.suggest('Netflix subscription')['suggestions']])
+
+        # Set by the user, the category may be learned from now on
+        response = self.client.patch(
+            f'/api/transactions/{imported.pk}/', {'category': 'entertainment'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        imported.refresh_from_db()
+        self.assertFalse(imported.category_guessed)
+
+
+class RecurringDetectionTests(TestCase):
+    """Regular charges become series, irregular ones do not, and writes only re-detect what they touch"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def history(self):
+        rows = [
+            (date(2025, month, 3), f'NETFLIX #44{month:02d}', Decimal('15.99'), 'entertainment')
+            for month in range(1, 7)
+        ]
+        rows += [(date(2025, month, 20), 'Spotify', Decimal('9.99'), 'entertainment') for month in range(1, 7)]
+        # Irregular: the same shop at random intervals, and a monthly bill seen twice only
+        rows += [(date(2025, 1, 1) + timedelta(days=offset), 'Amazon', Decimal('30'), 'clothing')
+                 for offset in (0, 3, 43, 54, 124, 126)]
+        rows += [(date(2025, 5, 1), 'Gym', Decimal('40'), 'health'), (date(2025, 6, 1), 'Gym', Decimal('40'), 'health')]
+        return rows
+
+    def test_detects_monthly_series_and_ignores_irregular_charges(self):
+        series = recurring.detect(self.history(), today=date(2025, 6, 25))
+        found = sorted(
+            (item.key, item.period, item.occurrences, item.amount, item.next_date, item.active) for item in series
+        )
+        self.assertEqual(
+            found,
+            [
+                ('netflix', 'monthly', 6, Decimal('15.99'), date(2025, 7, 3), True),
+                ('spotify', 'monthly', 6, Decimal('9.99'), date(2025, 7, 20), True),
+            ],
+        )
+
+    def run_jobs(self):
+        ran = []
+        while (job := jobs.claim('test', kinds=[Job.KIND_RECURRING])) is not None:
+            ran.append(job.payload)
+            self.assertEqual(jobs._succeed(job, 'test', jobs.HANDLERS[job.kind](job)), Job.STATUS_SUCCEEDED)
+        return ran
+
+    def test_write_redetects_only_the_changed_months(self):
+        Transaction.objects.bulk_create([
+            Transaction(user=self.user, date=day, description=description, amount=amount, category=category)
+            for day, description, amount, category in self.history()
+        ])
+        self.assertEqual(recurring.detect_user(self.user.pk), 2)
+        spotify = RecurringSeries.objects.get(key='spotify')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for day in ('2025-07-03', '2025-08-03'):
+                self.client.post('/api/transactions/', {
+                    'date': day, 'description': 'NETFLIX #4407', 'amount': '15.99', 'category': 'entertainment',
+                }, format='json')
+        # One job, collecting both months
+        self.assertEqual(self.run_jobs(), [{'months': ['2025-07', '2025-08']}])
+        netflix = RecurringSeries.objects.get(key='netflix')
+        self.assertEqual((netflix.occurrences, netflix.last_date), (8, date(2025, 8, 3)))
+        # Not re-detected: the same row
+        self.assertEqual(RecurringSeries.objects.get(key='spotify').detected_at, spotify.detected_at)
+
+        # Removing occurrences inside a stored series re-detects it too
+        with self.captureOnCommitCallbacks(execute=True):
+            for transaction in Transaction.objects.filter(description='Spotify', date__month__in=(2, 3, 5)):
+                self.client.delete(f'/api/transactions/{transaction.pk}/')
+        self.assertEqual(self.run_jobs(), [{'months': ['2025-02', '2025-03', '2025-05']}])
+        self.assertEqual(list(RecurringSeries.objects.values_list('key', flat=True)), ['netflix'])
+
+
+class AnomalyScoringTests(TestCase):
+    """Writes through the API are scored against the stored statistics right away"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+        Transaction.objects.bulk_create([
+            Transaction(
+                user=cls.user, date=date(2025, 1 + i % 6, 10), description=f'Lunch {i}',
+                amount=Decimal(10 + i), category='food',
+            )
+            for i in range(12)
+        ])
+        anomalies.rescore()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, data):
+        response = self.client.post('/api/transactions/', data, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def flagged(self):
+        flagged = Anomaly.objects.filter(kind=Anomaly.KIND_TRANSACTION)
+        return list(flagged.values_list('transaction__description', flat=True))
+
+    def test_single_saves(self):
+        self.assertEqual(self.flagged(), [])
+        self.post({'date': '2025-07-10', 'description': 'Usual lunch', 'amount': '16.00', 'category': 'food'})
+        self.post({'date': '2025-07-11', 'description': 'Banquet', 'amount': '500.00', 'category': 'food'})
+        # Another category without history is not judged
+        self.post({'date': '2025-07-11', 'description': 'Laptop', 'amount': '1500.00', 'category': 'education'})
+        self.assertEqual(self.flagged(), ['Banquet'])
+        anomaly = Anomaly.objects.get()
+        self.assertEqual((anomaly.amount, anomaly.expected), (Decimal('500.00'), Decimal('15.50')))
+
+        banquet = Transaction.objects.get(description='Banquet')
+        response = self.client.patch(f'/api/transactions/{banquet.pk}/', {'amount': '18.00'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.flagged(), [])
+
+    def test_bulk_create(self):
+        self.post([
+            {'date': '2025-07-10', 'description': 'Usual lunch', 'amount': '16.00', 'category': 'food'},
+            {'date': '2025-07-11', 'description': 'Banquet', 'amount': '500.00', 'category': 'food'},
+            {'date': '2025-07-12', 'description': 'Salary', 'amount': '5000.00', 'category': 'income'},
+        ])
+        self.assertEqual(self.flagged(), ['Banquet'])
+        # The same as a full rescore finds
+        anomalies.rescore()
+        self.assertEqual(self.flagged(), ['Banquet'])
+
+
+class ExportTests(TestCase):
+    """Exports must stream exactly the user's rows, with formula-like CSV cells neutralized"""
+
+    DESCRIPTIONS = [
+        'Groceries, weekly', '=HYPERLINK("http://example.com","x")', '+1 topup', '-refund', '@SUM(A1)',
+        'Café "quoted"\nsecond line', 'Tab\tinside',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+        other = User.objects.create_user('bob', 'bob@example.com', 'password')
+        Transaction.objects.bulk_create([
+            Transaction(user=cls.user, date=date(2025, 1, 1 + i), description=description,
+                        amount=Decimal(f'{i + 1}.25'), category='food', is_recurring=i % 2 == 0)
+            for i, description in enumerate(cls.DESCRIPTIONS)
+        ] + [
+            Transaction(user=other, date=date(2025, 1, 1), description='=Not yours', amount=Decimal('1'),
+                        category='food'),
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def export(self, **params):
+        response = self.client.get('/api/transactions/export/', params)
+        self.assertEqual(response.status_code, 200)
+        data = b''.join(response.streaming_content)
+        if params.get('gzip'):
+            self.assertEqual(response['Content-Type'], 'application/gzip')
+            data = gzip.decompress(data)
+        return data.decode('utf-8')
+
+    def expected(self, escape=False):
+        rows = Transaction.objects.filter(user=self.user).values_list(*EXPORT_FIELDS)
+        return sorted(
+            (
+                transaction_id, day.isoformat(),
+                "'" + description if escape and description[0] in '=+-@' else description,
+                f'{amount:.2f}', category, is_recurring,
+            )
+            for transaction_id, day, description, amount, category, is_recurring in rows
+        )
+
+    def test_csv_round_trip_escapes_formulas(self):
+        for compressed in ('', '1'):
+            with self.subTest(gzip=compressed):
+                header, *rows = csv.reader(io.StringIO(self.export(export_format='csv', gzip=compressed)))
+                self.assertEqual(tuple(header), EXPORT_FIELDS)
+                rows = sorted((int(id_), day, description, amount, category, recurring == 'True')
+                              for id_, day, description, amount, category, recurring in rows)
+                self.assertEqual(rows, self.expected(escape=True))
+                self.assertIn("'=HYPERLINK(\"http://example.com\",\"x\")", [row[2] for row in rows])
+
+    def test_ndjson_round_trip(self):
+        for compressed in ('', '1'):
+            with self.subTest(gzip=compressed):
+                lines = self.export(export_format='ndjson', gzip=compressed).splitlines()
+                rows = sorted(
+                    (row['id'], row['date'], row['description'], f"{row['amount']:.2f}", row['category'],
+                     row['is_recurring'])
+                    for row in map(json.loads, lines)
+                )
+                self.assertEqual(rows, self.expected())
@@ -0,0 +1,134 @@
+from datetime import date, timedelta
+
+import numpy as np
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncWeek
+
+from .constants import catagory_choices
+from .models import MonthlyCategoryRollup
+from .periods import month_range
+
+
+# Spending trends over many periods for charts, from one grouped query: month
+# and quarter totals are summed from the monthly rollups (core.rollups), week
+# totals are grouped from the transactions with TruncWeek. The result is
+# columnar, one array per category aligned with `periods`, so a chart library
+# can take the series as they are.
+
+GRANULARITIES = ('week', 'month', 'quarter')
+CATEGORIES = [key for key, _label in catagory_choices]
+_CATEGORY_INDEX = {category: i for i, category in enumerate(CATEGORIES)}
+INCOME = 'income'
+
+
+def month_number(year, month):
+    return year * 12 + month - 1
+
+
+def from_month_number(number):
+    return number // 12, number % 12 + 1
+
+
+def periods(start, end, granularity):
+    """
+    Period start dates covering the months `start` to `end`, both (year, month)
+    and inclusive. Quarters are widened to whole quarters, weeks start on Monday.
+
+    Returns:
+        list: Period start dates, in order
+    """
+    first, last = month_number(*start), month_number(*end)
+    if granularity == 'month':
+        return [date(*from_month_number(number), 1) for number in range(first, last + 1)]
+    if granularity == 'quarter':
+        first -= first % 3
+        return [date(*from_month_number(number), 1) for number in range(first, last + 1, 3)]
+    first_day = date(*start, 1)
+    _, end_day = month_range(*end)
+    day = first_day - timedelta(days=first_day.weekday())
+    weeks = []
+    while day < end_day:
+        weeks.append(day)
+        day += timedelta(days=7)
+    return weeks
+
+
+def _grouped_rows(user, period_starts, end, granularity, categories):
+    """(period start, category, total, count) rows from a single GROUP BY query"""
+    _, end_day = month_range(*end)
+    if granularity == 'week':
+        rows = user.transactions.filter(date__gte=period_starts[0], date__lt=end_day)
+        if categories:
+            rows = rows.filter(category__in=categories)
+        return [
+            (row['period'], row['category'], row['total'], row['count'])
+            for row in rows.annotate(period=TruncWeek('date')).values('period', 'category').annotate(
+                total=Sum('amount'), count=Count('id')
+            ).order_by()
+        ]
+
+    first = period_starts[0]
+    rollups = MonthlyCategoryRollup.objects.filter(user=user).filter(
+        Q(year__gt=first.year) | Q(year=first.year, month__gte=first.month)
+    ).filter(
+        Q(year__lt=end[0]) | Q(year=end[0], month__lte=end[1])
+    )
+    if categories:
+        rollups = rollups.filter(category__in=categories)
+    if granularity == 'month':
+        rollups = rollups.annotate(period_month=F('month'))
+    else:
+        # First month of the quarter, integer division
+        rollups = rollups.annotate(period_month=(F('month') - 1) / 3 * 3 + 1)
+    return [
+        (date(row['year'], row['period_month'], 1), row['category'], row['total'], row['count'])
+        for row in rollups.values('year', 'period_month', 'category').annotate(
+            total=Sum('total_amount'), count=Sum('transaction_count')
+        ).order_by()
+    ]
+
+
+def trends(user, start, end, granularity='month', categories=None):
+    """
+    Per-category totals of a user's transactions over a range of periods.
+
+    Args:
+        user (User): Whose transactions
+        start (tuple): First (year, month) of the range
+        end (tuple): Last (year, month) of the range, inclusive
+        granularity (str): 'week', 'month' or 'quarter'
+        categories (list, optional): Only these categories
+
+    Returns:
+        dict: `periods` (ISO start dates), `categories`, `series` and `counts`
+              (per category, one value per period), and `income`, `expenses`
+              and `net` arrays
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    period_starts = periods(start, end, granularity)
+    period_index = {period: i for i, period in enumerate(period_starts)}
+
+    totals = np.zeros((len(CATEGORIES), len(period_starts)))
+    counts = np.zeros((len(CATEGORIES), len(period_starts)), dtype=np.int64)
+    for period, category, total, count in _grouped_rows(user, period_starts, end, granularity, categories):
+        row, column = _CATEGORY_INDEX.get(category), period_index.get(period)
+        if row is None or column is None:
+            continue
+        totals[row, column] += float(total or 0)
+        counts[row, column] += count or 0
+
+    present = [i for i in range(len(CATEGORIES)) if counts[i].any()]
+    expense_rows = [i for i in range(len(CATEGORIES)) if CATEGORIES[i] != INCOME]
+    income = totals[_CATEGORY_INDEX[INCOME]]
+    expenses = totals[expense_rows].sum(axis=0)
+    return {
+        'granularity': granularity,
+        'periods': [period.isoformat() for period in period_starts],
+        'categories': [CATEGORIES[i] for i in present],
+        'series': {CATEGORIES[i]: totals[i].round(2).tolist() for i in present},
+        'counts': {CATEGORIES[i]: counts[i].tolist() for i in present},
+        'income': income.round(2).tolist(),
+        'expenses': expenses.round(2).tolist(),
+        'net': (income - expenses).round(2).tolist(),
+    }
@@ -1,11 +1,23 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
+from .async_views import (
+    AsyncAnalysisView,
+    AsyncImageToTransactionView,
+    AsyncImageToTransactionStreamView,
+    AsyncImageToTransactionBatchView,
+)
 from .views import (
     TransactionViewSet, 
     ImageToTransactionViewSet,
     AnalysisView,
+    ForecastView,
+    TrendsView,
     TransactionPDFView,
+    JobViewSet,
+    RecurringSeriesViewSet,
+    AnomalyViewSet,
+    LLMParseStatsView,
 
     #function based views
     user_update,
@@ -14,10 +26,30 @@ from .views import (
 router = DefaultRouter()
 router.register(r'transactions', TransactionViewSet, basename='transaction')
 router.register(r'image-to-trasaction', ImageToTransactionViewSet, basename='image-to-text')
+router.register(r'jobs', JobViewSet, basename='job')
+router.register(r'recurring', RecurringSeriesViewSet, basename='recurring')
+router.register(r'anomalies', AnomalyViewSet, basename='anomaly')
 
 urlpatterns = [
+    # Async (ASGI) variants of the Gemini-backed endpoints, listed before the
+    # router so `async` is not taken for a detail route pk
+    path('analysis/async/', AsyncAnalysisView.as_view(), name='analysis-async'),
+    path('image-to-trasaction/async/', AsyncImageToTransactionView.as_view(), name='image-to-text-async'),
+    path(
+        'image-to-trasaction/async/stream/',
+        AsyncImageToTransactionStreamView.as_view(),
+        name='image-to-text-async-stream'
+    ),
+    path(
+        'image-to-trasaction/async/batch/',
+        AsyncImageToTransactionBatchView.as_view(),
+        name='image-to-text-async-batch'
+    ),
     path('', include(router.urls)),
     path('analysis/', AnalysisView.as_view(), name='analysis'),
+    path('forecast/', ForecastView.as_view(), name='forecast'),
+    path('trends/', TrendsView.as_view(), name='trends'),
     path('user/update/', user_update, name='user-update'),
     path('transactions/pdf/download/', TransactionPDFView.as_view(), name='transaction-pdf'),
+    path('llm/parse-stats/', LLMParseStatsView.as_view(), name='llm-parse-stats'),
 ] 
\ No newline at end of file
@@ -1,4 +1,8 @@
-from datetime import date as dt, datetime
+import functools
+import hashlib
+import itertools
+import math
+from datetime import date as dt, datetime, timedelta
 from django.utils import timezone
 from django.http import HttpResponse
 
@@ -6,9 +10,9 @@ from django.shortcuts import render
 from django.db.models import Sum, Count, Q
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.http import FileResponse
+from django.http import FileResponse, StreamingHttpResponse
 
-from rest_framework import viewsets
+from rest_framework import mixins, viewsets
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated,IsAdminUser
@@ -21,20 +25,33 @@ from django_filters.rest_framework import DjangoFilterBackend
 
 
 
-from .models import Transaction, TransactionImage
+from .models import Transaction, TransactionImage, Job, RecurringSeries, Anomaly
 from .serializers import (
     TransactionSerializer ,
     TransactionViewSerializer, 
     TransactionCreateSerializer,
     TransactionUpdateSerializer,
     TransactionImageSerializer,
-    CustomUserUpdateSerializer
+    CustomUserUpdateSerializer,
+    UserViewSerializer,
+    JobSerializer,
+    JobCreateSerializer,
+    RecurringSeriesSerializer,
+    AnomalySerializer,
+    FLAT_LIST_FIELDS,
 )
-from .filters import TransactionFilters
-from .pagination import DefaultPagination
-from . image_to_transaction import image_to_transaction
-from .analysis import transaction_analysis
-from .transaction_to_pdf import create_transaction_pdf
+from .filters import AnomalyFilters, TransactionFilters
+from .pagination import DefaultPagination, KeysetPagination
+from .rollups import totals_from_rollups
+from .periods import month_range, previous_month, period_filter, quarter_range, year_range
+from .exporters import EXPORT_FIELDS, EXPORT_FORMATS, STREAM_FORMATS, export_stream, stream_event
+from .renderers import FastJSONRenderer
+from .importers import IMPORT_FORMATS, StatementImportError, detect_format, import_transactions
+from . image_to_transaction import image_to_transaction, stream_image_to_transaction, RECEIPT_MODEL
+from .analysis import transaction_analysis, ANALYSIS_MODEL, ANALYSIS_PROMPT_VERSION
+from .llm_client import LLMUnavailable
+from .pdf_stream import statement_chunks
+from . import analysis_cache, anomalies, categorizer, forecast, trends, jobs, receipt_batch, recurring, receipt_cache, receipt_images, singleflight, statements, structured_output
 
 # Create your views here.
 
@@ -46,7 +63,16 @@ class TransactionViewSet(viewsets.ModelViewSet):
     filterset_class = TransactionFilters
     pagination_class = DefaultPagination
 
-
+    @property
+    def paginator(self):
+        # ?pagination=cursor (or a cursor token) switches the list to keyset pagination
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or 'cursor' in params:
+                self._paginator = KeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -60,25 +86,56 @@ class TransactionViewSet(viewsets.ModelViewSet):
         if self.request.method in ['GET','POST', 'PATCH','DELETE']:
             return [IsAuthenticated()]
     
+    def get_renderers(self):
+        if self.is_flat_mode():
+            return [FastJSONRenderer()]
+        return super().get_renderers()
+
+    def is_flat_mode(self):
+        # ?mode=flat lists plain rows read with .values() and hoists the user to the envelope
+        return self.action == 'list' and self.request.query_params.get('mode') == 'flat'
+
     def get_queryset(self):
         user = self.request.user
         if user.is_staff:
-            return Transaction.objects.all()
+            return Transaction.objects.select_related('user')
         elif user.is_authenticated:
-            return Transaction.objects.filter(user=user)
+            return Transaction.objects.filter(user=user).select_related('user')
     
+    def get_totals(self, request, queryset):
+        # Calculate totals for the filtered data, from the monthly rollups when
+        # the active filters allow it
+        totals = totals_from_rollups(request.user, request.query_params)
+        if totals is None:
+            totals = queryset.aggregate(
+                total_income=Sum('amount', filter=Q(category='income')),
+                total_expenses=Sum('amount', filter=~Q(category='income')),
+                total_amount=Sum('amount'),
+                transaction_count=Count('id')
+            )
+        return {
+            'total_income': float(totals['total_income'] or 0),
+            'total_expenses': float(totals['total_expenses'] or 0),
+            'net_amount': float((totals['total_income'] or 0) - (totals['total_expenses'] or 0)),
+            'total_transactions': totals['transaction_count']
+        }
+
     def list(self, request, *args, **kwargs):
         # Get the filtered queryset (before pagination)
         queryset = self.filter_queryset(self.get_queryset())
-        
-        # Calculate totals for the filtered data
-        totals = queryset.aggregate(
-            total_income=Sum('amount', filter=Q(category='income')),
-            total_expenses=Sum('amount', filter=~Q(category='income')),
-            total_amount=Sum('amount'),
-            transaction_count=Count('id')
-        )
-        
+
+        if isinstance(self.paginator, KeysetPagination):
+            # A keyset page must not cost a full aggregate: totals only with
+            # ?total=, cached per filter set like the count
+            totals = None
+            if self.paginator.wants_total(request):
+                totals = self.paginator.cached(request, 'totals', lambda: self.get_totals(request, queryset))
+        else:
+            totals = self.get_totals(request, queryset)
+
+        if self.is_flat_mode():
+            return self.flat_list(queryset, totals)
+
         # Apply pagination
         page = self.paginate_queryset(queryset)
         if page is not None:
@@ -86,16 +143,25 @@ class TransactionViewSet(viewsets.ModelViewSet):
             response = self.get_paginated_response(serializer.data)
             
             # Add totals to the response
-            response.data['totals'] = {
-                'total_income': float(totals['total_income'] or 0),
-                'total_expenses': float(totals['total_expenses'] or 0),
-                'net_amount': float((totals['total_income'] or 0) - (totals['total_expenses'] or 0)),
-                'total_transactions': totals['transaction_count']
-            }
+            response.data['totals'] = totals
             return response
         
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
+
+    def flat_list(self, queryset, totals):
+        # Rows carry the user id only, each distinct user is serialized once in `users`
+        rows = self.paginate_queryset(queryset.values(*FLAT_LIST_FIELDS))
+        user_ids = {row['user'] for row in rows}
+        if user_ids <= {self.request.user.pk}:
+            users = [UserViewSerializer(self.request.user).data] if user_ids else []
+        else:
+            users = UserViewSerializer(User.objects.filter(pk__in=user_ids), many=True).data
+
+        response = self.get_paginated_response(rows)
+        response.data['users'] = {user['id']: user for user in users}
+        response.data['totals'] = totals
+        return response
     
     # Create a new transaction or multiple transactions
     # If a list of transactions is provided, it will create all of them
@@ -114,12 +180,339 @@ class TransactionViewSet(viewsets.ModelViewSet):
     # perform_create method is used to save the transaction with the user
     def perform_create(self, serializer):
         serializer.save()
-    
+
+    # Bulk import a CSV or OFX bank statement file
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_statement(self, request, *args, **kwargs):
+        statement = request.FILES.get('file')
+        if not statement:
+            return Response({"error": "No statement file provided."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Check file size limit (50MB)
+        if statement.size > 50 * 1024 * 1024:
+            return Response({"error": "Statement file size exceeds 50MB limit."}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_format = request.data.get('file_format') or detect_format(statement.name)
+        if file_format not in IMPORT_FORMATS:
+            return Response(
+                {"error": f"Unsupported statement format. Choose one of: {', '.join(IMPORT_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            batch_size = min(max(int(request.data.get('batch_size', 5000)), 100), 20000)
+        except ValueError:
+            return Response({"error": "Invalid batch_size parameter"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            result = import_transactions(
+                request.user, statement.file, file_format, batch_size=batch_size,
+                categorize=functools.partial(categorizer.categorize, request.user),
+            )
+        except StatementImportError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_201_CREATED)
+
+    # Likely categories of a description from the local classifier (core.categorizer),
+    # e.g. transactions/suggest-category/?description=Uber%20trip%20to%20office
+    @action(detail=False, methods=['get'], url_path='suggest-category')
+    def suggest_category(self, request, *args, **kwargs):
+        description = request.query_params.get('description', '').strip()[:255]
+        if not description:
+            return Response({"error": "description parameter is required"}, status=status.HTTP_400_BAD_REQUEST)
+        suggestions = categorizer.suggest(request.user, description)
+        confident = suggestions and suggestions[0][1] >= getattr(settings, 'CATEGORIZER_MIN_SCORE', 0.1)
+        return Response({
+            "category": suggestions[0][0] if confident else None,
+            "suggestions": [{"category": category, "score": round(score, 3)} for category, score in suggestions],
+        })
+
+    # Stream every filtered row as CSV or NDJSON without paging
+    # e.g. transactions/export/?export_format=ndjson&gzip=1&date_after=2024-01-01
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request, *args, **kwargs):
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {"error": f"Unsupported export format. Choose one of: {', '.join(EXPORT_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        use_gzip = request.query_params.get('gzip') in ('1', 'true')
+
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = queryset.values_list(*EXPORT_FIELDS).iterator(chunk_size=2000)
+
+        content_type, extension = EXPORT_FORMATS[export_format]
+        filename = f"transactions.{extension}"
+        if use_gzip:
+            content_type = 'application/gzip'
+            filename += '.gz'
+        response = StreamingHttpResponse(
+            export_stream(rows, export_format, gzip=use_gzip),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+def analysis_flight_key(user, year, month, fingerprint, model_name, prompt_version):
+    return 'analysis-' + analysis_cache.cache_key(user.pk, year, month, fingerprint, model_name, prompt_version)
+
+
+def receipt_flight_key(user, image_bytes):
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    return f'receipt-{user.pk}-{RECEIPT_MODEL}-{digest}'
+
+
+def receipt_transactions(user, image_bytes, budget=None, near=True):
+    """
+    Extracts the transaction list from a receipt image with Gemini, or takes it
+    from the receipt cache when the user uploaded the same receipt before
+
+    Args:
+        budget (callable, optional): Called before Gemini is, e.g.
+                                     receipt_batch.take_budget for batch uploads
+        near (bool): Whether a near match of the cache may be served (a
+                     receipt_cache.NearMatch), see receipt_cache_near()
+    """
+    api_key = settings.GEMINI_API_KEY
+    image = receipt_images.prepare(image_bytes)
+    cached = receipt_cache.get(user, image, near=near)
+    if cached is not None:
+        return cached
+    if budget is not None:
+        budget()
+
+    def extract():
+        transactions_data = image_to_transaction(image_bytes, api_key, prepared=image)
+        receipt_cache.put(user, image, transactions_data)
+        return transactions_data
+
+    # Byte-identical uploads in flight at the same time share one Gemini call
+    return singleflight.do(receipt_flight_key(user, image_bytes), extract, shareable=bool)
+
+
+def receipt_transaction(user, transaction_data):
+    """Builds an unsaved Transaction from one extracted receipt line, None if it is unusable"""
+    try:
+        # Ensure required fields have values
+        description = transaction_data.get('description', 'Unknown transaction')
+        amount = transaction_data.get('amount', 0)
+        date = transaction_data.get('date', dt.today())
+        category = transaction_data.get('category', 'miscellaneous')
+        
+        
+        # Create Transaction instance without saving to database
+        return Transaction(
+            user=user,
+            description=description,
+            amount=amount,
+            date=date,
+            category=category,
+        )
+    except Exception as e:
+        # Log the error but continue with other transactions
+        print(f"Error creating transaction: {e}")
+        return None
+
+
+def receipt_cache_near(request):
+    """
+    ?cache=exact only serves byte-identical receipts from the cache, so a
+    response flagged `near_match` can be read again by Gemini
+    """
+    return request.GET.get('cache') != 'exact'
+
+
+def receipt_response_data(user, transactions_data):
+    """Builds unsaved Transactions from extracted receipt data and serializes them"""
+    transactions = []
+    for transaction_data in transactions_data:
+        transaction = receipt_transaction(user, transaction_data)
+        if transaction is not None:
+            transactions.append(transaction)
+
+    # Serialize the transactions for JSON response
+    serializer = TransactionViewSerializer(transactions, many=True)
+    return {
+        "success": True,
+        "message": f"Extracted {len(transactions)} transactions from image",
+        "near_match": isinstance(transactions_data, receipt_cache.NearMatch),
+        "transactions": serializer.data
+    }
+
+
+def receipt_stream_format(request):
+    """?stream_format=ndjson|sse, by default SSE when the client accepts text/event-stream"""
+    stream_format = request.GET.get('stream_format')
+    if stream_format is None:
+        stream_format = 'sse' if 'text/event-stream' in request.headers.get('Accept', '') else 'ndjson'
+    return stream_format
+
+
+def receipt_event_stream(user, transactions_data, stream_format, near_match=False):
+    """
+    Serializes each extracted transaction as one event as soon as it arrives,
+    then a "done" event. The headers are sent by then, so a failure midway is
+    reported as a final "error" event.
+    """
+    count = 0
+    try:
+        for transaction_data in transactions_data:
+            transaction = receipt_transaction(user, transaction_data)
+            if transaction is None:
+                continue
+            count += 1
+            yield stream_event('transaction', TransactionViewSerializer(transaction).data, stream_format)
+    except Exception as e:
+        yield stream_event('error', {"error": str(e)}, stream_format)
+        return
+    yield stream_event('done', {
+        "success": True,
+        "message": f"Extracted {count} transactions from image",
+        "near_match": near_match,
+    }, stream_format)
+
+
+def receipt_stream_response(events, stream_format):
+    response = StreamingHttpResponse(events, content_type=STREAM_FORMATS[stream_format])
+    response['Cache-Control'] = 'no-cache'
+    # Keep nginx from buffering the events
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def receipt_batch_event(user, index, image, transactions_data, error, stream_format):
+    """
+    One "receipt" event with a batch receipt's transactions, or a
+    "receipt_error" event when it failed. `index` is its position in the upload.
+    """
+    if error is None and not transactions_data:
+        error = "Failed to extract transactions from image."
+    if error is not None:
+        data = {"index": index, "name": image.name, "error": str(error)}
+        if isinstance(error, receipt_batch.RateBudgetExceeded):
+            data["retry_after"] = math.ceil(error.retry_after)
+        return stream_event('receipt_error', data, stream_format)
+    transactions = [receipt_transaction(user, transaction_data) for transaction_data in transactions_data]
+    transactions = [transaction for transaction in transactions if transaction is not None]
+    return stream_event('receipt', {
+        "index": index,
+        "name": image.name,
+        "near_match": isinstance(transactions_data, receipt_cache.NearMatch),
+        "transactions": TransactionViewSerializer(transactions, many=True).data,
+    }, stream_format)
+
+
+def receipt_batch_done(total, failed, stream_format):
+    return stream_event('done', {
+        "success": True,
+        "receipts": total - failed,
+        "failed": failed,
+        "message": f"Extracted transactions from {total - failed} of {total} receipts",
+    }, stream_format)
+
+
+def receipt_batch_event_stream(user, images, stream_format, near=True):
+    """Reads a batch upload's receipts concurrently and yields an event per receipt as each one finishes"""
+    failed = 0
+    extract = functools.partial(receipt_transactions, near=near)
+    for index, image, transactions_data, error in receipt_batch.run_batch(user, images, extract):
+        failed += error is not None or not transactions_data
+        yield receipt_batch_event(user, index, image, transactions_data, error, stream_format)
+    yield receipt_batch_done(len(images), failed, stream_format)
+
+
+def month_analysis(user, year, month):
+    """
+    The analysis of a user's month, from the cache or Gemini.
+
+    Shared by AnalysisView and the background job queue (core.jobs).
+
+    Returns:
+        dict: Analysis with `cached` and `cache_age_seconds` metadata and the
+        month's `anomalies` (core.anomalies), or an `error` key when Gemini failed
+    """
+    current_month_transactions_qs = user.transactions.filter(
+        **period_filter(*month_range(year, month))
+    )
+
+    previous_month_transactions_qs = user.transactions.filter(
+        **period_filter(*month_range(*previous_month(year, month)))
+    )
+
+    # Convert to list of dictionaries for the analysis
+    current_transactions = list(current_month_transactions_qs.values(
+        'date', 'description', 'amount', 'category', 'is_recurring'
+    ))
+    previous_transactions = list(previous_month_transactions_qs.values(
+        'date', 'description', 'amount', 'category', 'is_recurring'
+    ))
+
+    # Parse Date into string format
+    for transaction in current_transactions + previous_transactions:
+        transaction['date'] = transaction['date'].strftime('%Y-%m-%d')
+
+    # Serve a stored analysis while neither month's transactions have changed
+    fingerprint = analysis_cache.transactions_fingerprint(current_transactions, previous_transactions)
+    cache_args = (user, year, month, fingerprint, ANALYSIS_MODEL, ANALYSIS_PROMPT_VERSION)
+    cached = analysis_cache.get(*cache_args)
+    if cached is not None:
+        analysis_result, age = cached
+        return {
+            **analysis_result,
+            'anomalies': anomalies.month_anomalies(user, year, month),
+            'cached': True,
+            'cache_age_seconds': age,
+        }
+
+    api_key = settings.GEMINI_API_KEY
+
+    def analyse():
+        analysis_result = transaction_analysis(
+            api_key, current_transactions, previous_transactions, period=f"{year}-{month:02d}"
+        )
+        if 'error' not in analysis_result:
+            analysis_cache.put(*cache_args, analysis_result)
+        return analysis_result
+
+    # Identical requests in flight at the same time (two tabs, retries) share one Gemini call
+    analysis_result = singleflight.do(
+        analysis_flight_key(*cache_args), analyse, shareable=lambda result: 'error' not in result
+    )
+    return {
+        **analysis_result,
+        'anomalies': anomalies.month_anomalies(user, year, month),
+        'cached': False,
+        'cache_age_seconds': 0,
+    }
+
+
+def month_pdf(user, year, month):
+    """
+    The PDF statement of a user's month, stored or rendered (core.statements).
+
+    Shared by TransactionPDFView and the background job queue (core.jobs).
+
+    Returns:
+        bytes or None: The PDF, None when the month has no transactions
+    """
+    return statements.statement(user, year, month)
+
+
 class ImageToTransactionViewSet(viewsets.ModelViewSet):
-    queryset = TransactionImage.objects.all()
+    # Listing and deleting act on the user's cached receipts (core.receipt_cache)
+    http_method_names = ['get', 'post', 'delete']
     serializer_class = TransactionImageSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_staff:
+            return TransactionImage.objects.order_by('-last_used_at')
+        return TransactionImage.objects.filter(user=user).order_by('-last_used_at')
+
+    def perform_destroy(self, instance):
+        receipt_cache.delete([instance])
+
     def create(self, request, *args, **kwargs):
         image_file = request.FILES.get('image')
         if not image_file:
@@ -128,47 +521,96 @@ class ImageToTransactionViewSet(viewsets.ModelViewSet):
         # Check file size limit (5MB)
         if image_file.size > 5 * 1024 * 1024:
             return Response({"error": "Image file size exceeds 5MB limit."}, status=status.HTTP_400_BAD_REQUEST)
-        api_key = settings.GEMINI_API_KEY
         try:
             image_bytes = image_file.read()
-            transactions_data = image_to_transaction(image_bytes, api_key)
+            transactions_data = receipt_transactions(request.user, image_bytes, near=receipt_cache_near(request))
+        except LLMUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         if not transactions_data:
             return Response({"error": "Failed to extract transactions from image."}, status=status.HTTP_400_BAD_REQUEST)
         
 
-        transactions = []
-        for transaction_data in transactions_data:
-            try:
-                # Ensure required fields have values
-                description = transaction_data.get('description', 'Unknown transaction')
-                amount = transaction_data.get('amount', 0)
-                date = transaction_data.get('date', dt.today())
-                category = transaction_data.get('category', 'miscellaneous')
-                
-                
-                # Create Transaction instance without saving to database
-                transaction = Transaction(
-                    user=request.user,
-                    description=description,
-                    amount=amount,
-                    date=date,
-                    category=category,
+        return Response(
+            receipt_response_data(request.user, transactions_data),
+            status=status.HTTP_200_OK
+        )
+
+    def perform_content_negotiation(self, request, force=False):
+        # The stream actions answer text/event-stream themselves, no renderer involved
+        return super().perform_content_negotiation(request, force=force or self.action in ('stream', 'batch'))
+
+    # Stream the transactions as NDJSON or server-sent events, each one as soon
+    # as the model has written it, e.g. image-to-trasaction/stream/?stream_format=sse
+    @action(detail=False, methods=['post'], url_path='stream')
+    def stream(self, request, *args, **kwargs):
+        stream_format = receipt_stream_format(request)
+        if stream_format not in STREAM_FORMATS:
+            return Response(
+                {"error": f"Unsupported stream format. Choose one of: {', '.join(STREAM_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        image_file = request.FILES.get('image')
+        if not image_file:
+            return Response({"error": "No image file provided."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Check file size limit (5MB)
+        if image_file.size > 5 * 1024 * 1024:
+            return Response({"error": "Image file size exceeds 5MB limit."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            image_bytes = image_file.read()
+            image = receipt_images.prepare(image_bytes)
+            cached = receipt_cache.get(request.user, image, near=receipt_cache_near(request))
+            if cached is not None:
+                transactions_data = iter(cached)
+            else:
+                transactions_data = receipt_cache.storing(
+                    request.user, image,
+                    stream_image_to_transaction(image_bytes, settings.GEMINI_API_KEY, prepared=image),
                 )
-                transactions.append(transaction)
-            except Exception as e:
-                # Log the error but continue with other transactions
-                print(f"Error creating transaction: {e}")
-                continue
+            # Wait for the first transaction, so a failing call still gets a proper status code
+            first = next(transactions_data, None)
+        except LLMUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if first is None:
+            return Response({"error": "Failed to extract transactions from image."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Serialize the transactions for JSON response
-        serializer = TransactionViewSerializer(transactions, many=True)
-        return Response({
-            "success": True,
-            "message": f"Extracted {len(transactions)} transactions from image",
-            "transactions": serializer.data
-        }, status=status.HTTP_200_OK)
+        return receipt_stream_response(
+            receipt_event_stream(
+                request.user, itertools.chain([first], transactions_data), stream_format,
+                near_match=isinstance(cached, receipt_cache.NearMatch),
+            ),
+            stream_format,
+        )
+
+    # Many receipts in one request: several `images` files, each an image or a
+    # zip of images. An event per receipt is streamed as soon as it is read
+    # (NDJSON or SSE like the stream action), a failed one does not stop the rest
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch(self, request, *args, **kwargs):
+        stream_format = receipt_stream_format(request)
+        if stream_format not in STREAM_FORMATS:
+            return Response(
+                {"error": f"Unsupported stream format. Choose one of: {', '.join(STREAM_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        uploads = request.FILES.getlist('images')
+        if not uploads:
+            return Response({"error": "No image files provided."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            images = receipt_batch.collect_images(uploads)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not images:
+            return Response({"error": "No images found in the upload."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return receipt_stream_response(
+            receipt_batch_event_stream(request.user, images, stream_format, near=receipt_cache_near(request)),
+            stream_format
+        )
     
 
 class AnalysisView(APIView):
@@ -176,41 +618,89 @@ class AnalysisView(APIView):
 
     def get(self, request, *args, **kwargs):
         # Get month and year from query parameters, default to current month/year if not provided
-        month = int(request.GET.get('month', dt.today().month))
-        year = int(request.GET.get('year', dt.today().year))
-
-        current_month_transactions_qs = request.user.transactions.filter(
-            date__year=year,
-            date__month=month
-        )
-
-        previous_month_transactions_qs = request.user.transactions.filter(
-            date__year=year if month > 1 else year - 1,
-            date__month=month - 1 if month > 1 else 12,
-        )
+        try:
+            month = int(request.GET.get('month', dt.today().month))
+            year = int(request.GET.get('year', dt.today().year))
+            month_range(year, month)  # rejects an invalid month
+        except ValueError:
+            return Response({"error": "Invalid month or year parameter"}, status=status.HTTP_400_BAD_REQUEST)
 
-        
-        
-        # Convert to list of dictionaries for the analysis
-        current_transactions = list(current_month_transactions_qs.values(
-            'date', 'description', 'amount', 'category', 'is_recurring'
-        ))
-        previous_transactions = list(previous_month_transactions_qs.values(
-            'date', 'description', 'amount', 'category', 'is_recurring'
-        ))  
-
-        # Parse Date into string format
-        for transaction in current_transactions + previous_transactions:
-            transaction['date'] = transaction['date'].strftime('%Y-%m-%d')
-        
-        api_key = settings.GEMINI_API_KEY
-        
         try:
-            analysis_result = transaction_analysis(api_key, current_transactions, previous_transactions)
-            # Add metadata to the response
-            return Response(analysis_result, status=status.HTTP_200_OK)
+            analysis_result = month_analysis(request.user, year, month)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(analysis_result, status=status.HTTP_200_OK)
+
+
+
+class TrendsView(APIView):
+    """
+    Per-category totals over a range of months as columnar series for charts
+    (core.trends). ?start=YYYY-MM&end=YYYY-MM (end defaults to this month, start
+    to TRENDS_DEFAULT_MONTHS before it), ?granularity=month|week|quarter and
+    ?category=food,transport.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            end = self.month_param(request, 'end') or (dt.today().year, dt.today().month)
+            start = self.month_param(request, 'start')
+        except ValueError:
+            return Response({"error": "Invalid start or end parameter, expected YYYY-MM"}, status=status.HTTP_400_BAD_REQUEST)
+        default_months = getattr(settings, 'TRENDS_DEFAULT_MONTHS', 12)
+        max_months = getattr(settings, 'TRENDS_MAX_MONTHS', 120)
+        start = start or trends.from_month_number(trends.month_number(*end) - default_months + 1)
+        months = trends.month_number(*end) - trends.month_number(*start) + 1
+        if months < 1:
+            return Response({"error": "start must not be after end"}, status=status.HTTP_400_BAD_REQUEST)
+        if months > max_months:
+            return Response({"error": f"At most {max_months} months per request"}, status=status.HTTP_400_BAD_REQUEST)
+
+        categories = [category for category in request.GET.get('category', '').split(',') if category]
+        try:
+            result = trends.trends(
+                request.user, start, end, request.GET.get('granularity', 'month'), categories or None
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_200_OK)
+
+    @staticmethod
+    def month_param(request, name):
+        value = request.GET.get(name)
+        if not value:
+            return None
+        parsed = datetime.strptime(value, '%Y-%m')
+        return parsed.year, parsed.month
+
+
+class ForecastView(APIView):
+    """
+    Month-end spending forecast per category (core.forecast), computed locally
+    from the user's past months and recurring series. ?date=YYYY-MM-DD forecasts
+    as of another day, defaults to today.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            today = dt.fromisoformat(request.GET['date']) if 'date' in request.GET else dt.today()
+        except ValueError:
+            return Response({"error": "Invalid date parameter, expected YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(forecast.forecast(request.user, today), status=status.HTTP_200_OK)
+
+
+class LLMParseStatsView(APIView):
+    """Parsed and unusable Gemini answers per task since the last reset"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(structured_output.parse_stats(), status=status.HTTP_200_OK)
+
+    def delete(self, request, *args, **kwargs):
+        structured_output.reset_stats()
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 
@@ -227,37 +717,33 @@ def user_update(request):
 
 
 class TransactionPDFView(APIView):
+    """
+    A month's PDF statement (?year&month, stored by core.statements), or a
+    statement of any range streamed as it is rendered: ?year&quarter,
+    ?year&period=year or ?start=YYYY-MM-DD&end=YYYY-MM-DD (end inclusive).
+    """
     permission_classes = [IsAuthenticated]
 
+    RANGE_PARAMS = ('start', 'end', 'quarter', 'period')
+
     def get(self, request, *args, **kwargs):
+        if any(param in request.GET for param in self.RANGE_PARAMS):
+            return self.range_statement(request)
         try:
             # Get month and year from query parameters, default to current month/year if not provided
             month = int(request.GET.get('month', dt.today().month))
             year = int(request.GET.get('year', dt.today().year))
 
-            transactions_qs = request.user.transactions.filter(
-                date__year=year,
-                date__month=month
-            ).order_by('date')
-
-            transactions = list(transactions_qs.values(
-                'date', 'description', 'amount', 'category'
-            ))
+            # Create PDF
+            pdf_data = month_pdf(request.user, year, month)
 
             # Check if transactions exist
-            if not transactions:
+            if pdf_data is None:
                 return Response(
                     {"error": f"No transactions found for {year}-{month:02d}"}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
 
-            # Parse Date into string format
-            for transaction in transactions:
-                transaction['date'] = transaction['date'].strftime('%Y-%m-%d')
-
-            # Create PDF
-            pdf_data = create_transaction_pdf(transactions)
-
             # Verify PDF data
             if not pdf_data or not isinstance(pdf_data, bytes):
                 return Response(
@@ -280,4 +766,130 @@ class TransactionPDFView(APIView):
             return Response(
                 {"error": f"Failed to generate PDF: {str(e)}"}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+            )
+
+
+    def range_statement(self, request):
+        try:
+            if 'start' in request.GET or 'end' in request.GET:
+                start = dt.fromisoformat(request.GET['start'])
+                end = dt.fromisoformat(request.GET['end']) + timedelta(days=1)
+            elif 'quarter' in request.GET:
+                start, end = quarter_range(int(request.GET.get('year', dt.today().year)), int(request.GET['quarter']))
+            elif request.GET['period'] == 'year':
+                start, end = year_range(int(request.GET.get('year', dt.today().year)))
+            else:
+                raise ValueError(request.GET['period'])
+        except (KeyError, ValueError):
+            return Response(
+                {"error": "Invalid range, use year and quarter, period=year, or start and end (YYYY-MM-DD)"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if start >= end:
+            return Response({"error": "start must not be after end"}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = statements.statement_rows(request.user, start, end)
+        last_day = end - timedelta(days=1)
+        if rows is None:
+            return Response(
+                {"error": f"No transactions found from {start} to {last_day}"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        # Rendered page by page while it is sent, memory stays bounded for any range
+        response = StreamingHttpResponse(statement_chunks(rows), content_type='application/pdf')
+        response['Content-Disposition'] = f'attachment; filename="transactions_{start}_{last_day}.pdf"'
+        return response
+
+
+class JobViewSet(mixins.CreateModelMixin,
+                 mixins.RetrieveModelMixin,
+                 mixins.ListModelMixin,
+                 viewsets.GenericViewSet):
+    """
+    Background jobs for the slow endpoints: submit with POST, then poll
+    GET /api/jobs/<id>/ until `status` is succeeded (result included) or dead.
+    Jobs are run by the run_jobworker management command.
+    """
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = DefaultPagination
+
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        serializer = JobCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        if data['kind'] == Job.KIND_RECEIPT:
+            job = jobs.submit(request.user, data['kind'], input_file=data['image'], priority=data['priority'])
+        elif data['kind'] in (Job.KIND_RECURRING, Job.KIND_CATEGORIZER):
+            job = jobs.submit(request.user, data['kind'], priority=data['priority'])
+        else:
+            payload = {'year': data['year'], 'month': data['month']}
+            job = jobs.submit(request.user, data['kind'], payload=payload, priority=data['priority'])
+
+        response = Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+        response['Location'] = f'/api/jobs/{job.pk}/'
+        return response
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Serves the file produced by a succeeded job, e.g. the PDF statement"""
+        job = self.get_object()
+        if job.status != Job.STATUS_SUCCEEDED or not job.result_file:
+            return Response({"error": "This job has no file to download."}, status=status.HTTP_404_NOT_FOUND)
+        filename = (job.result or {}).get('filename') or job.result_file.name.rsplit('/', 1)[-1]
+        return FileResponse(job.result_file.open('rb'), as_attachment=True, filename=filename)
+
+    @action(detail=True, methods=['post'])
+    def retry(self, request, pk=None):
+        """Puts a dead job back in the queue"""
+        job = self.get_object()
+        if not jobs.retry(job):
+            return Response({"error": "Only dead jobs can be retried."}, status=status.HTTP_400_BAD_REQUEST)
+        job.refresh_from_db()
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class RecurringSeriesViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    The user's recurring transactions (subscriptions, rent, salary) with their
+    next expected date and amount, detected by core.recurring, soonest first.
+    Filter with ?period=weekly|monthly|yearly and ?active=true|false.
+    """
+    serializer_class = RecurringSeriesSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = DefaultPagination
+
+    def get_queryset(self):
+        queryset = RecurringSeries.objects.filter(user=self.request.user)
+        period = self.request.query_params.get('period')
+        if period:
+            queryset = queryset.filter(period=period)
+        active = self.request.query_params.get('active')
+        if active is not None:
+            queryset = queryset.filter(active=active.lower() in ('1', 'true', 'yes'))
+        return queryset
+
+    @action(detail=False, methods=['post'])
+    def detect(self, request, *args, **kwargs):
+        """Re-detects the user's series right away instead of waiting for the background job"""
+        recurring.detect_user(request.user.pk)
+        return self.list(request, *args, **kwargs)
+
+
+class AnomalyViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    The user's unusual transactions and months, found by core.anomalies, most
+    unusual first. Filter with ?year, ?month, ?kind=transaction|month and ?category.
+    """
+    serializer_class = AnomalySerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = DefaultPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = AnomalyFilters
+
+    def get_queryset(self):
+        return Anomaly.objects.filter(user=self.request.user).select_related('transaction')